@@ -1,17 +1,34 @@
+import collections
 import copy
+import heapq
+import itertools
+import math
 import os
 import logging
+import logging.handlers
 import pickle
 import psutil
+import queue
 import time
 import threading
 import typing
 
+from collections import defaultdict
 from enum import Enum
 from math import ceil
-from multiprocessing import Pool, Queue, Manager, current_process
+from multiprocessing import Process, Queue, Manager, current_process
 from threading import Timer
 
+from dsbox.controller.config import JobSetting
+from dsbox.JobManager import cancellation
+from dsbox.JobManager import executor
+from dsbox.JobManager import fold_budget
+from dsbox.JobManager import heartbeat
+from dsbox.JobManager import result_transport
+from dsbox.JobManager import shared_memory
+from dsbox.JobManager.admission import MemoryAdmissionController
+from dsbox.JobManager.zygote import WarmWorker
+
 _logger = logging.getLogger(__name__)
 # used to save all PID of workers created
 m = Manager()
@@ -22,6 +39,25 @@ class TimerResponse(Enum):
     STOP_WORKER_JOBS = 1
 
 
+class JobStatus(Enum):
+    '''
+    Outcome of a job, stored under JOB_STATUS in the kwargs bundle returned by pop_job
+    '''
+    DONE = 0
+    FAILED = 1
+    TIMEOUT = 2
+    CANCELLED = 3
+    # The worker died, stalled or was lost while running the job, which may succeed when run again
+    LOST = 4
+
+
+# Keys added by the job manager to the kwargs bundles. They are not passed to the target method.
+JOB_ID = 'job_id'
+JOB_STATUS = 'job_status'
+TIME_LIMIT = 'time_limit'
+_JOB_MANAGER_KEYS = (JOB_ID, JOB_STATUS, TIME_LIMIT)
+
+
 class WorkerQueueHandler(logging.handlers.QueueHandler):
     '''
     Adds process name to log records
@@ -42,6 +78,71 @@ class WorkerQueueHandler(logging.handlers.QueueHandler):
     #     print('enqueue:', record)
     #     return super().enqueue(record)
 
+
+class BatchingQueueHandler(WorkerQueueHandler):
+    '''
+    Sends the records of a worker in batches: when BATCH_SIZE records are buffered, on records of
+    level ERROR and above, every FLUSH_INTERVAL seconds and between jobs. Records below the given
+    level are dropped before they are formatted. Counts the records and the time spent on them.
+    '''
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, queue, level: int = logging.NOTSET):
+        super().__init__(queue)
+        # Not the level of the handler, so that dropped records are counted
+        self.threshold = level
+        self._buffer: typing.List[logging.LogRecord] = []
+        self.records = 0
+        self.dropped = 0
+        self.batches = 0
+        self.seconds = 0.0
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def handle(self, record):
+        if record.levelno < self.threshold:
+            self.dropped += 1
+            return False
+        return super().handle(record)
+
+    def emit(self, record):
+        start = time.perf_counter()
+        try:
+            self._buffer.append(self.prepare(record))
+            self.records += 1
+            if len(self._buffer) >= BatchingQueueHandler.BATCH_SIZE or record.levelno >= logging.ERROR:
+                self._send()
+        except Exception:
+            self.handleError(record)
+        self.seconds += time.perf_counter() - start
+
+    def _send(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            self.enqueue(batch)
+            self.batches += 1
+
+    def flush(self):
+        start = time.perf_counter()
+        self.acquire()
+        try:
+            self._send()
+        finally:
+            self.release()
+        self.seconds += time.perf_counter() - start
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(BatchingQueueHandler.FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def stats(self) -> typing.Dict[str, float]:
+        return {'records': self.records, 'dropped': self.dropped, 'batches': self.batches,
+                'seconds': self.seconds}
+
 class QueueWrapper:
     def __init__(self, name, queue):
         self.name = name
@@ -80,6 +181,33 @@ class QueueWrapper:
 
 
 class DistributedJobManager:
+    # Set by Controller.initialize before the workers are forked
+    job_setting: JobSetting = JobSetting()
+
+    # Seconds between two checks of the workers by the supervisor thread
+    SUPERVISE_INTERVAL = 1.0
+
+    # Seconds given to a terminated worker to exit before it is killed
+    TERMINATE_GRACE = 5.0
+
+    # Seconds between two checks by an idle worker whether it has been superseded
+    IDLE_CHECK_INTERVAL = 1.0
+
+    # A job is a straggler when it runs STRAGGLER_FACTOR times longer than the median of the
+    # recent runtimes of its family, and at least MIN_STRAGGLER_SECONDS
+    STRAGGLER_FACTOR = 3.0
+    MIN_STRAGGLER_SECONDS = 60.0
+    # Seconds without a heartbeat after which a remote worker is considered gone
+    REMOTE_WORKER_TIMEOUT = 60.0
+    # CPU seconds a worker has to use to count as making progress within its step. More than the
+    # heartbeat thread alone uses during job_setting.stall_timeout.
+    MIN_STALL_CPU_SECONDS = 1.0
+
+    # Runtimes needed in a family before its jobs can be stragglers
+    MIN_RUNTIME_SAMPLES = 5
+    # Number of recent runtimes kept per family
+    RUNTIME_HISTORY = 20
+
     def __init__(self, proc_num: int = 4, timer_response=TimerResponse.STOP_WORKER_JOBS):
 
         self.start_time = time.perf_counter()
@@ -96,13 +224,78 @@ class DistributedJobManager:
         self.argument_lock = self.manager.Lock()
         self.result_lock = self.manager.Lock()
 
+        # worker name -> {'pid', 'job_id', 'started'}, written by the workers
+        self.worker_status = self.manager.dict()
+        # job id -> True of the cancelled jobs, read by the workers
+        self.cancelled = self.manager.dict()
+        # Large values of the results are written here instead of going through result_queue
+        self.spool_dir = result_transport.make_spool()
+        # Workers of an older generation exit after their current job, or when idle
+        self.generation = self.manager.Value('i', 0)
+        # worker name -> logging statistics, see BatchingQueueHandler.stats
+        self.log_stats = self.manager.dict()
+        # worker name -> {'time', 'job_id', 'step', 'step_started'}, see heartbeat
+        self.heartbeats = self.manager.dict()
+        # CPUs of the search, those reserved for the workers, and worker name -> CPUs borrowed
+        # for parallel folds, see fold_budget
+        self.fold_budget = self.manager.dict(
+            cpus=self.job_setting.cpu if self.job_setting.parallel_folds else 0, reserved=proc_num)
+        self.fold_budget_lock = self.manager.Lock()
+
         # initialize
-        self.job_pool: Pool = None
+        self.workers: typing.List[typing.Union[Process, WarmWorker]] = []
+        # Replacing workers and checking them must not overlap
+        self._workers_lock = threading.RLock()
+        self._worker_args: typing.Tuple = None
+        # Runs the workers, see executor
+        self.backend: executor.ProcessBackend = None
+        # Adapts the job bundles sent to remote workers, e.g. replaces objects bound to this host
+        self.remote_bundle_function: typing.Optional[typing.Callable[[typing.Dict], typing.Dict]] = None
+        self._worker_counter = itertools.count()
+        self._supervisor: threading.Thread = None
+        self._stopping = threading.Event()
 
         self.timer: Timer = None
 
-        # status counter
-        self.ongoing_jobs: int = 0
+        # job id -> kwargs bundle of the jobs pushed but not popped yet
+        self._jobs: typing.Dict[int, typing.Dict] = {}
+        self._jobs_lock = threading.RLock()
+        # Notified whenever a job is pushed or popped, see wait_for_jobs
+        self._jobs_changed = threading.Condition(self._jobs_lock)
+        self._job_counter = itertools.count()
+        # job id -> time limit, resolved when the job is seen running
+        self._time_limits: typing.Dict[int, float] = {}
+        # job id -> priority of the jobs not sent to the workers yet
+        self._waiting: typing.Dict[int, float] = {}
+        # (-priority, job id), may contain stale entries of updated or dispatched jobs
+        self._waiting_heap: typing.List[typing.Tuple[float, int]] = []
+        # Priority of jobs pushed without one, higher first. Jobs of equal priority are
+        # dispatched in push order.
+        self.priority_function: typing.Optional[typing.Callable[[typing.Dict], float]] = None
+        # job id -> predicted memory of the jobs sent to the workers and not popped yet
+        self._dispatched: typing.Dict[int, int] = {}
+        # job id -> largest memory measured while the job runs
+        self._job_peaks: typing.Dict[int, int] = {}
+        # job id -> time after which the worker of a cancelled job is terminated
+        self._cancel_deadlines: typing.Dict[int, float] = {}
+        # job id -> time the job was first seen running
+        self._job_started: typing.Dict[int, float] = {}
+        # family -> recent runtimes of the jobs that succeeded
+        self._runtimes: typing.Dict[str, typing.Deque[float]] = defaultdict(
+            lambda: collections.deque(maxlen=DistributedJobManager.RUNTIME_HISTORY))
+        # job id -> time a second copy of the straggler job was sent to the workers
+        self._speculative: typing.Dict[int, float] = {}
+        # Jobs that were run again, speculatively or after their worker stalled
+        self._retried: typing.Set[int] = set()
+        # worker name -> (step started, CPU seconds, time) of the last progress seen by _is_stalled
+        self._progress: typing.Dict[str, typing.Tuple[float, float, float]] = {}
+        # Jobs of remote workers reported before the workers stopped them
+        self._abandoned: typing.Set[int] = set()
+        # Worker seconds without a job dispatched to the worker, see idle_worker_seconds
+        self._idle_seconds = 0.0
+        self._idle_checked = time.perf_counter()
+        self.admission = MemoryAdmissionController(
+            int(self.job_setting.ram_bytes * self.job_setting.admission_ram_fraction))
 
         # start the workers
         self._start_workers(DistributedJobManager._posted_job_wrapper)
@@ -116,20 +309,319 @@ class DistributedJobManager:
         self._timeout_sec = value
         self._setup_timeout_timer()
 
+    @property
+    def ongoing_jobs(self) -> int:
+        '''
+        Number of jobs pushed and not popped yet, queued or running
+        '''
+        return len(self._jobs)
+
     def _start_workers(self, target_method: typing.Callable):
+        # Segments left behind by workers of a previous run that was killed
+        shared_memory.cleanup_dead_segments()
+
         # Start logging listener
         lp = threading.Thread(target=DistributedJobManager._logger_thread, args=(self.log_queue,))
         lp.start()
 
-        self.job_pool = Pool(processes=self.proc_num)
-        self.job_pool.map_async(
-            func=DistributedJobManager._internal_worker_process,
-            iterable=[
-                (self.arguments_queue, self.result_queue, target_method,
-                 self.log_queue, DistributedJobManager._log_configurer)
-                for a in range(self.proc_num)]
-        )
-        self.job_pool.close()  # prevents any additional worker to be added to the pool
+        self._worker_args = (self.arguments_queue, self.result_queue, target_method,
+                             self.log_queue, DistributedJobManager._log_configurer,
+                             self.worker_status, self.cancelled, self.spool_dir, self.generation,
+                             self.log_stats, self.heartbeats, (self.fold_budget_lock, self.fold_budget))
+        self.backend = executor.create_backend(self, DistributedJobManager._internal_worker_process)
+        for _ in range(self.proc_num):
+            self.workers.append(self._spawn_worker())
+
+        # Replaces workers that exit or exceed the time limit of their job
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def _worker_max_rss_bytes(self) -> int:
+        if self.job_setting.worker_max_rss_bytes:
+            return self.job_setting.worker_max_rss_bytes
+        # Fair share of the memory
+        return self.job_setting.ram_bytes // self.proc_num
+
+    def _spawn_worker(self) -> typing.Union[Process, WarmWorker]:
+        recycle = (self.job_setting.worker_max_jobs, self._worker_max_rss_bytes(), self.generation.value)
+        return self.backend.spawn(f'Worker-{next(self._worker_counter)}', (recycle,))
+
+    @property
+    def capacity(self) -> int:
+        '''
+        Number of workers, local and remote
+        '''
+        return self.proc_num + len(self.backend.remote_workers())
+
+    def preload_primitives(self, python_paths: typing.Iterable[str]) -> None:
+        """
+        Imports the given primitives into the zygote. Workers are replaced by workers forked from
+        it, right away if idle, otherwise after their current job.
+        Args:
+            python_paths: python paths of primitives, e.g. of the templates of the search
+        """
+        if self.backend.preload(python_paths):
+            # Terminating idle workers could lose the job they are about to receive
+            self.generation.value += 1
+
+    def _supervise(self) -> None:
+        while not self._stopping.wait(DistributedJobManager.SUPERVISE_INTERVAL):
+            try:
+                with self._workers_lock:
+                    self._check_remote_workers()
+                    self._check_workers()
+                self._dispatch()
+            except Exception:
+                _logger.exception('Worker supervision failed')
+
+    def _check_workers(self) -> None:
+        '''
+        Replaces dead workers, workers whose job exceeded its time limit, workers whose job did
+        not stop within the grace period of its cancellation, and workers that stalled.
+        Their job is reported through the result queue, unless it is run again. With
+        job_setting.speculative_execution, straggler jobs are copied to an idle worker.
+        '''
+        running = set()
+        heartbeats = self.heartbeats.copy()
+        for slot, worker in enumerate(self.workers):
+            if self._stopping.is_set():
+                return
+            status = self.worker_status.get(worker.name, {})
+            job_id = status.get('job_id')
+            if not worker.is_alive():
+                if status.get('recycled'):
+                    _logger.info(f'{worker.name} recycled')
+                else:
+                    _logger.warning(f'{worker.name} exited with code {worker.exitcode}')
+                self._replace_worker(slot, job_id, JobStatus.LOST)
+                continue
+            if job_id is None:
+                continue
+            running.add(job_id)
+            if job_id in self._jobs:
+                self._job_started.setdefault(job_id, status['started'])
+            if job_id in self._cancel_deadlines:
+                if time.time() > self._cancel_deadlines[job_id]:
+                    _logger.warning(f'Job {job_id} did not stop after its cancellation, '
+                                    f'terminating {worker.name}')
+                    self._terminate_worker(worker)
+                    self._replace_worker(slot, job_id, JobStatus.CANCELLED)
+                continue
+            if self.admission.enabled:
+                # usage_monitor imports this module
+                from dsbox.JobManager.usage_monitor import UsageMonitor
+                memory = UsageMonitor.get_process_tree_memory(worker.pid)
+                self._job_peaks[job_id] = max(self._job_peaks.get(job_id, 0), memory)
+            time_limit = self._get_time_limit(job_id)
+            if time_limit and time.time() - status['started'] > time_limit:
+                _logger.warning(f'Job {job_id} exceeded its time limit of {time_limit:.0f}s, '
+                                f'terminating {worker.name}')
+                self._terminate_worker(worker)
+                self._replace_worker(slot, job_id, JobStatus.TIMEOUT)
+            elif self._is_stalled(worker, status, heartbeats.get(worker.name)):
+                beat = heartbeats.get(worker.name) or {}
+                _logger.warning(f'No progress from {worker.name} for {self.job_setting.stall_timeout:.0f}s, '
+                                f'job {job_id} at step {beat.get("step")}, terminating it')
+                self._terminate_worker(worker)
+                if self.job_setting.speculative_execution and self._requeue(job_id):
+                    _logger.info(f'Job {job_id} queued again')
+                    job_id = None
+                self._replace_worker(slot, job_id, JobStatus.LOST)
+            elif self.job_setting.speculative_execution and self._is_straggler(job_id):
+                self._speculate(job_id)
+
+        # Cancelled jobs that stopped, or never reached a worker
+        now = time.time()
+        for job_id, deadline in list(self._cancel_deadlines.items()):
+            if now > deadline and job_id not in running:
+                del self._cancel_deadlines[job_id]
+                self.cancelled.pop(job_id, None)
+
+    def _check_remote_workers(self) -> None:
+        '''
+        Drops the remote workers whose heartbeat stopped, and reports their job. Remote workers
+        cannot be terminated, so jobs exceeding their time limit or the grace period of their
+        cancellation are reported right away, and cancelled.
+        '''
+        heartbeats = self.heartbeats.copy()
+        for name, info in self.backend.remote_workers().items():
+            status = self.worker_status.get(name, {})
+            job_id = status.get('job_id')
+            beat = heartbeats.get(name)
+            last = beat['time'] if beat else info['registered']
+            if time.time() - last > DistributedJobManager.REMOTE_WORKER_TIMEOUT:
+                _logger.warning(f'Lost {name} on {info["host"]}')
+                self.backend.drop_remote_worker(name)
+                self.worker_status.pop(name, None)
+                self.heartbeats.pop(name, None)
+                if job_id is not None and not (self.job_setting.speculative_execution and self._requeue(job_id)):
+                    self._report_job(job_id, JobStatus.LOST)
+                continue
+            if job_id is None or job_id not in self._jobs or job_id in self._abandoned:
+                continue
+            if job_id in self._cancel_deadlines:
+                if time.time() > self._cancel_deadlines[job_id]:
+                    _logger.warning(f'Job {job_id} did not stop after its cancellation on {name}')
+                    self._abandoned.add(job_id)
+                    self._report_job(job_id, JobStatus.CANCELLED)
+                continue
+            self._job_started.setdefault(job_id, status['started'])
+            time_limit = self._get_time_limit(job_id)
+            if time_limit and time.time() - status['started'] > time_limit:
+                _logger.warning(f'Job {job_id} exceeded its time limit of {time_limit:.0f}s on {name}')
+                # Its worker stops at the next step boundary, the result is dropped
+                self.cancelled[job_id] = True
+                self._abandoned.add(job_id)
+                self._report_job(job_id, JobStatus.TIMEOUT)
+
+    def _is_stalled(self, worker: typing.Union[Process, WarmWorker], status: typing.Dict,
+                    beat: typing.Optional[typing.Dict]) -> bool:
+        '''
+        Whether the job of the worker made no progress for job_setting.stall_timeout: it stayed at
+        the same pipeline step, and its processes did not use CPU. The heartbeat alone cannot
+        tell, its thread keeps beating while a primitive waits in a deadlock that released the
+        interpreter lock, and stops beating while a long C call holds it.
+        '''
+        timeout = self.job_setting.stall_timeout
+        if not timeout:
+            return False
+        # The first heartbeat of a worker may not have arrived yet
+        step_started = beat.get('step_started', 0.0) if beat else 0.0
+        # usage_monitor imports this module
+        from dsbox.JobManager.usage_monitor import UsageMonitor
+        cpu = UsageMonitor.get_process_tree_cpu_time(worker.pid)
+        now = time.time()
+        progress = self._progress.get(worker.name)
+        # CPU time goes down when a child process exits
+        if (progress is None or progress[0] != step_started
+                or abs(cpu - progress[1]) >= DistributedJobManager.MIN_STALL_CPU_SECONDS):
+            progress = (step_started, cpu, now)
+            self._progress[worker.name] = progress
+        last = max(progress[2], step_started, status['started'])
+        return now - last > timeout
+
+    def _is_straggler(self, job_id: int) -> bool:
+        '''
+        Whether the job runs much longer than the recent jobs of its family
+        '''
+        if job_id in self._retried:
+            return False
+        with self._jobs_lock:
+            bundle = self._jobs.get(job_id)
+        if bundle is None:
+            return False
+        runtimes = self._runtimes.get(self.admission.family_of(bundle))
+        if not runtimes or len(runtimes) < DistributedJobManager.MIN_RUNTIME_SAMPLES:
+            return False
+        median = sorted(runtimes)[len(runtimes) // 2]
+        threshold = max(DistributedJobManager.MIN_STRAGGLER_SECONDS,
+                        DistributedJobManager.STRAGGLER_FACTOR * median)
+        return time.time() - self._job_started[job_id] > threshold
+
+    def _speculate(self, job_id: int) -> None:
+        '''
+        Sends a copy of a straggler job to an idle worker, if there is one and no job is waiting
+        for it. pop_job returns the first result and cancels the other copy.
+        '''
+        with self.argument_lock:
+            with self._jobs_lock:
+                if (job_id not in self._jobs or self._waiting or not self.arguments_queue.empty()
+                        or len(self._dispatched) + len(self._speculative) >= self.capacity):
+                    return
+                self._retried.add(job_id)
+                self._account_idle()
+                self._speculative[job_id] = time.time()
+                self.arguments_queue.put(self._jobs[job_id])
+        _logger.info(f'Job {job_id} is a straggler after {time.time() - self._job_started[job_id]:.0f}s, '
+                     f'running a copy of it')
+
+    def _requeue(self, job_id: int) -> bool:
+        '''
+        Puts a job whose worker was terminated back in front of the waiting jobs, once
+        '''
+        with self._jobs_lock:
+            if job_id not in self._jobs or job_id in self._retried:
+                return False
+            self._retried.add(job_id)
+            self._account_idle()
+            self._dispatched.pop(job_id, None)
+            self._time_limits.pop(job_id, None)
+            self._job_started.pop(job_id, None)
+            self._job_peaks.pop(job_id, None)
+            self._set_priority(job_id, math.inf)
+        return True
+
+    def _get_time_limit(self, job_id: int) -> typing.Optional[float]:
+        '''
+        Time limit of a running job: the one given to push_job, the configured job_time_limit, or
+        a fraction of the remaining search time when the job started.
+        '''
+        if job_id not in self._time_limits:
+            with self._jobs_lock:
+                bundle = self._jobs.get(job_id)
+            time_limit = bundle.get(TIME_LIMIT) if bundle else None
+            if not time_limit:
+                time_limit = self.job_setting.job_time_limit
+            if not time_limit and self.job_setting.job_time_limit_fraction and self._timeout_sec > 0:
+                remaining = self.start_time + self._timeout_sec - time.perf_counter()
+                time_limit = max(remaining * self.job_setting.job_time_limit_fraction,
+                                 self.job_setting.min_job_time_limit)
+            self._time_limits[job_id] = time_limit
+        return self._time_limits[job_id]
+
+    def _terminate_worker(self, worker: typing.Union[Process, WarmWorker]) -> None:
+        # Pipelines may run their own subprocesses
+        try:
+            for child in psutil.Process(worker.pid).children(recursive=True):
+                child.kill()
+        except psutil.Error:
+            pass
+        worker.terminate()
+        worker.join(DistributedJobManager.TERMINATE_GRACE)
+        if worker.is_alive():
+            os.kill(worker.pid, 9)
+            worker.join()
+
+    def _replace_worker(self, slot: int, job_id: typing.Optional[int], job_status: JobStatus) -> None:
+        worker = self.workers[slot]
+        self.worker_status.pop(worker.name, None)
+        self.heartbeats.pop(worker.name, None)
+        self._progress.pop(worker.name, None)
+        # CPUs borrowed by the worker for parallel folds
+        self.fold_budget.pop(worker.name, None)
+        try:
+            _current_work_pids.remove(worker.pid)
+        except ValueError:
+            pass
+        shared_memory.cleanup_dead_segments()
+
+        with self._jobs_lock:
+            copied = job_id is not None and job_id in self._speculative
+            if copied:
+                self._account_idle()
+                del self._speculative[job_id]
+        if copied:
+            # The other copy of the job still runs
+            _logger.info(f'Dropping the copy of job {job_id} run by {worker.name}')
+            job_id = None
+        if job_id is not None:
+            self._report_job(job_id, job_status)
+
+        if not self._stopping.is_set():
+            self.workers[slot] = self._spawn_worker()
+            _logger.info(f'{self.workers[slot].name} replaces {worker.name}')
+
+    def _report_job(self, job_id: typing.Optional[int], job_status: JobStatus = JobStatus.FAILED) -> None:
+        '''
+        Returns a job that did not produce a result through the result queue
+        '''
+        with self._jobs_lock:
+            bundle = self._jobs.get(job_id)
+        if bundle is not None:
+            report = dict(bundle)
+            report[JOB_STATUS] = job_status
+            report[TIME_LIMIT] = self._time_limits.get(job_id)
+            self.result_queue.put((report, None))
 
     @staticmethod
     def _posted_job_wrapper(target_obj: typing.Any, target_method: str,
@@ -142,16 +634,15 @@ class DistributedJobManager:
         return result
 
     @staticmethod
-    def _log_configurer(log_queue: Queue):
+    def _log_configurer(log_queue: Queue) -> BatchingQueueHandler:
         '''
         Configure logging handlers for a worker
         '''
-        h = WorkerQueueHandler(log_queue)
+        # Records below the levels of the handlers of the main process would be discarded there
+        h = BatchingQueueHandler(log_queue, level=DistributedJobManager.job_setting.log_level)
         root = logging.getLogger()
         root.addHandler(h)
-
-        # TODO: Now, sending all messages. Should set level based on logging level.
-        # root.setLevel(logging.DEBUG)
+        return h
 
     @staticmethod
     def _logger_thread(q: Queue):
@@ -159,21 +650,39 @@ class DistributedJobManager:
         Thread on main process to wait for logging events
         '''
         while True:
-            record = q.get()
+            records = q.get()
             # print('log record:', record)
-            if record is None:
+            if records is None:
                 break
-            logger = logging.getLogger(record.name)
-            logger.handle(record)
+            if not isinstance(records, list):
+                records = [records]
+            for record in records:
+                logger = logging.getLogger(record.name)
+                logger.handle(record)
+
+    def log_cost(self) -> typing.Dict[str, float]:
+        '''
+        Logging statistics summed over the workers, with the seconds spent on logging per job
+        '''
+        total: typing.Dict[str, float] = defaultdict(float)
+        for stats in self.log_stats.values():
+            for key, value in stats.items():
+                total[key] += value
+        total['seconds_per_job'] = total['seconds'] / total['jobs'] if total['jobs'] else 0.0
+        return dict(total)
 
     @staticmethod
     def _internal_worker_process(args: typing.Tuple[Queue, Queue, Queue, typing.Callable]) -> None:
         """
         The worker process iteratively checks the arguments_queue. It runs the target method with
         the arguments from top of arguments_queue. The worker finally pushes the results to the
-        results queue for main process to read from it.
+        results queue for main process to read from it. Large values of the results are written
+        into spool_dir, see result_transport.
         Args:
-            args: typing.Tuple[Queue, Queue, typing.Callable]
+            args: typing.Tuple[Queue, Queue, typing.Callable, Queue, typing.Callable, typing.Dict,
+                               typing.Dict, str, typing.Any, typing.Dict, typing.Dict,
+                               typing.Optional[typing.Tuple[typing.Any, typing.Dict]],
+                               typing.Tuple[int, int, int]]
 
         """
         arguments_queue: Queue = args[0]
@@ -181,9 +690,21 @@ class DistributedJobManager:
         target: typing.Callable = args[2]
         log_queue: Queue = args[3]
         log_configurer: typing.Callable = args[4]
+        worker_status: typing.Dict = args[5]
+        cancelled: typing.Dict = args[6]
+        spool_dir: str = args[7]
+        generation = args[8]
+        log_stats: typing.Dict = args[9]
+        heartbeats: typing.Dict = args[10]
+        budget = args[11]
+        max_jobs, max_rss_bytes, worker_generation = args[12]
+        name = current_process().name
 
         # Configure logging
-        log_configurer(log_queue)
+        log_handler = log_configurer(log_queue)
+        cancellation.install(cancelled)
+        heartbeat.install(heartbeats, name)
+        fold_budget.install(budget)
 
         # _logger.debug("worker process started {}".format(current_process().name))
         # print(f"[INFO] {current_process().name} > worker process started")
@@ -198,35 +719,53 @@ class DistributedJobManager:
                 # wait until a new job is available
                 # print(f"[INFO] {current_process().name} > waiting on new jobs")
                 _logger.info("waiting on new jobs")
-                kwargs = arguments_queue.get(block=True)
+                kwargs = DistributedJobManager._next_job(arguments_queue, generation, worker_generation)
+                if kwargs is None:
+                    _logger.info('Superseded by a newer generation of workers')
+                    worker_status[name] = {'pid': os.getpid(), 'job_id': None, 'recycled': True}
+                    break
                 _logger.info("copying")
                 kwargs_copy = copy.copy(kwargs)
+                job_id = kwargs.get(JOB_ID)
+                # the supervisor enforces the time limit of the job
+                worker_status[name] = {'pid': os.getpid(), 'job_id': job_id, 'started': time.time()}
+                heartbeat.start_job(job_id)
                 # execute the job
-                try:
-                    # TODO add timelimit to single work in the worker
-                    # print(f"[INFO] {current_process().name} > executing job")
-                    result = target(**kwargs)
-                    # assert hasattr(result['fitted_pipeline'], 'runtime'), \
-                    #     '[DJM] Eval does not have runtime'
-                except:
-                    _logger.exception(
-                        f'Target evaluation failed {hash(str(kwargs))}', exc_info=True)
-                    # print(f'[INFO] {current_process().name} > Target evaluation failed {hash(str(kwargs))}')
-                    # traceback.print_exc()
-                    # _logger.error(traceback.format_exc())
+                result = None
+                if not cancellation.start_job(job_id):
+                    _logger.info(f'Job {job_id} cancelled before it started')
+                else:
+                    try:
+                        # print(f"[INFO] {current_process().name} > executing job")
+                        result = target(**{key: value for key, value in kwargs.items()
+                                           if key not in _JOB_MANAGER_KEYS})
+                        # assert hasattr(result['fitted_pipeline'], 'runtime'), \
+                        #     '[DJM] Eval does not have runtime'
+                    except:
+                        if cancellation.is_cancelled():
+                            _logger.info(f'Job {job_id} cancelled')
+                        else:
+                            _logger.exception(
+                                f'Target evaluation failed {job_id}', exc_info=True)
+                        # print(f'[INFO] {current_process().name} > Target evaluation failed {hash(str(kwargs))}')
+                        # traceback.print_exc()
+                        # _logger.error(traceback.format_exc())
+                        result = None
+                if cancellation.is_cancelled():
                     result = None
-
-                # push the results
-                if result is not None:
-                    result_simplified = result.copy()
-                    if "ensemble_tunning_result" in result:
-                        result_simplified.pop("ensemble_tunning_result")
+                    kwargs[JOB_STATUS] = JobStatus.CANCELLED
+                else:
+                    kwargs[JOB_STATUS] = JobStatus.FAILED if result is None else JobStatus.DONE
+                kwargs_copy[JOB_STATUS] = JobStatus.FAILED
+                cancellation.finish_job()
+                heartbeat.start_job(None)
 
                 _logger.info(f"Pushing Results: {result['id'] if result and 'id' in result else 'NONE'}")
-                _logger.debug(f"Pushing Results={result} kwargs={kwargs}")
+                # Only formatted if debug records are shipped
+                _logger.debug("Pushing Results=%s kwargs=%s", result, kwargs)
 
                 try:
-                    result_queue.put((kwargs, result))
+                    result_queue.put((kwargs, result_transport.offload(result, spool_dir)))
                 except BrokenPipeError:
                     _logger.exception(f"Result queue put failed. Broken Pipe.")
                     exit(1)
@@ -247,9 +786,18 @@ class DistributedJobManager:
                         exit(1)
 
                     # exit(1)
+                worker_status[name] = {'pid': os.getpid(), 'job_id': None}
                 counter += 1
                 # print(f"[INFO] {current_process().name} > is Idle, done {counter} jobs")
                 _logger.info(f"is Idle, done {counter} jobs")
+                log_handler.flush()
+                log_stats[name] = dict(log_handler.stats(), jobs=counter)
+                # Primitives leak memory (e.g. TensorFlow sessions), exit between jobs and let
+                # the supervisor start a fresh worker
+                if (generation.value > worker_generation
+                        or DistributedJobManager._should_recycle(counter, max_jobs, max_rss_bytes)):
+                    worker_status[name] = {'pid': os.getpid(), 'job_id': None, 'recycled': True}
+                    break
             except BrokenPipeError:
                 error_count += 1
                 print(f"{current_process().name:17} > Broken Pipe. Error count={error_count}")
@@ -260,18 +808,47 @@ class DistributedJobManager:
                 _logger.exception(f"Unexpected Exception. Error count={error_count}", exc_info=True)
         print(f"{current_process().name:17} > Worker EXITING")
         _logger.warning('Worker EXITING')
+        log_handler.flush()
 
 
-    def push_job(self, kwargs_bundle: typing.Dict = {}) -> int:
+    @staticmethod
+    def _next_job(arguments_queue: Queue, generation, worker_generation: int) -> typing.Optional[typing.Dict]:
+        '''
+        Waits for a job. Returns None once the worker has been superseded.
+        '''
+        while True:
+            try:
+                return arguments_queue.get(block=True, timeout=DistributedJobManager.IDLE_CHECK_INTERVAL)
+            except queue.Empty:
+                if generation.value > worker_generation:
+                    return None
+
+    @staticmethod
+    def _should_recycle(job_count: int, max_jobs: int, max_rss_bytes: int) -> bool:
+        if max_jobs and job_count >= max_jobs:
+            _logger.info(f'Recycling worker after {job_count} jobs')
+            return True
+        if max_rss_bytes:
+            rss = psutil.Process().memory_info().rss
+            if rss > max_rss_bytes:
+                _logger.info(f'Recycling worker after {job_count} jobs, '
+                             f'rss {rss/1024**2:.0f} MB > {max_rss_bytes/1024**2:.0f} MB')
+                return True
+        return False
+
+    def push_job(self, kwargs_bundle: typing.Dict = {}, *, time_limit: float = None,
+                 priority: float = None) -> int:
         """
-        The method creates a new process for the given job and returns the pid of the job
+        The method queues the given job for the workers and returns the id of the job
         Args:
-            target:
-            name:
             kwargs_bundle:
+            time_limit: seconds the job may run before its worker is terminated and the job is
+                returned with JobStatus.TIMEOUT. If None, derived from job_setting.
+            priority: the pending job with the highest priority is dispatched first. If None,
+                computed by priority_function.
 
         Returns: int
-            hash of the input argument
+            job id, also stored under JOB_ID in the kwargs bundle returned by pop_job
 
         """
         hint_message = "kwargs must be a dict with format: " \
@@ -283,12 +860,141 @@ class DistributedJobManager:
             l in kwargs_bundle for l in ['target_obj', 'target_method', 'kwargs']), hint_message
         assert isinstance(kwargs_bundle['kwargs'], dict), hint_message
 
-        with self.argument_lock:
-            self.ongoing_jobs += 1
-            self.arguments_queue.put(kwargs_bundle)
+        job_id = next(self._job_counter)
+        kwargs_bundle = dict(kwargs_bundle)
+        kwargs_bundle[JOB_ID] = job_id
+        kwargs_bundle[TIME_LIMIT] = time_limit
+        if priority is None:
+            priority = self.priority_function(kwargs_bundle) if self.priority_function else 0
+        with self._jobs_lock:
+            self._jobs[job_id] = kwargs_bundle
+            self._set_priority(job_id, priority)
+            self._jobs_changed.notify_all()
+        self._dispatch()
         # self.result_queue_size = None
 
-        return hash(str(kwargs_bundle))
+        return job_id
+
+    def cancel_jobs(self, job_ids: typing.Iterable[int] = None,
+                    predicate: typing.Callable[[typing.Dict], bool] = None, *,
+                    grace_period: float = None) -> typing.List[int]:
+        """
+        Cancels jobs pushed and not popped yet. Jobs waiting for a worker are returned by pop_job
+        right away with JobStatus.CANCELLED. Running jobs are asked to stop at their next step
+        boundary, and their worker is terminated if they have not stopped after grace_period
+        seconds. They are returned with JobStatus.CANCELLED as well, unless they finished first.
+        Args:
+            job_ids: ids returned by push_job. If None, all jobs.
+            predicate: if given, only the jobs whose kwargs bundle satisfies it are cancelled
+            grace_period: if None, job_setting.cancel_grace_period
+
+        Returns:
+            ids of the cancelled jobs
+        """
+        if grace_period is None:
+            grace_period = self.job_setting.cancel_grace_period
+        with self._jobs_lock:
+            candidates = list(self._jobs) if job_ids is None else job_ids
+            selected = [job_id for job_id in candidates
+                        if job_id in self._jobs and job_id not in self._cancel_deadlines
+                        and (predicate is None or predicate(self._jobs[job_id]))]
+            for job_id in selected:
+                if job_id in self._waiting:
+                    del self._waiting[job_id]
+                    report = dict(self._jobs[job_id])
+                    report[JOB_STATUS] = JobStatus.CANCELLED
+                    self.result_queue.put((report, None))
+                else:
+                    self.cancelled[job_id] = True
+                    self._cancel_deadlines[job_id] = time.time() + grace_period
+        if selected:
+            _logger.info(f'Cancelled {len(selected)} jobs')
+            self._signal_cancelled()
+        return selected
+
+    def _signal_cancelled(self) -> None:
+        '''
+        Interrupts the workers running a cancelled job. Workers that pick up a cancelled job later
+        see it in self.cancelled.
+        '''
+        remote = self.backend.remote_workers()
+        for name, status in self.worker_status.items():
+            if name in remote:
+                # See remote_worker, it watches self.cancelled itself
+                continue
+            if status.get('job_id') in self._cancel_deadlines:
+                try:
+                    os.kill(status['pid'], cancellation.CANCEL_SIGNAL)
+                except OSError:
+                    pass
+
+    def _set_priority(self, job_id: int, priority: float) -> None:
+        if math.isnan(priority):
+            # would never match its heap entry
+            priority = 0.0
+        self._waiting[job_id] = priority
+        heapq.heappush(self._waiting_heap, (-priority, job_id))
+
+    def _next_waiting(self) -> typing.Optional[int]:
+        '''
+        Returns the waiting job with the highest priority, dropping stale heap entries
+        '''
+        while self._waiting_heap:
+            priority, job_id = self._waiting_heap[0]
+            if self._waiting.get(job_id) == -priority:
+                return job_id
+            heapq.heappop(self._waiting_heap)
+        return None
+
+    def update_priority(self, job_id: int, priority: float) -> bool:
+        """
+        Changes the priority of a job that has not been dispatched yet
+        Returns:
+            False if the job is not waiting anymore
+        """
+        with self._jobs_lock:
+            if job_id not in self._waiting:
+                return False
+            self._set_priority(job_id, priority)
+        return True
+
+    def reprioritize(self) -> None:
+        """
+        Recomputes the priority of all waiting jobs with priority_function, e.g. after the
+        statistics it depends on changed
+        """
+        if self.priority_function is None:
+            return
+        with self._jobs_lock:
+            for job_id in self._waiting:
+                priority = self.priority_function(self._jobs[job_id])
+                self._waiting[job_id] = 0.0 if math.isnan(priority) else priority
+            self._waiting_heap = [(-priority, job_id) for job_id, priority in self._waiting.items()]
+            heapq.heapify(self._waiting_heap)
+
+    def _dispatch(self) -> None:
+        '''
+        Sends waiting jobs to the workers, at most one per worker, and only while the predicted
+        memory of the jobs in flight stays within the admission budget.
+        '''
+        with self.argument_lock:
+            with self._jobs_lock:
+                capacity = self.capacity
+                while self._waiting and len(self._dispatched) + len(self._speculative) < capacity:
+                    job_id = self._next_waiting()
+                    kwargs_bundle = self._jobs[job_id]
+                    estimate = self.admission.estimate(kwargs_bundle)
+                    in_flight = sum(max(predicted, self._job_peaks.get(other, 0))
+                                    for other, predicted in self._dispatched.items())
+                    if not self.admission.admit(estimate, in_flight):
+                        _logger.debug(f'Holding back job {job_id}: {estimate/1024**2:.0f} MB predicted, '
+                                      f'{in_flight/1024**2:.0f} MB in flight')
+                        break
+                    heapq.heappop(self._waiting_heap)
+                    del self._waiting[job_id]
+                    self._account_idle()
+                    self._dispatched[job_id] = estimate
+                    self.arguments_queue.put(kwargs_bundle)
 
     def pop_job(self, block: bool = False, timeout=None) -> typing.Tuple[typing.Dict, typing.Any]:
         """
@@ -298,15 +1004,51 @@ class DistributedJobManager:
             Is the pop blocking or non-blocking
 
         Returns:
+            (kwargs bundle, result). The result is None if the job failed, timed out, was
+            cancelled or lost its worker, see kwargs[JOB_STATUS].
+        Raises:
+            queue.Empty: if no result is available within timeout
 
         """
         _logger.info(f"# ongoing_jobs {self.ongoing_jobs}")
         print(f"# ongoing_jobs {self.ongoing_jobs}")
 
+        deadline = None if timeout is None else time.perf_counter() + timeout
         with self.result_lock:
-            (kwargs, results) = self.result_queue.get(block=block, timeout=timeout)
-            self.ongoing_jobs -= 1
+            while True:
+                if block and deadline is not None:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        raise queue.Empty
+                (kwargs, results) = self.result_queue.get(block=block, timeout=timeout)
+                job_id = kwargs.get(JOB_ID)
+                with self._jobs_lock:
+                    if job_id is None or self._jobs.pop(job_id, None) is not None:
+                        self._account_idle()
+                        self._jobs_changed.notify_all()
+                        self._time_limits.pop(job_id, None)
+                        self._dispatched.pop(job_id, None)
+                        peak = self._job_peaks.pop(job_id, 0)
+                        started = self._job_started.pop(job_id, None)
+                        if kwargs.get(JOB_STATUS) == JobStatus.DONE:
+                            self.admission.record_peak(kwargs, peak)
+                            if started is not None:
+                                self._runtimes[self.admission.family_of(kwargs)].append(time.time() - started)
+                        if self._speculative.pop(job_id, None) is not None:
+                            # The first result wins, the other copy is stopped and its result dropped
+                            self.cancelled[job_id] = True
+                            self._cancel_deadlines[job_id] = time.time() + self.job_setting.cancel_grace_period
+                            self._signal_cancelled()
+                        self._retried.discard(job_id)
+                        self._abandoned.discard(job_id)
+                        break
+                # e.g. a job that finished while its worker was being terminated
+                _logger.debug(f'Dropping result of job {job_id}, already returned or cleared')
+                result_transport.discard(results)
+                if not self._jobs:
+                    raise queue.Empty
             print(f"[PID] pid:{os.getpid()}")
+        self._dispatch()
 
         # _logger.info(f"[INFO] end of pop # ongoing_jobs {self.ongoing_jobs}")
         return (kwargs, results)
@@ -328,8 +1070,49 @@ class DistributedJobManager:
         #     self.Qlock.release()
         #     return (None, None)
 
+    def wait_for_jobs(self, predicate: typing.Callable[[int], bool], timeout: float = None) -> bool:
+        """
+        Blocks until predicate holds for the number of jobs pushed and not popped. The predicate is
+        evaluated again whenever a job is pushed or popped, and after notify_waiters.
+        Args:
+            predicate: called with ongoing_jobs
+            timeout: seconds to wait at most. If None, no limit.
+
+        Returns:
+            False if the timeout expired first
+        """
+        with self._jobs_changed:
+            return self._jobs_changed.wait_for(lambda: predicate(len(self._jobs)), timeout)
+
+    def notify_waiters(self) -> None:
+        '''
+        Wakes up wait_for_jobs, e.g. after a condition of its predicate that is not about the jobs
+        changed
+        '''
+        with self._jobs_changed:
+            self._jobs_changed.notify_all()
+
+    def _account_idle(self) -> None:
+        '''
+        Called with _jobs_lock held before the number of dispatched jobs changes
+        '''
+        now = time.perf_counter()
+        capacity = self.capacity
+        busy = min(capacity, len(self._dispatched) + len(self._speculative))
+        self._idle_seconds += (capacity - busy) * (now - self._idle_checked)
+        self._idle_checked = now
+
+    def idle_worker_seconds(self) -> float:
+        '''
+        Seconds summed over the workers during which no job was dispatched to them, since the job
+        manager started
+        '''
+        with self._jobs_lock:
+            self._account_idle()
+            return self._idle_seconds
+
     def any_pending_job(self):
-        return not self.arguments_queue.empty()
+        return bool(self._waiting) or not self.arguments_queue.empty()
 
     def is_idle(self):
         return self.are_queues_empty() and self.are_workers_idle()
@@ -344,7 +1127,7 @@ class DistributedJobManager:
         #              f"result_queue:{len(self.result_queue)}")
         _logger.debug(f"are_queues_empty: {self.arguments_queue.empty()} and "
                       f"{self.result_queue.empty()}")
-        return self.arguments_queue.empty() and self.result_queue.empty()
+        return not self._waiting and self.arguments_queue.empty() and self.result_queue.empty()
 
     def check_timeout(self):
         """
@@ -360,12 +1143,19 @@ class DistributedJobManager:
 
     def reset(self):
         '''
-        Cancel timer and clear the job queue.
+        Cancel timer, cancel the running jobs and clear the job queue.
         '''
         self._timeout_sec = -1
         if self.timer:
             self.timer.cancel()
+        self.cancel_jobs()
         self._clear_jobs()
+        # Workers keep the datasets of the search loaded, replace them to free the memory
+        self.generation.value += 1
+        cost = self.log_cost()
+        if cost.get('jobs'):
+            _logger.info(f"Worker logging: {cost['records']:.0f} records in {cost['batches']:.0f} batches, "
+                         f"{cost['dropped']:.0f} dropped, {cost['seconds_per_job']*1000:.1f} ms per job")
 
     def kill_job_manager(self):
         """
@@ -378,8 +1168,14 @@ class DistributedJobManager:
         # Send sentinel to stop logging listener
         self.log_queue.put(None)
 
-        _logger.debug("self.job_pool.terminate()")
-        self.job_pool.terminate()
+        _logger.debug("terminate workers")
+        self._stopping.set()
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join(DistributedJobManager.TERMINATE_GRACE)
+        self.backend.stop()
+        shared_memory.cleanup_dead_segments()
 
         _logger.debug("self.manager.shutdown()")
         self.manager.shutdown()
@@ -405,20 +1201,41 @@ class DistributedJobManager:
         _logger.warning(f"timer started: {self._timeout_sec/60} min")
 
     def _stop_worker_jobs(self):
-        _logger.warning("search TIMEOUT reached! Stopping worker jobs. Actually just clearing the queue.")
+        _logger.warning("search TIMEOUT reached! Stopping worker jobs.")
+        self.cancel_jobs()
         self._clear_jobs()
 
     def _clear_jobs(self):
         with self.argument_lock:
             _logger.info(f"Clearing {self.ongoing_jobs} jobs from queue")
-            self.ongoing_jobs = 0
             while not self.arguments_queue.empty():
                 self.arguments_queue.get()
+            with self.result_lock:
+                while not self.result_queue.empty():
+                    (_, results) = self.result_queue.get()
+                    result_transport.discard(results)
+            # Results of the jobs still running are dropped by pop_job
+            with self._jobs_lock:
+                self._account_idle()
+                self._jobs_changed.notify_all()
+                self._jobs.clear()
+                self._time_limits.clear()
+                self._waiting.clear()
+                self._waiting_heap.clear()
+                self._dispatched.clear()
+                self._job_peaks.clear()
+                self._job_started.clear()
+                self._speculative.clear()
+                self._retried.clear()
+                self._abandoned.clear()
 
     def _kill_me(self):
         _logger.warning("search TIMEOUT reached! Killing search Process")
         self.kill_job_manager()
         self.kill_timer()
+        # atexit handlers do not run
+        if self.spool_dir:
+            result_transport.remove_spool(self.spool_dir)
         os._exit(0)
         # os.kill(os.getpid(), 9)
 
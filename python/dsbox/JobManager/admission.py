@@ -0,0 +1,99 @@
+'''
+Memory aware admission of jobs to the search workers.
+
+The job manager keeps the jobs it cannot dispatch yet on the main process. Before dispatching
+a job it asks MemoryAdmissionController whether the predicted memory of the jobs in flight plus
+the new one stays within the budget. Predictions come from the peaks measured for earlier jobs
+of the same template family, or before any measurement, from the size of the dataset and a
+prior per family.
+'''
+import collections
+import logging
+import typing
+
+_logger = logging.getLogger(__name__)
+
+MB = 1024**2
+
+# Memory of a job before any measurement: (minimum bytes, multiple of the dataset size).
+# Image, video and audio templates load their media files, which are not part of the dataset size.
+FAMILY_PRIORS = {
+    'image': (4096 * MB, 20),
+    'video': (4096 * MB, 20),
+    'audio': (2048 * MB, 20),
+    'graph': (1024 * MB, 10),
+    'edgeList': (1024 * MB, 10),
+    'text': (1024 * MB, 10),
+    'timeseries': (1024 * MB, 10),
+    'table': (512 * MB, 5),
+}
+DEFAULT_PRIOR = (1024 * MB, 10)
+
+
+def template_family(kwargs_bundle: typing.Dict) -> str:
+    '''
+    Template family of a job posted by the template space searches: the input types of its
+    template
+    '''
+    try:
+        input_type = kwargs_bundle['target_obj'].template.template['inputType']
+    except (AttributeError, KeyError, TypeError):
+        return 'default'
+    if isinstance(input_type, str):
+        return input_type
+    return '+'.join(sorted(input_type))
+
+
+class MemoryAdmissionController:
+    """
+    Predicts the memory of jobs and admits them while the total stays within budget_bytes.
+
+    Args:
+        budget_bytes: Memory the jobs in flight may use together. Zero disables the control.
+        family_of: Maps a kwargs bundle to the key under which peaks are recorded
+    """
+
+    # Number of recent peaks kept per family
+    HISTORY_SIZE = 20
+    # Margin on measured peaks
+    SAFETY_FACTOR = 1.2
+
+    def __init__(self, budget_bytes: int = 0,
+                 family_of: typing.Callable[[typing.Dict], str] = template_family) -> None:
+        self.budget_bytes = budget_bytes
+        self.family_of = family_of
+        # Size of the search dataset, used by the priors
+        self.dataset_bytes = 0
+        self.peaks: typing.Dict[str, typing.Deque[int]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=MemoryAdmissionController.HISTORY_SIZE))
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def estimate(self, kwargs_bundle: typing.Dict) -> int:
+        family = self.family_of(kwargs_bundle)
+        peaks = self.peaks.get(family)
+        if peaks:
+            return int(max(peaks) * MemoryAdmissionController.SAFETY_FACTOR)
+        # The most demanding input type of the family
+        priors = [FAMILY_PRIORS[input_type] for input_type in family.split('+') if input_type in FAMILY_PRIORS]
+        minimum, ratio = max(priors) if priors else DEFAULT_PRIOR
+        return max(minimum, ratio * self.dataset_bytes)
+
+    def admit(self, estimate: int, in_flight_bytes: int) -> bool:
+        """
+        Returns true if a job with the given estimate can run next to the jobs in flight. A job
+        is always admitted when nothing else runs, so that an estimate above the budget cannot
+        block the search.
+        """
+        if not self.enabled or in_flight_bytes == 0:
+            return True
+        return in_flight_bytes + estimate <= self.budget_bytes
+
+    def record_peak(self, kwargs_bundle: typing.Dict, peak_bytes: int) -> None:
+        if peak_bytes <= 0:
+            return
+        family = self.family_of(kwargs_bundle)
+        self.peaks[family].append(peak_bytes)
+        _logger.debug(f'Memory peak of {family} job: {peak_bytes/MB:.0f} MB')
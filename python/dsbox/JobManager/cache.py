@@ -2,7 +2,16 @@
 Cache Module
 '''
 import copy
+import fcntl
+import hashlib
+import json
 import logging
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
 import traceback
 import typing
 
@@ -11,10 +20,14 @@ from multiprocessing import Manager
 from d3m.metadata.pipeline import PrimitiveStep
 from d3m.container.dataset import Dataset
 from d3m.container.pandas import DataFrame
-from d3m.container.numpy import ndarray as d3m_ndarray
 from d3m.primitive_interfaces.base import PrimitiveBase
 
 from dsbox.combinatorial_search.search_utils import comparison_metrics
+from dsbox.controller.config import CacheSetting
+from dsbox.JobManager import fingerprint
+from dsbox.JobManager.cache_metrics import CacheMetrics
+from dsbox.JobManager import shared_files
+from dsbox.JobManager import shared_memory
 from dsbox.template.configuration_space import ConfigurationPoint
 
 _logger = logging.getLogger(__name__)
@@ -25,12 +38,63 @@ DO_NOT_CACHE_LIST = {
 }
 
 class DummyLock:
-    def acquire(self, blocking=True, timeout=-1):
-        pass
+    def acquire(self, blocking=True, timeout=-1) -> bool:
+        return True
 
     def release(self):
         pass
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class _FileLock:
+    """
+    Lock shared by the processes of a host through flock() on a file. Unlike a Manager lock, it
+    is released by the kernel when its owner dies, e.g. a worker terminated while pushing to the
+    cache. Each process opens the file itself, locks are not shared with forked children.
+    """
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {'path': self.path, '_fd': None, '_pid': None}
+
+    def _file(self) -> int:
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self, blocking=True, timeout=-1) -> bool:
+        fd = self._file()
+        deadline = time.monotonic() + timeout if timeout is not None and timeout >= 0 else None
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    return False
+            time.sleep(_FileLock.POLL_INTERVAL)
+
+    def release(self) -> None:
+        fcntl.flock(self._file(), fcntl.LOCK_UN)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
 
 class DummyManager:
     def dict(self):
@@ -51,6 +115,9 @@ class CacheManager:
     used in later iterations of search to
     """
 
+    # Set by controller before the search processes are created
+    cache_setting: CacheSetting = CacheSetting()
+
     def __init__(self, is_multiprocessing=False):
         """
         Initializes the manager, and the two cache objects - candidates and primitives - that
@@ -63,9 +130,28 @@ class CacheManager:
         else:
             self.manager = [DummyManager()]*2
 
-        self.candidate_cache = CandidateCache(self.manager[0])
-
-        self.primitive_cache = PrimitivesCache(self.manager[1])
+        self.metrics = CacheMetrics(self.manager[1])
+
+        self.candidate_cache = CandidateCache(
+            self.manager[0], store_dir=CacheManager.cache_setting.candidate_cache_dir, metrics=self.metrics)
+
+        # Each search gets its own spill directory, so concurrent TA2 sessions do not collide
+        cache_dir = None
+        if CacheManager.cache_setting.primitive_cache_dir:
+            os.makedirs(CacheManager.cache_setting.primitive_cache_dir, exist_ok=True)
+            cache_dir = tempfile.mkdtemp(prefix='search_', dir=CacheManager.cache_setting.primitive_cache_dir)
+        quarantine_file = None
+        if CacheManager.cache_setting.primitive_cache_dir:
+            # Shared by all searches using the same local directory
+            quarantine_file = os.path.join(CacheManager.cache_setting.primitive_cache_dir, 'do_not_cache.json')
+        validation = CacheValidationPolicy(
+            self.manager[1], validation_rate=CacheManager.cache_setting.cache_validation_rate,
+            quarantine_file=quarantine_file)
+        self.primitive_cache = PrimitivesCache(
+            self.manager[1], cache_dir=cache_dir, validation=validation, metrics=self.metrics,
+            max_bytes=CacheManager.cache_setting.primitive_cache_max_bytes,
+            cache_outputs=CacheManager.cache_setting.cache_step_outputs,
+            read_bytes_per_second=CacheManager.cache_setting.cache_read_bytes_per_second)
 
     def cleanup(self):
         """
@@ -75,8 +161,10 @@ class CacheManager:
         """
         _logger.info("Cleanup Cache Manager. candidate_cache:{} primitive_cache:{}".format(
             len(self.candidate_cache.storage), len(self.primitive_cache.storage)))
+        if CacheManager.cache_setting.metrics_file:
+            self.metrics.dump(CacheManager.cache_setting.metrics_file)
         self.candidate_cache.storage.clear()
-        self.primitive_cache.storage.clear()
+        self.primitive_cache.clear()
 
     def shutdown(self):
         '''
@@ -84,35 +172,142 @@ class CacheManager:
         '''
         _logger.info("Shutdown Cache Manager. candidate_cache:{} primitive_cache:{}".format(
             len(self.candidate_cache.storage), len(self.primitive_cache.storage)))
+        self.primitive_cache.remove_cache_dir()
         for m in self.manager:
             m.shutdown()
 
 
 class CandidateCache:
+    """
+    Evaluation results of candidates (ConfigurationPoint). Besides the in-memory storage shared
+    by the search processes, results can be persisted in store_dir, so that a search restarted
+    on the same dataset and problem does not evaluate the same candidates again. See
+    set_context() and lookup_persisted().
+    """
     comparison_metrics = ['cross_validation_metrics', 'test_metrics', 'training_metrics']
     S_INVALID = "DUMMY"
     S_VALID = "FULL"
+    # Cross-validation stopped early by racing, see dsbox.template.racing
+    S_PARTIAL = "PARTIAL"
+
+    # Report fields persisted in addition to the metrics and status
+    persisted_fields = ['id', 'fid', 'rank', 'total_runtime', 'template_name']
 
-    def __init__(self, manager):
+    def __init__(self, manager, store_dir: str = None, metrics: CacheMetrics = None):
         self.storage = manager.dict()
+        self.metrics = metrics if metrics is not None else CacheMetrics(manager)
+        self.store_dir = store_dir
+        # Directory of the current dataset and problem under store_dir
+        self.store_path: str = None
+
+    def set_context(self, dataset: Dataset, problem: typing.Dict) -> None:
+        """
+        Sets the dataset and problem the persisted results are keyed by
+        """
+        if not self.store_dir:
+            return
+        # Problem file locations may differ between runs, only the description matters
+        problem_description = {key: problem[key] for key in ('id', 'problem', 'inputs') if key in problem}
+        context = fingerprint.combine(
+            fingerprint.ensure_fingerprint(dataset), fingerprint.canonical_fingerprint(problem_description))
+        self.store_path = os.path.join(self.store_dir, context)
+        try:
+            os.makedirs(self.store_path, exist_ok=True)
+            _logger.info(f'Persistent candidate cache: {self.store_path}')
+        except OSError:
+            _logger.warning(f'Unable to create {self.store_path}', exc_info=True)
+            self.store_path = None
 
     def lookup(self, candidate: ConfigurationPoint) -> typing.Dict:
 
         key = CandidateCache._get_hash(candidate)
         if key in self.storage:
             _logger.info("hit@Candidate: ({})".format(key))
+            self.metrics.add(CacheMetrics.CANDIDATE_CACHE, lookups=1, hits=1)
             return self.storage[key]
         else:
+            self.metrics.add(CacheMetrics.CANDIDATE_CACHE, lookups=1, misses=1)
             return None
 
-    def push_None(self, candidate: ConfigurationPoint) -> None:
+    def lookup_persisted(self, candidate: ConfigurationPoint) -> typing.Optional[typing.Dict]:
+        """
+        Returns the result of the candidate persisted by a previous run, or None. The result
+        contains the metrics, status and the fields in persisted_fields.
+        """
+        if not self.store_path:
+            return None
+        file_path = os.path.join(self.store_path, CandidateCache._get_hash(candidate) + '.pkl')
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'rb') as fd:
+                record = pickle.load(fd)
+        except Exception:
+            _logger.warning(f'Unable to read persisted candidate {file_path}', exc_info=True)
+            return None
+        _logger.info("hit@PersistedCandidate: ({})".format(CandidateCache._get_hash(candidate)))
+        self.metrics.add(CacheMetrics.CANDIDATE_CACHE, persisted_hits=1)
+        return record
+
+    def reuse_persisted(self, candidate: ConfigurationPoint, history: typing.Any,
+                        output_directory: str) -> typing.Optional[typing.Dict]:
+        """
+        Looks up the candidate in the results persisted by previous runs on the same dataset and
+        problem. If found, the result is added to the history (an ExecutionHistory) and to this
+        cache as if the candidate had just been evaluated.
+
+        Reused reports only hold the metrics, status and persisted_fields. In particular they
+        have no ensemble_tuning_result or ensemble_tuning_metrics: the predictions are not
+        persisted, so reused candidates take no part in ensemble tuning.
+        Args:
+            candidate: the candidate pipeline to be evaluated
+            history: history of the search, its templates are the rows of history.storage
+            output_directory: output directory of the search, holding the fitted pipelines
+
+        Returns:
+            the reused report, or None if there is none (or the candidate failed before)
+        """
+        if not CacheManager.cache_setting.reuse_candidate_results:
+            return None
+        if self.is_hit(candidate):
+            return None
+        record = self.lookup_persisted(candidate)
+        if record is None or record['template_name'] not in history.storage.index:
+            return None
+        template_name = record['template_name']
+
+        if record['status'] == CandidateCache.S_INVALID:
+            _logger.info(f"Skipping candidate that failed in a previous run: {template_name}")
+            history.update_none(fail_report=None, template_name=template_name)
+            self.push_None(candidate=candidate)
+            return None
+
+        # fitted_pipeline imports this module
+        from dsbox.pipeline.fitted_pipeline import FittedPipeline
+        # The fitted pipeline must still be there, TA3 loads it by its id
+        fitted_pipeline_file = os.path.join(
+            output_directory, FittedPipeline.pipelines_fitted_subdir, record['fid'], record['fid'] + '.json')
+        if not os.path.exists(fitted_pipeline_file):
+            return None
+
+        report = dict(record, configuration=candidate)
+        _logger.info(f"Reusing report from a previous run for {template_name}: id={report['id']}")
+        history.update(report, template_name=template_name)
+        self.push(report, persist=False)
+        return report
+
+    def push_None(self, candidate: ConfigurationPoint, failed: bool = False) -> None:
+        """
+        Marks the candidate as invalid. Used both while the candidate is being evaluated, and
+        with failed=True when its evaluation failed, in which case the failure is persisted.
+        """
         result = {
             "configuration": candidate,
             "status": CandidateCache.S_INVALID,
         }
-        self.push(result=result)
+        self.push(result=result, persist=failed)
 
-    def push(self, result: typing.Dict) -> None:
+    def push(self, result: typing.Dict, persist: bool = True) -> None:
         assert (result is not None and
                 'configuration' in result), 'invalid push in candidate_cache: {}'.format(result)
 
@@ -123,6 +318,10 @@ class CandidateCache:
         for k in comparison_metrics + ['configuration', 'status']:
             update[k] = copy.deepcopy(result[k]) if k in result else None
         update['id'] = result['fitted_pipeline'].id if 'fitted_pipeline' in result else None
+        if 'partial_evaluation' in result:
+            update['status'] = CandidateCache.S_PARTIAL
+            # Raced against the best candidate of this search only
+            persist = False
 
         # check the candidate in cache. If duplicate is found the metric values must match
         self._check_update_format(candidate, key, update)
@@ -133,6 +332,19 @@ class CandidateCache:
         assert 'status' in update
         self.storage[key] = update
 
+        if persist and self.store_path:
+            self._persist(key, result, update)
+
+    def _persist(self, key: str, result: typing.Dict, update: typing.Dict) -> None:
+        record = {k: update[k] for k in comparison_metrics + ['status']}
+        for k in CandidateCache.persisted_fields:
+            record[k] = result.get(k)
+        file_path = os.path.join(self.store_path, key + '.pkl')
+        try:
+            shared_files.dump_atomic(file_path, record)
+        except Exception:
+            _logger.warning(f'Unable to persist candidate {key}', exc_info=True)
+
     def _check_update_format(self, candidate, key, update):
         """
         checks the format of the update dict. If the candidate is already pushed into the cache
@@ -157,7 +369,7 @@ class CandidateCache:
             assert match['configuration'] is not None
             for k in comparison_metrics:
                 # _logger.debug('_check_update_format: metric={k}')
-                if match['status'] == CandidateCache.S_INVALID:
+                if match['status'] == CandidateCache.S_INVALID and update['status'] is None:
                     update['status'] = CandidateCache.S_VALID
                 assert k in match
                 assert k in update
@@ -186,8 +398,93 @@ class CandidateCache:
         return CandidateCache._get_hash(candidate) in self.storage
 
     @staticmethod
-    def _get_hash(candidate: ConfigurationPoint) -> int:
-        return hash(str(candidate))
+    def _get_hash(candidate: ConfigurationPoint) -> str:
+        return fingerprint.canonical_fingerprint(candidate)
+
+
+class CacheValidationPolicy:
+    """
+    Decides which primitive cache hits are validated by refitting the primitive, and keeps a
+    trust score per primitive path. A primitive starts untrusted and every hit is validated
+    until it has passed MIN_VALIDATIONS checks, after that only validation_rate of its hits
+    are. A primitive whose refitted outputs differ from the cached ones is nondeterministic,
+    it is quarantined: added to the do-not-cache list, which is persisted in
+    quarantine_file so that later runs skip it as well.
+    """
+
+    MIN_VALIDATIONS = 3
+
+    def __init__(self, manager: Manager = DummyManager(), *, validation_rate: float = 0.1,
+                 quarantine_file: str = None):
+        self.validation_rate = validation_rate
+        self.quarantine_file = quarantine_file
+        # prim_name -> {'validated': passed checks, 'mismatch': failed checks}
+        self.trust = manager.dict()
+        # prim_name -> reason
+        self.quarantined = manager.dict()
+        self._lock = manager.Lock()
+        self._random = random.Random()
+        for prim_name in self._load_quarantine_file():
+            self.quarantined[prim_name] = 'quarantined in a previous run'
+
+    def is_cacheable(self, prim_name: str) -> bool:
+        return prim_name not in DO_NOT_CACHE_LIST and prim_name not in self.quarantined
+
+    def trust_score(self, prim_name: str) -> int:
+        """
+        Number of validations passed, or -1 if the primitive is quarantined
+        """
+        if prim_name in self.quarantined:
+            return -1
+        return self.trust.get(prim_name, {}).get('validated', 0)
+
+    def should_validate(self, prim_name: str) -> bool:
+        if self.trust_score(prim_name) < CacheValidationPolicy.MIN_VALIDATIONS:
+            return True
+        return self._random.random() < self.validation_rate
+
+    def record(self, prim_name: str, is_equal: bool, reason: str = '') -> bool:
+        """
+        Records the outcome of a validation. Returns True if the primitive got quarantined.
+        """
+        if not self._lock.acquire(blocking=True, timeout=PrimitivesCache.LOCK_TIMEOUT):
+            _logger.warning(f'Cache validation lock timed out, not recording validation of {prim_name}')
+            return False
+        try:
+            counts = self.trust.get(prim_name, {'validated': 0, 'mismatch': 0})
+            if is_equal:
+                counts['validated'] += 1
+            else:
+                counts['mismatch'] += 1
+            self.trust[prim_name] = counts
+            if is_equal or prim_name in self.quarantined:
+                return False
+            self.quarantined[prim_name] = reason
+        finally:
+            self._lock.release()
+        _logger.warning(f'Cache validation failed, quarantining nondeterministic primitive {prim_name}: {reason}')
+        self._save_quarantine_file()
+        return True
+
+    def _load_quarantine_file(self) -> typing.List[str]:
+        if not self.quarantine_file or not os.path.exists(self.quarantine_file):
+            return []
+        try:
+            with open(self.quarantine_file, 'r') as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            _logger.warning(f'Unable to read {self.quarantine_file}', exc_info=True)
+            return []
+
+    def _save_quarantine_file(self) -> None:
+        if not self.quarantine_file:
+            return
+        # Several searches may share the file, so merge with what is already there
+        names = sorted(set(self._load_quarantine_file()) | set(self.quarantined.keys()))
+        try:
+            shared_files.write_atomic(self.quarantine_file, lambda fd: json.dump(names, fd, indent=2), mode='w')
+        except OSError:
+            _logger.warning(f'Unable to write {self.quarantine_file}', exc_info=True)
 
 
 class PrimitivesCache:
@@ -199,17 +496,60 @@ class PrimitivesCache:
              (10000000, 1000)
             > %timeit hash(A.values.tobytes())
              7.66 s ± 4.87 ms per loop (mean ± std. dev. of 7 runs, 1 loop each)
+
+        If cache_dir is given fitted primitives are pickled into files under cache_dir, and
+        storage only keeps a small index entry per primitive. The total size of the pickled
+        files is kept under max_bytes by evicting the least recently used entries. Without
+        cache_dir the primitives are kept in storage itself (used for the local runtime cache).
+
     todo:
         1. only add the primitive to the cache if it is reasonable to do so. (if the time to
         recompute it is significantly more than reading it) (500 MBps)
 
 
     """
-    def __init__(self, manager: Manager = DummyManager()):
+    # push_key return codes
+    PUSHED = 0
+    DOUBLE_PUSH = 1
+    DO_NOT_CACHE = 2
+    TOO_LARGE = 3
+
+    # Third element of the storage key of cached step outputs
+    OUTPUTS = 'outputs'
+    # Cache outputs only if producing them takes this many times longer than reading them
+    OUTPUT_ADMISSION_RATIO = 2.0
+    # Largest share of max_bytes a single cached output may take
+    OUTPUT_MAX_FRACTION = 0.25
+    # Seconds to wait for a lock before going on without the cache. Operations under the locks
+    # are short, a longer wait means the owner died holding a Manager lock.
+    LOCK_TIMEOUT = 30
+
+    def __init__(self, manager: Manager = DummyManager(), *, cache_dir: str = None, max_bytes: int = 0,
+                 cache_outputs: bool = False, read_bytes_per_second: int = 500 * 1024**2,
+                 validation: CacheValidationPolicy = None, metrics: CacheMetrics = None):
+        # (prim_name, prim_hash) -> {'fitting_time', 'size', 'last_access', 'file' or 'model'}
+        # (prim_name, prim_hash, OUTPUTS) -> {'fitting_time' (produce time), 'size', 'last_access', 'file',
+        #                                    'handle' if stored as a shared memory segment}
         self.storage = manager.dict()
-        self.write_lock = manager.Lock()
-
-    def push(self, hash_prefix: int, pipe_step: PrimitiveStep, primitive_arguments: typing.Dict,
+        # Bookkeeping shared by all workers, i.e. total size of the files in cache_dir
+        self.usage = manager.dict()
+        self.usage['bytes'] = 0
+        self.cache_dir = cache_dir
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Survives workers terminated while holding it
+            self.write_lock = _FileLock(os.path.join(self.cache_dir, '.write_lock'))
+        else:
+            self.write_lock = manager.Lock()
+        self.max_bytes = max_bytes
+        self.cache_outputs = cache_outputs
+        self.read_bytes_per_second = read_bytes_per_second
+        self.validation = validation if validation is not None else CacheValidationPolicy(manager)
+        self.metrics = metrics if metrics is not None else CacheMetrics(manager)
+        if self.cache_dir:
+            _logger.info(f'Primitive cache directory: {self.cache_dir} budget: {self.max_bytes/1024**2:.0f} MB')
+
+    def push(self, hash_prefix: str, pipe_step: PrimitiveStep, primitive_arguments: typing.Dict,
              fitting_time: int, model: PrimitiveBase) -> int:
         prim_name, prim_hash = PrimitivesCache._get_hash(
             hash_prefix=hash_prefix, pipe_step=pipe_step, primitive_arguments=primitive_arguments)
@@ -217,23 +557,119 @@ class PrimitivesCache:
         return self.push_key(prim_hash=prim_hash, prim_name=prim_name, model=model,
                              fitting_time=fitting_time)
 
-    def push_key(self, prim_hash: int, prim_name: int, model: PrimitiveBase,
+    def push_key(self, prim_hash: str, prim_name: str, model: PrimitiveBase,
                  fitting_time: int) -> int:
+        if not self.validation.is_cacheable(prim_name):
+            _logger.debug(f'In do not cache list: %s', prim_name)
+            self.metrics.add(prim_name, rejected_inserts=1)
+            return PrimitivesCache.DO_NOT_CACHE
+        if self.is_hit_key(prim_name=prim_name, prim_hash=prim_hash):
+            return PrimitivesCache.DOUBLE_PUSH
+
+        if not self.cache_dir:
+            return self._push_entry((prim_name, prim_hash), {
+                'fitting_time': fitting_time, 'size': 0, 'last_access': time.time(), 'model': model})
 
-        self.write_lock.acquire(blocking=True)
+        return self._spill((prim_name, prim_hash), model, {'fitting_time': fitting_time})
+
+    def push_outputs(self, prim_hash: str, prim_name: str, outputs: typing.Dict,
+                     produce_time: float) -> int:
+        """
+        Store the produced outputs of a fitted step, so that a later hit can skip multi_produce
+        as well. Only done with a cache directory, and only if reading the outputs back is
+        estimated to be clearly cheaper than producing them again.
+        """
+        if not (self.cache_dir and self.cache_outputs):
+            return PrimitivesCache.DO_NOT_CACHE
+        if not self.validation.is_cacheable(prim_name):
+            self.metrics.add(prim_name, rejected_inserts=1)
+            return PrimitivesCache.DO_NOT_CACHE
+        key = (prim_name, prim_hash, PrimitivesCache.OUTPUTS)
+        if key in self.storage:
+            return PrimitivesCache.DOUBLE_PUSH
+        return self._spill(key, outputs, {'fitting_time': produce_time}, admit=self._admit_outputs)
+
+    def _admit_outputs(self, key: typing.Tuple, size: int, entry: typing.Dict) -> bool:
+        read_time = size / self.read_bytes_per_second
+        if entry['fitting_time'] < PrimitivesCache.OUTPUT_ADMISSION_RATIO * read_time:
+            _logger.debug(f'Outputs not worth caching: {key[0]} {size} bytes produced in {entry["fitting_time"]:.2f}s')
+            return False
+        # Do not let a single output evict a large part of the cache
+        if self.max_bytes and size > self.max_bytes * PrimitivesCache.OUTPUT_MAX_FRACTION:
+            _logger.debug(f'Outputs too large to cache: {key[0]} {size} bytes')
+            return False
+        return True
+
+    def _spill(self, key: typing.Tuple, value, entry: typing.Dict, admit: typing.Callable = None) -> int:
+        file_path = self._entry_path(key)
+        temp_path = shared_files.temp_path(file_path)
+
+        # Serialize and write outside of the lock, it is the expensive part
+        handle = None
+        if len(key) > 2:
+            # Outputs are stored as a segment, workers hitting the entry then map the same pages
+            # instead of each unpickling its own copy
+            handle = shared_memory.share(value, path=temp_path, min_bytes=0)
+            if not isinstance(handle, shared_memory.SegmentHandle):
+                handle = None
+        if handle is None:
+            try:
+                payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                _logger.warning('Caching model failed. Most likely the primitive does not pickle properly.')
+                traceback.print_exc()
+                return None
+            size = len(payload)
+        else:
+            size = handle.size
+
+        rejected = False
+        if self.max_bytes and size > self.max_bytes:
+            _logger.debug(f'Too large to cache: {key[0]} {size} bytes')
+            rejected = True
+        elif admit is not None and not admit(key, size, entry):
+            rejected = True
+        if rejected:
+            self._remove_file(temp_path)
+            self.metrics.add(key[0], rejected_inserts=1)
+            return PrimitivesCache.TOO_LARGE
 
         try:
-            if prim_name in DO_NOT_CACHE_LIST:
-                _logger.debug(f'In do not cache list: %s', prim_name)
-                return 2
-            elif not self.is_hit_key(prim_name=prim_name, prim_hash=prim_hash):
-                self.storage[(prim_name, prim_hash)] = (fitting_time, model)
-                _logger.debug(f"Push@cache:{prim_name},{prim_hash}")
-                # print(f"[INFO] Push@cache:{prim_name},{prim_hash}")
-                return 0
-            else:
+            if handle is None:
+                with open(temp_path, 'wb') as out:
+                    out.write(payload)
+            os.replace(temp_path, file_path)
+        except OSError:
+            _logger.warning(f'Failed to write cache file {file_path}', exc_info=True)
+            self._remove_file(temp_path)
+            return None
+
+        # If another worker pushed the same entry in the meantime, both wrote the same file
+        entry.update({'size': size, 'last_access': time.time(), 'file': file_path})
+        if handle is not None:
+            handle.path = file_path
+            entry['handle'] = handle
+        return self._push_entry(key, entry)
+
+    def _push_entry(self, key: typing.Tuple, entry: typing.Dict) -> int:
+        if not self._acquire_write_lock(key[0]):
+            self._remove_file(entry.get('file'))
+            return None
+        try:
+            if key in self.storage:
                 # print("[WARN] Double-push in Primitives Cache")
-                return 1
+                return PrimitivesCache.DOUBLE_PUSH
+            if entry['size'] > 0:
+                self._evict(entry['size'])
+                self.usage['bytes'] = self.usage['bytes'] + entry['size']
+            self.storage[key] = entry
+            if len(key) > 2:
+                self.metrics.add(key[0], output_inserts=1, output_insert_bytes=entry['size'])
+            else:
+                self.metrics.add(key[0], inserts=1, insert_bytes=entry['size'])
+            _logger.debug(f"Push@cache:{key[0]},{key[1]}")
+            # print(f"[INFO] Push@cache:{key[0]},{key[1]}")
+            return PrimitivesCache.PUSHED
         except:
             _logger.warning('Caching model failed. Most likely the primitive does not pickle properly.')
             traceback.print_exc()
@@ -241,7 +677,109 @@ class PrimitivesCache:
             # print("[INFO] released")
             self.write_lock.release()
 
-    def lookup(self, hash_prefix: int, pipe_step: PrimitiveStep,
+    def _evict(self, incoming_size: int) -> None:
+        """
+        Remove least recently used entries until incoming_size fits within max_bytes. Caller
+        must hold write_lock.
+        """
+        if not self.max_bytes:
+            return
+        used = self.usage['bytes']
+        if used + incoming_size <= self.max_bytes:
+            return
+        # One round trip to the manager, then evict in LRU order
+        entries = sorted(self.storage.items(), key=lambda item: item[1]['last_access'])
+        for key, entry in entries:
+            if used + incoming_size <= self.max_bytes:
+                break
+            self.storage.pop(key, None)
+            self._remove_file(entry.get('file'))
+            used -= entry['size']
+            self.metrics.add(key[0], evictions=1, evicted_bytes=entry['size'])
+            _logger.debug(f'Evict@cache:{key[0]},{key[1]} size={entry["size"]}')
+        self.usage['bytes'] = max(used, 0)
+
+    def _acquire_write_lock(self, prim_name: str = '') -> bool:
+        """
+        Returns False if the lock could not be acquired within LOCK_TIMEOUT, the caller then
+        skips the cache operation
+        """
+        start = time.perf_counter()
+        acquired = self.write_lock.acquire(blocking=True, timeout=PrimitivesCache.LOCK_TIMEOUT)
+        self.metrics.add(prim_name, lock_waits=1, lock_wait_seconds=time.perf_counter() - start)
+        if not acquired:
+            _logger.warning(f'Primitive cache lock timed out, skipping cache for {prim_name}')
+        return acquired
+
+    def _touch(self, key: typing.Tuple) -> None:
+        if not self._acquire_write_lock(key[0]):
+            return
+        try:
+            entry = self.storage.get(key)
+            if entry is not None:
+                entry['last_access'] = time.time()
+                self.storage[key] = entry
+        finally:
+            self.write_lock.release()
+
+    def _entry_path(self, key: typing.Tuple) -> str:
+        digest = hashlib.md5(repr(key).encode()).hexdigest()
+        suffix = 'seg' if len(key) > 2 else 'pkl'
+        return os.path.join(self.cache_dir, '{}_{}.{}'.format('_'.join(key[0].split('.')[-2:]), digest, suffix))
+
+    @staticmethod
+    def _remove_file(file_path: str) -> None:
+        if not file_path:
+            return
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def should_validate(self, prim_name: str) -> bool:
+        return self.validation.should_validate(prim_name)
+
+    def record_validation(self, prim_name: str, is_equal: bool, reason: str = '') -> None:
+        """
+        Records the outcome of validating a cache hit. If the primitive gets quarantined its
+        entries are dropped from the cache.
+        """
+        self.metrics.add(prim_name, validations=1, validation_failures=0 if is_equal else 1)
+        if self.validation.record(prim_name, is_equal, reason):
+            self.remove_primitive(prim_name)
+
+    def remove_primitive(self, prim_name: str) -> None:
+        if not self._acquire_write_lock(prim_name):
+            # The entries of the primitive stay in the cache
+            return
+        try:
+            for key, entry in list(self.storage.items()):
+                if key[0] == prim_name:
+                    self.storage.pop(key, None)
+                    self._remove_file(entry.get('file'))
+                    self.usage['bytes'] = max(self.usage['bytes'] - entry['size'], 0)
+        finally:
+            self.write_lock.release()
+
+    def clear(self) -> None:
+        """
+        Remove all entries and their spilled files
+        """
+        if not self._acquire_write_lock():
+            return
+        try:
+            for entry in self.storage.values():
+                self._remove_file(entry.get('file'))
+            self.storage.clear()
+            self.usage['bytes'] = 0
+        finally:
+            self.write_lock.release()
+
+    def remove_cache_dir(self) -> None:
+        if self.cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def lookup(self, hash_prefix: str, pipe_step: PrimitiveStep,
                primitive_arguments: typing.Dict) -> typing.Tuple[Dataset, PrimitiveBase]:
 
         prim_name, prim_hash = self._get_hash(hash_prefix=hash_prefix, pipe_step=pipe_step,
@@ -249,15 +787,56 @@ class PrimitivesCache:
 
         return self.lookup_key(prim_name=prim_name, prim_hash=prim_hash)
 
-    def lookup_key(self, prim_hash: int, prim_name: int) -> typing.Tuple[Dataset, PrimitiveBase]:
-        if self.is_hit_key(prim_name=prim_name, prim_hash=prim_hash):
-            _logger.debug("Hit@cache: {},{}".format(prim_name, prim_hash))
-            # print("[INFO] Hit@cache: {},{}".format(prim_name, prim_hash))
-            return self.storage[(prim_name, prim_hash)]
-        else:
+    def lookup_key(self, prim_hash: str, prim_name: str) -> typing.Tuple[Dataset, PrimitiveBase]:
+        """
+        Returns (fitting_time, model), or (None, None) if the entry is missing or has been
+        evicted by another worker after is_hit_key() was called.
+        """
+        key = (prim_name, prim_hash)
+        entry = self.storage.get(key)
+        if entry is None:
+            self.metrics.add(prim_name, lookups=1, misses=1)
             return (None, None)
+        _logger.debug("Hit@cache: {},{}".format(prim_name, prim_hash))
+        # print("[INFO] Hit@cache: {},{}".format(prim_name, prim_hash))
+        if 'model' in entry:
+            model = entry['model']
+        else:
+            try:
+                with open(entry['file'], 'rb') as fd:
+                    model = pickle.load(fd)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                _logger.debug(f'Cache file gone: {prim_name},{prim_hash}')
+                self.metrics.add(prim_name, lookups=1, misses=1)
+                return (None, None)
+        self._touch(key)
+        self.metrics.add(prim_name, lookups=1, hits=1, fit_time_saved_seconds=entry['fitting_time'])
+        return (entry['fitting_time'], model)
+
+    def lookup_outputs(self, prim_hash: str, prim_name: str) -> typing.Optional[typing.Dict]:
+        """
+        Returns the cached outputs of a fitted step, or None
+        """
+        key = (prim_name, prim_hash, PrimitivesCache.OUTPUTS)
+        entry = self.storage.get(key)
+        self.metrics.add(prim_name, output_lookups=1)
+        if entry is None:
+            return None
+        try:
+            if 'handle' in entry:
+                outputs = shared_memory.attach(entry['handle'])
+            else:
+                with open(entry['file'], 'rb') as fd:
+                    outputs = pickle.load(fd)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            _logger.debug(f'Cache file gone: {prim_name},{prim_hash}')
+            return None
+        _logger.debug("Hit@cache outputs: {},{}".format(prim_name, prim_hash))
+        self._touch(key)
+        self.metrics.add(prim_name, output_hits=1, produce_time_saved_seconds=entry['fitting_time'])
+        return outputs
 
-    def is_hit(self, hash_prefix: int, pipe_step: PrimitiveStep,
+    def is_hit(self, hash_prefix: str, pipe_step: PrimitiveStep,
                primitive_arguments: typing.Dict) -> bool:
         return (
                 (
@@ -266,11 +845,11 @@ class PrimitivesCache:
                         primitive_arguments=primitive_arguments)
                 ) in self.storage)
 
-    def is_hit_key(self, prim_hash: int, prim_name: int) -> bool:
+    def is_hit_key(self, prim_hash: str, prim_name: str) -> bool:
         return (prim_name, prim_hash) in self.storage
 
     @staticmethod
-    def _get_argument_hash(key: str, value, *, fast_unsafe_method=False) -> int:
+    def _get_argument_hash(key: str, value, *, fast_unsafe_method=False) -> str:
 
         # TODO the list part is related to timeseries datasets. chcek this with team
         assert (isinstance(value, Dataset) or
@@ -278,41 +857,34 @@ class PrimitivesCache:
                 isinstance(value, typing.List)), \
                f"Key {key} value type not valid {type(value)}"
 
-        result = hash(key)
         if fast_unsafe_method:
-            result += hash(str(value))
-            return result
-
-        if isinstance(value, DataFrame):
-            # v2019.6.30
-            # this added part used to check whether the input dataframe has column with ndarray
-            # hashing large ndarray is very slow so we should not do hash on this part
-            a_copy = copy.copy(value)
-            if type(value) is DataFrame:
-                for i in range(value.shape[1]):
-                    if type(value.iloc[0, i]) is d3m_ndarray:
-                        drop_column_name = value.columns[i]
-                        a_copy = a_copy.drop(columns=drop_column_name)
-                        _logger.warning("Dropping column: {}".format(drop_column_name))
-                value = a_copy
-
-            result += hash(value.values.tobytes())
-        else:
-            result += hash(str(value))
-        return result
+            return fingerprint.combine(key, str(value))
+        return fingerprint.combine(key, fingerprint.value_fingerprint(value))
 
     @staticmethod
     def get_hash(pipe_step: PrimitiveStep, primitive_arguments: typing.Dict,
                  primitive_hyperparams: typing.Dict,  # 2019-7-11: must pass in hyperparams
-                 hash_prefix: int = None) -> typing.Tuple[int, int]:
-        return PrimitivesCache._get_hash(pipe_step, primitive_arguments, primitive_hyperparams, hash_prefix)
+                 hash_prefix: str = None,
+                 argument_fingerprints: typing.Dict[str, str] = None) -> typing.Tuple[str, str]:
+        return PrimitivesCache._get_hash(pipe_step, primitive_arguments, primitive_hyperparams, hash_prefix,
+                                         argument_fingerprints)
 
     @staticmethod
     def _get_hash(pipe_step: PrimitiveStep, primitive_arguments: typing.Dict,
                   primitive_hyperparams: typing.Dict,
-                  hash_prefix: int = None) -> typing.Tuple[int, int]:
+                  hash_prefix: str = None,
+                  argument_fingerprints: typing.Dict[str, str] = None) -> typing.Tuple[str, str]:
+        """
+        Returns (prim_name, prim_hash). The hash is a hex digest that is stable across
+        processes and runs, so it can be used for caches shared between workers.
+
+        Args:
+            argument_fingerprints: Known fingerprints of (some of) the arguments, usually
+                propagated from upstream steps. Arguments not listed are content hashed.
+        """
         prim_name = str(pipe_step.primitive)
-        hyperparam_hash = hash(str(primitive_hyperparams.items()))
+        primitive_id = fingerprint.primitive_identity(pipe_step.primitive)
+        hyperparam_hash = fingerprint.hyperparams_fingerprint(primitive_hyperparams)
 
         dataset_id = ""
         dataset_digest = ""
@@ -322,17 +894,21 @@ class PrimitivesCache:
         except Exception:
             pass
 
-        argument_hash = 0
-        if hash_prefix is None:
-            for key, value in primitive_arguments.items():
-                argument_hash += PrimitivesCache._get_argument_hash(key, value)
-        else:
+        fast_unsafe_method = hash_prefix is not None
+        if fast_unsafe_method:
             _logger.debug("Primtive cache, hash computed in prefix mode")
-            for key, value in primitive_arguments.items():
-                argument_hash += PrimitivesCache._get_argument_hash(key, value, fast_unsafe_method=True)
+        if argument_fingerprints is None:
+            argument_fingerprints = {}
+        argument_hashes = []
+        for key in sorted(primitive_arguments.keys()):
+            if key in argument_fingerprints:
+                argument_hashes.append(fingerprint.combine(key, argument_fingerprints[key]))
+            else:
+                argument_hashes.append(PrimitivesCache._get_argument_hash(
+                    key, primitive_arguments[key], fast_unsafe_method=fast_unsafe_method))
 
-        dataset_hash = hash(str(argument_hash) + dataset_id + dataset_digest)
-        prim_hash = hash(str([hyperparam_hash, dataset_hash, hash_prefix]))
+        dataset_hash = fingerprint.combine(dataset_id, dataset_digest, *argument_hashes)
+        prim_hash = fingerprint.combine(primitive_id, hyperparam_hash, dataset_hash, hash_prefix)
         _logger.debug("dataset hash {}: {}".format(prim_name, dataset_hash))
         _logger.debug("hash: {}, {}".format(prim_name, prim_hash))
         return prim_name, prim_hash
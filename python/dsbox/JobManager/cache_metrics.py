@@ -0,0 +1,125 @@
+'''
+Cache instrumentation
+
+Counters are accumulated locally in each process and published to a Manager dict at most once
+per FLUSH_INTERVAL seconds, so recording an event does not cost a round trip to the manager.
+'''
+import json
+import logging
+import os
+import time
+import typing
+import uuid
+
+from collections import defaultdict
+
+_logger = logging.getLogger(__name__)
+
+# Counters kept per primitive python path
+COUNTERS = [
+    'lookups', 'hits', 'misses', 'persisted_hits',
+    'output_lookups', 'output_hits',
+    'inserts', 'insert_bytes', 'output_inserts', 'output_insert_bytes', 'rejected_inserts',
+    'evictions', 'evicted_bytes',
+    'validations', 'validation_failures',
+    'lock_waits', 'lock_wait_seconds',
+    'fit_time_saved_seconds', 'produce_time_saved_seconds',
+]
+
+
+class CacheMetrics:
+    """
+    Per primitive statistics of the primitive and candidate caches.
+
+    Args:
+        manager: Manager (or DummyManager) used to share the counters between processes
+    """
+
+    FLUSH_INTERVAL = 1.0
+
+    # Name under which the candidate cache statistics are recorded
+    CANDIDATE_CACHE = 'candidate_cache'
+
+    def __init__(self, manager) -> None:
+        # instance id -> {prim_name -> {counter -> value}}
+        self.published = manager.dict()
+        self._reset_local()
+
+    def _reset_local(self) -> None:
+        # Each process (and each unpickled copy) publishes under its own id
+        self._instance_id = uuid.uuid4().hex
+        self._local: typing.Dict[str, typing.Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._last_flush = time.perf_counter()
+
+    def __getstate__(self) -> typing.Dict:
+        return {'published': self.published}
+
+    def __setstate__(self, state: typing.Dict) -> None:
+        self.published = state['published']
+        self._reset_local()
+
+    def add(self, prim_name: str, **counters: float) -> None:
+        entry = self._local[prim_name]
+        for counter, value in counters.items():
+            entry[counter] += value
+        if time.perf_counter() - self._last_flush > CacheMetrics.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Publish the counters of this process
+        """
+        self._last_flush = time.perf_counter()
+        if not self._local:
+            return
+        try:
+            self.published[self._instance_id] = {name: dict(entry) for name, entry in self._local.items()}
+        except Exception:
+            _logger.debug('Unable to publish cache metrics', exc_info=True)
+
+    def report(self) -> typing.Dict:
+        """
+        Returns the counters of all processes, summed per primitive and in total
+        """
+        self.flush()
+        primitives: typing.Dict[str, typing.Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for entries in self.published.values():
+            for prim_name, entry in entries.items():
+                for counter, value in entry.items():
+                    primitives[prim_name][counter] += value
+
+        total: typing.Dict[str, float] = defaultdict(float)
+        for prim_name, entry in primitives.items():
+            if prim_name == CacheMetrics.CANDIDATE_CACHE:
+                continue
+            for counter, value in entry.items():
+                total[counter] += value
+
+        def summarize(entry):
+            result = {}
+            for counter in COUNTERS:
+                if counter in entry:
+                    value = entry[counter]
+                    result[counter] = value if counter.endswith('seconds') else int(value)
+            if entry.get('lookups'):
+                result['hit_rate'] = entry.get('hits', 0) / entry['lookups']
+            return result
+
+        return {
+            'total': summarize(total),
+            'primitives': {prim_name: summarize(entry) for prim_name, entry in sorted(primitives.items())},
+        }
+
+    def dump(self, file_path: str) -> None:
+        report = self.report()
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as out:
+                json.dump(report, out, indent=4)
+            _logger.info(f'Cache metrics written to {file_path}')
+        except OSError:
+            _logger.warning(f'Unable to write cache metrics to {file_path}', exc_info=True)
+        total = report['total']
+        _logger.info('Primitive cache: lookups={} hits={} fit time saved={:.1f}s lock wait={:.1f}s'.format(
+            int(total.get('lookups', 0)), int(total.get('hits', 0)),
+            total.get('fit_time_saved_seconds', 0), total.get('lock_wait_seconds', 0)))
@@ -0,0 +1,113 @@
+'''
+Cooperative cancellation of the job running in a search worker.
+
+The job manager records the ids of cancelled jobs in a Manager dict shared with the workers, and
+sends CANCEL_SIGNAL to the workers running them. The signal handler only sets a flag, so checking
+for cancellation at a step boundary is free unless a signal arrived. Only then the shared dict is
+consulted, which tells a signal meant for the job of the worker from one meant for its previous
+job.
+
+Outside of the workers nothing is installed and check_cancelled() never raises.
+'''
+import logging
+import signal
+import threading
+import time
+import typing
+
+_logger = logging.getLogger(__name__)
+
+CANCEL_SIGNAL = signal.SIGUSR1
+
+# job id -> True, shared with the job manager
+_cancelled: typing.Optional[typing.Dict] = None
+_job_id: typing.Optional[int] = None
+_signalled = False
+_confirmed = False
+
+
+class JobCancelled(Exception):
+    '''
+    Raised in a worker at a step boundary when its job was cancelled
+    '''
+    pass
+
+
+def install(cancelled: typing.Dict) -> None:
+    '''
+    Called by a worker process before it runs jobs
+    '''
+    global _cancelled
+    _cancelled = cancelled
+    signal.signal(CANCEL_SIGNAL, _on_signal)
+
+
+def watch(interval: float = 1.0) -> None:
+    '''
+    For workers the job manager cannot signal, e.g. remote workers: checks the shared dict for
+    the job of the worker every interval seconds instead.
+    '''
+    threading.Thread(target=_watch, args=(interval,), daemon=True).start()
+
+
+def _watch(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        if _confirmed or _signalled:
+            continue
+        if _lookup():
+            _on_signal(CANCEL_SIGNAL, None)
+
+
+def _on_signal(signum, frame) -> None:
+    global _signalled
+    _signalled = True
+
+
+def _lookup() -> bool:
+    if _cancelled is None or _job_id is None:
+        return False
+    try:
+        return _job_id in _cancelled
+    except Exception:
+        _logger.debug('Unable to read cancelled jobs', exc_info=True)
+        return False
+
+
+def start_job(job_id: int) -> bool:
+    '''
+    Makes job_id the job of this worker. Returns False if it was cancelled before it started.
+    '''
+    global _job_id, _signalled, _confirmed
+    _job_id = job_id
+    _signalled = False
+    _confirmed = _lookup()
+    return not _confirmed
+
+
+def finish_job() -> None:
+    global _job_id, _signalled, _confirmed
+    if _confirmed and _cancelled is not None:
+        try:
+            _cancelled.pop(_job_id, None)
+        except Exception:
+            pass
+    _job_id = None
+    _signalled = False
+    _confirmed = False
+
+
+def is_cancelled() -> bool:
+    global _signalled, _confirmed
+    if not _confirmed and _signalled:
+        _signalled = False
+        _confirmed = _lookup()
+    return _confirmed
+
+
+def check_cancelled() -> None:
+    '''
+    Raises JobCancelled if the job of this worker was cancelled
+    '''
+    if is_cancelled():
+        raise JobCancelled(f'Job {_job_id} cancelled')
@@ -0,0 +1,276 @@
+'''
+Backends running the workers of the job manager.
+
+ProcessBackend runs them as processes of this host, forked from a warm zygote when possible.
+SocketBackend does the same, and also serves the queues and shared dicts of the job manager on
+a TCP address. Workers on other hosts, started with
+
+    python -m dsbox.JobManager.remote_worker HOST:PORT --authkey KEY --processes N
+
+register there and run the same worker loop as the local workers: they receive the pickled job
+bundles, and put their results and log records back. The job manager counts them as additional
+workers while their heartbeat arrives.
+
+Remote hosts need the same code and primitives installed. The search datasets saved in
+D3MLOCALDIR are fetched from the coordinator by dataset name, see Coordinator.fetch_dataset.
+Objects bound to the coordinator host, e.g. the shared primitive cache, are replaced in the job
+bundles by DistributedJobManager.remote_bundle_function.
+'''
+import itertools
+import logging
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+import typing
+
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager, DictProxy, ValueProxy
+
+from dsbox.JobManager.zygote import WarmWorker, Zygote
+
+_logger = logging.getLogger(__name__)
+
+# Shared objects of the job manager served to remote workers, by the proxy type they use
+_SHARED_DICTS = ('worker_status', 'cancelled', 'log_stats', 'heartbeats')
+_QUEUE_METHODS = ('get', 'put', 'empty', 'full', 'qsize')
+
+
+class CoordinatorManager(BaseManager):
+    '''
+    Manager serving the job manager to remote workers, and connecting remote workers to it
+    '''
+    pass
+
+
+for _name in _SHARED_DICTS:
+    CoordinatorManager.register(_name, proxytype=DictProxy)
+CoordinatorManager.register('generation', proxytype=ValueProxy)
+for _name in ('arguments_queue', 'result_queue', 'log_queue'):
+    CoordinatorManager.register(_name, exposed=_QUEUE_METHODS)
+CoordinatorManager.register('coordinator', exposed=('register', 'unregister', 'datasets', 'fetch_dataset'))
+
+
+class ProcessBackend:
+    """
+    Runs the workers as processes of this host
+
+    Args:
+        job_manager: DistributedJobManager whose worker arguments are set
+        target: function run by the workers
+    """
+    def __init__(self, job_manager, target: typing.Callable) -> None:
+        self.target = target
+        self.worker_args = job_manager._worker_args
+        self.zygote: Zygote = None
+        if job_manager.job_setting.warm_workers:
+            try:
+                self.zygote = Zygote(job_manager.manager, target, self.worker_args)
+            except Exception:
+                _logger.warning('Unable to start the zygote, forking workers from the main process',
+                                exc_info=True)
+
+    def remote_workers(self) -> typing.Dict[str, typing.Dict]:
+        '''
+        Worker name -> {'host', 'pid', 'registered'} of the registered remote workers
+        '''
+        return {}
+
+    def drop_remote_worker(self, name: str) -> None:
+        pass
+
+    def spawn(self, name: str, extra_args: typing.Tuple) -> typing.Union[Process, WarmWorker]:
+        if self.zygote is not None:
+            try:
+                return self.zygote.spawn(name, extra_args)
+            except (OSError, EOFError):
+                _logger.warning('Zygote is gone, forking workers from the main process', exc_info=True)
+                self.zygote = None
+        worker = Process(target=self.target, args=(self.worker_args + extra_args,), name=name, daemon=True)
+        worker.start()
+        return worker
+
+    def preload(self, python_paths: typing.Iterable[str]) -> int:
+        '''
+        Imports the given primitives into the zygote. Returns how many were loaded.
+        '''
+        if self.zygote is None:
+            return 0
+        try:
+            return self.zygote.preload(python_paths)
+        except (OSError, EOFError):
+            _logger.warning('Unable to preload primitives, the zygote is gone', exc_info=True)
+            self.zygote = None
+            return 0
+
+    def stop(self) -> None:
+        if self.zygote is not None:
+            self.zygote.stop()
+
+
+class SocketBackend(ProcessBackend):
+    """
+    Runs local workers like ProcessBackend, and serves the job manager to remote workers
+
+    Args:
+        job_manager: DistributedJobManager whose worker arguments are set
+        target: function run by the local workers
+        address: (host, port) to listen on. Port 0 picks a free port, see self.address.
+        authkey: key the remote workers must present
+    """
+    def __init__(self, job_manager, target: typing.Callable, address: typing.Tuple[str, int],
+                 authkey: bytes) -> None:
+        super().__init__(job_manager, target)
+        self._remote: typing.Dict[str, typing.Dict] = {}
+        self._remote_lock = threading.Lock()
+        coordinator = Coordinator(self, job_manager)
+        arguments_queue = _RemoteArgumentsQueue(job_manager)
+        # Registering again replaces the objects of a previous job manager of this process
+        for name in _SHARED_DICTS:
+            CoordinatorManager.register(name, callable=_constant(getattr(job_manager, name)),
+                                        proxytype=DictProxy)
+        CoordinatorManager.register('generation', callable=_constant(job_manager.generation),
+                                    proxytype=ValueProxy)
+        CoordinatorManager.register('arguments_queue', callable=_constant(arguments_queue),
+                                    exposed=_QUEUE_METHODS)
+        CoordinatorManager.register('result_queue', callable=_constant(job_manager.result_queue.queue),
+                                    exposed=_QUEUE_METHODS)
+        CoordinatorManager.register('log_queue', callable=_constant(job_manager.log_queue.queue),
+                                    exposed=_QUEUE_METHODS)
+        CoordinatorManager.register('coordinator', callable=_constant(coordinator),
+                                    exposed=('register', 'unregister', 'datasets', 'fetch_dataset'))
+        self._server = CoordinatorManager(address=address, authkey=authkey).get_server()
+        self.address = self._server.address
+        threading.Thread(target=self._server.serve_forever, name='Coordinator', daemon=True).start()
+        _logger.info(f'Waiting for remote workers on {socket.gethostname()}:{self.address[1]}')
+
+    def remote_workers(self) -> typing.Dict[str, typing.Dict]:
+        with self._remote_lock:
+            return dict(self._remote)
+
+    def drop_remote_worker(self, name: str) -> None:
+        with self._remote_lock:
+            self._remote.pop(name, None)
+
+    def stop(self) -> None:
+        super().stop()
+        self._server.stop_event.set()
+        try:
+            self._server.listener.close()
+        except OSError:
+            pass
+
+
+class Coordinator:
+    '''
+    Methods called by the remote workers
+    '''
+    def __init__(self, backend: SocketBackend, job_manager) -> None:
+        self._backend = backend
+        self._job_manager = job_manager
+        self._counter = itertools.count()
+
+    def register(self, host: str, pid: int) -> typing.Dict:
+        '''
+        Adds a remote worker. Returns its name, its recycling limits and the job setting.
+        '''
+        job_manager = self._job_manager
+        name = f'Remote-{host}-{next(self._counter)}'
+        with self._backend._remote_lock:
+            self._backend._remote[name] = {'host': host, 'pid': pid, 'registered': time.time()}
+        _logger.info(f'{name} registered, pid {pid}')
+        # The memory of remote hosts is not known here
+        recycle = (job_manager.job_setting.worker_max_jobs, job_manager.job_setting.worker_max_rss_bytes,
+                   job_manager.generation.value)
+        return {'name': name, 'recycle': recycle, 'job_setting': job_manager.job_setting}
+
+    def unregister(self, name: str) -> None:
+        self._backend.drop_remote_worker(name)
+        _logger.info(f'{name} unregistered')
+
+    def datasets(self) -> typing.Dict[str, int]:
+        '''
+        Dataset name -> modification time of the datasets saved by save_pickled_dataset
+        '''
+        base_dir = os.environ.get('D3MLOCALDIR', '/tmp')
+        versions = {}
+        for entry in os.scandir(base_dir):
+            if entry.name.endswith('.pkl') and entry.is_file():
+                versions[entry.name[:-len('.pkl')]] = entry.stat().st_mtime_ns
+        return versions
+
+    def fetch_dataset(self, dataset_name: str) -> bytes:
+        '''
+        Pickled dataset, with its shared memory segments resolved
+        '''
+        # search_utils imports d3m
+        from dsbox.combinatorial_search.search_utils import load_pickled_dataset
+        return pickle.dumps(load_pickled_dataset(dataset_name), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class _RemoteArgumentsQueue:
+    '''
+    Arguments queue of the job manager, adapting the job bundles for remote workers
+    '''
+    def __init__(self, job_manager) -> None:
+        self._job_manager = job_manager
+
+    def get(self, block: bool = True, timeout: float = None) -> typing.Dict:
+        job_manager = self._job_manager
+        bundle = job_manager.arguments_queue.get(block=block, timeout=timeout)
+        try:
+            if job_manager.remote_bundle_function is not None:
+                bundle = job_manager.remote_bundle_function(bundle)
+            # Would otherwise be lost when sending it fails
+            pickle.dumps(bundle, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            _logger.exception(f'Unable to send job {bundle.get("job_id")} to a remote worker')
+            job_manager._report_job(bundle.get('job_id'))
+            raise queue.Empty
+        return bundle
+
+    def put(self, item, block=True, timeout=None):
+        self._job_manager.arguments_queue.put(item, block=block, timeout=timeout)
+
+    def empty(self) -> bool:
+        return self._job_manager.arguments_queue.empty()
+
+    def full(self) -> bool:
+        return self._job_manager.arguments_queue.full()
+
+    def qsize(self) -> int:
+        return self._job_manager.arguments_queue.qsize()
+
+
+def _constant(value: typing.Any) -> typing.Callable[[], typing.Any]:
+    return lambda: value
+
+
+def parse_address(address: str) -> typing.Tuple[str, int]:
+    '''
+    'host:port' -> (host, port)
+    '''
+    host, _, port = address.rpartition(':')
+    return (host or '0.0.0.0', int(port or 0))
+
+
+def create_backend(job_manager, target: typing.Callable) -> ProcessBackend:
+    '''
+    Backend selected by job_manager.job_setting.executor
+    '''
+    setting = job_manager.job_setting
+    if setting.executor == 'socket' and not setting.executor_authkey:
+        # Job bundles are unpickled, only accept workers presenting a key
+        _logger.warning('DSBOX_EXECUTOR_AUTHKEY is not set, running local workers only')
+    elif setting.executor == 'socket':
+        try:
+            return SocketBackend(job_manager, target, parse_address(setting.executor_address),
+                                 setting.executor_authkey.encode())
+        except OSError:
+            _logger.warning(f'Unable to listen on {setting.executor_address}, running local workers only',
+                            exc_info=True)
+    elif setting.executor != 'process':
+        _logger.warning(f'Unknown executor {setting.executor}, running local workers only')
+    return ProcessBackend(job_manager, target)
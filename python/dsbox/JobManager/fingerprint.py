@@ -0,0 +1,268 @@
+'''
+Stable content fingerprints used to build cache keys.
+
+Python's builtin ``hash()`` is salted per interpreter (PYTHONHASHSEED), so keys built with
+it cannot be shared between processes started independently or reused across runs. The
+functions in this module return hex digests computed with blake2b over the raw column
+buffers of the data and over a canonical encoding of primitive hyperparameters.
+'''
+import enum
+import hashlib
+import json
+import logging
+import math
+import re
+import typing
+
+import numpy as np
+import pandas as pd
+
+from d3m.container.dataset import Dataset
+from d3m.primitive_interfaces.base import PrimitiveBase
+
+_logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16
+
+_ADDRESS_PATTERN = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def new_hasher() -> 'hashlib.blake2b':
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def combine(*parts: typing.Any) -> str:
+    '''
+    Digest of a sequence of already computed fingerprints (or other strings).
+    '''
+    hasher = new_hasher()
+    for part in parts:
+        data = str(part).encode('utf-8')
+        # Length prefix so that ('ab', 'c') and ('a', 'bc') differ
+        hasher.update(len(data).to_bytes(8, 'little'))
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _buffer_bytes(array: np.ndarray) -> memoryview:
+    '''
+    Bytes of a contiguous array. The buffer protocol does not support datetimes and timedeltas,
+    their int64 view has the same bytes.
+    '''
+    if array.dtype.kind in 'mM':
+        array = array.view(np.int64)
+    return memoryview(array).cast('B')
+
+
+def _update_column(hasher, column: pd.Series) -> None:
+    values = column.values
+    if isinstance(values, np.ndarray) and values.dtype != np.object_:
+        # Columns of a homogeneous block are contiguous rows of the block, so this does not copy
+        buffer = np.ascontiguousarray(values)
+        hasher.update(str(buffer.dtype).encode('utf-8'))
+        hasher.update(_buffer_bytes(buffer))
+        return
+
+    if len(column) > 0 and isinstance(column.iloc[0], np.ndarray):
+        # v2019.6.30: hashing large ndarray cells (e.g. images) is very slow, so only the
+        # shape of the column enters the fingerprint. The dataset id and digest are added
+        # by the caller.
+        _logger.warning("Not hashing content of ndarray column: {}".format(column.name))
+        hasher.update(b'ndarray-column')
+        return
+
+    try:
+        hashed = pd.util.hash_pandas_object(column, index=False).values
+    except TypeError:
+        # Unhashable cells such as lists or dicts
+        hashed = pd.util.hash_pandas_object(column.map(repr), index=False).values
+    hasher.update(b'object-column')
+    hasher.update(_buffer_bytes(np.ascontiguousarray(hashed)))
+
+
+def dataframe_fingerprint(dataframe: pd.DataFrame) -> str:
+    '''
+    Fingerprint of a dataframe, computed one column at a time so that no contiguous copy of
+    the whole frame is needed.
+    '''
+    hasher = new_hasher()
+    hasher.update(repr(dataframe.shape).encode('utf-8'))
+    for i in range(dataframe.shape[1]):
+        hasher.update(repr(dataframe.columns[i]).encode('utf-8'))
+        _update_column(hasher, dataframe.iloc[:, i])
+    return hasher.hexdigest()
+
+
+def ndarray_fingerprint(array: np.ndarray) -> str:
+    hasher = new_hasher()
+    hasher.update(repr(array.shape).encode('utf-8'))
+    hasher.update(str(array.dtype).encode('utf-8'))
+    if array.dtype == np.object_:
+        hasher.update(repr(array.tolist()).encode('utf-8'))
+    else:
+        hasher.update(_buffer_bytes(np.ascontiguousarray(array)))
+    return hasher.hexdigest()
+
+
+def value_fingerprint(value: typing.Any) -> str:
+    '''
+    Fingerprint of a primitive argument: a Dataset, a DataFrame, an ndarray or a list of
+    those (timeseries inputs).
+    '''
+    if isinstance(value, pd.DataFrame):
+        return dataframe_fingerprint(value)
+    if isinstance(value, Dataset):
+        parts = ['dataset']
+        for resource_id in sorted(value.keys()):
+            parts.append(resource_id)
+            parts.append(value_fingerprint(value[resource_id]))
+        return combine(*parts)
+    if isinstance(value, np.ndarray):
+        return ndarray_fingerprint(value)
+    if isinstance(value, (list, tuple)):
+        return combine('list', *[value_fingerprint(item) for item in value])
+    return combine('repr', _stable_repr(value))
+
+
+def _stable_repr(value: typing.Any) -> str:
+    return _ADDRESS_PATTERN.sub('', repr(value))
+
+
+def canonical(value: typing.Any) -> typing.Any:
+    '''
+    Converts a hyperparameter value into a JSON-serializable structure that does not depend
+    on object identity or dict ordering.
+    '''
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, enum.Enum):
+        return {'enum': type(value).__name__, 'name': value.name}
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            return {'float': repr(value)}
+        return value
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.ndarray):
+        return {'ndarray': ndarray_fingerprint(value)}
+    if isinstance(value, typing.Mapping):
+        return {'mapping': sorted([[str(k), canonical(v)] for k, v in value.items()],
+                                   key=lambda item: item[0])}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return {'set': sorted([json.dumps(canonical(item), sort_keys=True) for item in value])}
+    if isinstance(value, PrimitiveBase):
+        return {
+            'primitive': primitive_identity(type(value)),
+            'hyperparams': canonical(value.hyperparams),
+        }
+    if isinstance(value, type):
+        return {'type': f'{value.__module__}.{value.__qualname__}'}
+    return {'repr': _stable_repr(value)}
+
+
+def canonical_fingerprint(value: typing.Any) -> str:
+    encoded = json.dumps(canonical(value), sort_keys=True, separators=(',', ':'))
+    return combine(encoded)
+
+
+def hyperparams_fingerprint(hyperparams: typing.Optional[typing.Mapping]) -> str:
+    if hyperparams is None:
+        hyperparams = {}
+    return canonical_fingerprint(hyperparams)
+
+
+def primitive_identity(primitive: typing.Type[PrimitiveBase]) -> str:
+    '''
+    Python path, id and version of a primitive class.
+    '''
+    try:
+        metadata = primitive.metadata.query()
+        return '{}@{}@{}'.format(metadata['python_path'], metadata['id'], metadata['version'])
+    except Exception:
+        return str(primitive)
+
+
+# Fingerprints propagated through container metadata
+
+METADATA_KEY = 'dsbox_fingerprint'
+
+
+def _structure_guard(value: typing.Any) -> str:
+    '''
+    Cheap summary of a container, stored next to its fingerprint. Primitives such as the
+    dataset splitters copy top-level metadata into their outputs; the guard prevents an
+    output from inheriting the fingerprint of its input.
+    '''
+    if isinstance(value, pd.DataFrame):
+        hasher = new_hasher()
+        hasher.update(repr(value.shape).encode('utf-8'))
+        hasher.update(repr(list(value.columns)).encode('utf-8'))
+        if value.shape[1] > 0:
+            _update_column(hasher, value.iloc[:, 0])
+        return hasher.hexdigest()
+    if isinstance(value, Dataset):
+        return combine(*[part for resource_id in sorted(value.keys())
+                         for part in (resource_id, _structure_guard(value[resource_id]))])
+    if isinstance(value, (list, tuple)):
+        return combine('list', len(value))
+    return combine('type', type(value).__name__)
+
+
+def attach_fingerprint(value: typing.Any, value_fingerprint: str) -> None:
+    '''
+    Records the fingerprint in the top-level metadata of a d3m container, in place.
+    '''
+    metadata = getattr(value, 'metadata', None)
+    if metadata is None:
+        return
+    try:
+        value.metadata = metadata.update((), {
+            METADATA_KEY: {
+                'fingerprint': value_fingerprint,
+                'guard': _structure_guard(value),
+            }
+        })
+    except Exception:
+        _logger.debug('Unable to attach fingerprint to {}'.format(type(value)), exc_info=True)
+
+
+def get_fingerprint(value: typing.Any) -> typing.Optional[str]:
+    '''
+    Returns the fingerprint attached to a d3m container, or None if there is none or it was
+    copied from another container.
+    '''
+    metadata = getattr(value, 'metadata', None)
+    if metadata is None:
+        return None
+    try:
+        entry = metadata.query(()).get(METADATA_KEY)
+    except Exception:
+        return None
+    if not entry or entry.get('guard') != _structure_guard(value):
+        return None
+    return entry.get('fingerprint')
+
+
+def ensure_fingerprint(value: typing.Any) -> str:
+    '''
+    Returns the attached fingerprint, computing the content hash and attaching it if needed.
+    Only raw pipeline inputs should need the content hash.
+    '''
+    result = get_fingerprint(value)
+    if result is None:
+        result = value_fingerprint(value)
+        attach_fingerprint(value, result)
+    return result
+
+
+def derive_output_fingerprint(step_fingerprint: str, output_id: str) -> str:
+    '''
+    Fingerprint of a step output, derived from the step's cache key (which covers the
+    primitive, its hyperparameters and its input fingerprints).
+    '''
+    return combine('output', step_fingerprint, output_id)
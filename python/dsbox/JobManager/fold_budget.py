@@ -0,0 +1,103 @@
+'''
+CPU budget for the cross-validation folds a search worker runs in parallel.
+
+The job manager shares the number of CPUs of the search, D3MCPU, with its workers, and reserves
+one for each local worker. A worker about to run the folds of a cross-validation borrows the
+CPUs left over for extra fold processes with acquire(), and gives them back with release(). The
+processes of the search therefore never exceed D3MCPU. The CPUs borrowed by a worker are
+recorded under its name, so the job manager returns them when it replaces the worker.
+
+Each fold process is forked from the worker and may grow as large as the worker, so acquire()
+also grants no more CPUs than the memory available holds fold processes of that size.
+
+Outside of the workers nothing is installed and acquire() grants nothing.
+'''
+import logging
+import typing
+
+import psutil
+
+from multiprocessing import current_process
+
+_logger = logging.getLogger(__name__)
+
+# (lock, {'cpus', 'reserved', worker name -> borrowed}) shared with the job manager
+_budget: typing.Optional[typing.Tuple[typing.Any, typing.Dict]] = None
+
+_RESERVED_KEYS = ('cpus', 'reserved')
+
+# Fraction of the available memory fold processes may take
+AVAILABLE_MEMORY_FRACTION = 0.8
+
+
+def install(budget: typing.Optional[typing.Tuple[typing.Any, typing.Dict]]) -> None:
+    '''
+    Called by a worker process before it runs jobs
+    '''
+    global _budget
+    _budget = budget
+
+
+def _borrowed(state: typing.Dict) -> int:
+    return sum(value for key, value in state.items() if key not in _RESERVED_KEYS)
+
+
+def _fitting_in_memory() -> int:
+    '''
+    Number of fold processes the available memory holds, if each grows as large as this process
+    '''
+    try:
+        size = psutil.Process().memory_info().rss
+        available = psutil.virtual_memory().available
+    except psutil.Error:
+        return 0
+    if size <= 0:
+        return 0
+    return int(available * AVAILABLE_MEMORY_FRACTION // size)
+
+
+def acquire(wanted: int) -> int:
+    '''
+    Borrows up to wanted idle CPUs, as many as fold processes fit in memory. Returns how many
+    were granted.
+    '''
+    if _budget is None or wanted <= 0:
+        return 0
+    fitting = _fitting_in_memory()
+    if fitting < wanted:
+        _logger.debug(f'Memory available for {fitting} of {wanted} fold processes')
+        wanted = fitting
+        if wanted <= 0:
+            return 0
+    lock, state = _budget
+    name = current_process().name
+    try:
+        with lock:
+            free = state['cpus'] - state['reserved'] - _borrowed(state)
+            granted = max(0, min(wanted, free))
+            if granted:
+                state[name] = state.get(name, 0) + granted
+    except Exception:
+        # The manager is gone
+        _logger.debug('Unable to borrow CPUs', exc_info=True)
+        return 0
+    return granted
+
+
+def release(count: int) -> None:
+    '''
+    Gives back CPUs granted by acquire()
+    '''
+    if _budget is None or count <= 0:
+        return
+    lock, state = _budget
+    name = current_process().name
+    try:
+        with lock:
+            remaining = state.get(name, 0) - count
+            if remaining > 0:
+                state[name] = remaining
+            else:
+                state.pop(name, None)
+    except Exception:
+        _logger.debug('Unable to give back CPUs', exc_info=True)
@@ -0,0 +1,52 @@
+'''
+Heartbeats of the search workers.
+
+A thread in each worker publishes, every HEARTBEAT_INTERVAL seconds, the id of the job the worker
+runs and the pipeline step the job is at, with the time the step started. The runtime reports
+steps through set_step(). The job manager tells that a remote worker is gone when its heartbeat
+stops. It does not take a late heartbeat for a stalled job, long C calls of primitives hold the
+interpreter lock: a job stalls when its step does not change and its processes do not use CPU,
+see DistributedJobManager._is_stalled.
+
+Outside of the workers nothing is installed and set_step() only records the step locally.
+'''
+import threading
+import time
+import typing
+
+HEARTBEAT_INTERVAL = 5.0
+
+_job_id: typing.Optional[int] = None
+_step: typing.Optional[str] = None
+_step_started: float = 0.0
+
+
+def install(heartbeats: typing.Dict, name: str) -> None:
+    '''
+    Called by a worker process before it runs jobs. Starts publishing heartbeats[name].
+    '''
+    threading.Thread(target=_beat, args=(heartbeats, name), daemon=True).start()
+
+
+def _beat(heartbeats: typing.Dict, name: str) -> None:
+    while True:
+        try:
+            heartbeats[name] = {'time': time.time(), 'job_id': _job_id, 'step': _step,
+                                'step_started': _step_started}
+        except Exception:
+            # The manager is gone
+            return
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def start_job(job_id: typing.Optional[int]) -> None:
+    global _job_id, _step, _step_started
+    _job_id = job_id
+    _step = None
+    _step_started = time.time()
+
+
+def set_step(step: str) -> None:
+    global _step, _step_started
+    _step = step
+    _step_started = time.time()
@@ -0,0 +1,143 @@
+'''
+Runs search workers on this host for a job manager on another host, see executor.
+
+    python -m dsbox.JobManager.remote_worker HOST:PORT --authkey KEY --processes N
+
+HOST:PORT is DSBOX_EXECUTOR_ADDRESS of the coordinator and KEY its DSBOX_EXECUTOR_AUTHKEY. Each
+of the N worker processes registers with the coordinator and runs the worker loop of the job
+manager. A worker process that exits, e.g. recycled after max jobs, is replaced by a new one.
+All exit once the coordinator is gone.
+
+The datasets of the search are fetched from the coordinator into --local-dir when they change.
+'''
+import argparse
+import functools
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+import typing
+
+from multiprocessing import Process, current_process
+
+from dsbox.JobManager import cancellation
+from dsbox.JobManager import executor
+from dsbox.JobManager import shared_files
+from dsbox.JobManager.DistributedJobManager import DistributedJobManager, QueueWrapper
+
+_logger = logging.getLogger(__name__)
+
+# Exit code of worker processes that lost the coordinator
+EXIT_DISCONNECTED = 3
+
+# Seconds between two checks of the worker processes
+CHECK_INTERVAL = 1.0
+
+
+def _sync_datasets(coordinator, local_dir: str) -> None:
+    '''
+    Fetches the datasets of the coordinator that changed since they were last fetched
+    '''
+    versions = coordinator.datasets()
+    for dataset_name, version in versions.items():
+        dataset_path = os.path.join(local_dir, dataset_name + '.pkl')
+        version_path = os.path.join(local_dir, dataset_name + '.version')
+        try:
+            with open(version_path) as fd:
+                if fd.read() == str(version) and os.path.exists(dataset_path):
+                    continue
+        except OSError:
+            pass
+        start = time.perf_counter()
+        data = coordinator.fetch_dataset(dataset_name)
+        # Other worker processes of this host may read the dataset meanwhile
+        shared_files.write_atomic(dataset_path, lambda out: out.write(data))
+        with open(version_path, 'w') as out:
+            out.write(str(version))
+        _logger.info(f'Fetched {dataset_name}, {len(data)/1024**2:.0f} MB in {time.perf_counter() - start:.1f}s')
+    for entry in os.scandir(local_dir):
+        if entry.name.endswith('.pkl') and entry.name[:-len('.pkl')] not in versions:
+            os.remove(entry.path)
+
+
+def _run_job(coordinator, local_dir: str, target_obj: typing.Any, target_method: str,
+             kwargs: typing.Dict = {}) -> typing.Any:
+    _sync_datasets(coordinator, local_dir)
+    return DistributedJobManager._posted_job_wrapper(target_obj, target_method, kwargs)
+
+
+def run_worker(address: typing.Tuple[str, int], authkey: bytes, local_dir: str) -> None:
+    '''
+    Registers with the coordinator and runs jobs until the worker is recycled
+    '''
+    manager = executor.CoordinatorManager(address=address, authkey=authkey)
+    try:
+        manager.connect()
+        coordinator = manager.coordinator()
+        registration = coordinator.register(socket.gethostname(), os.getpid())
+    except (OSError, EOFError):
+        sys.exit(EXIT_DISCONNECTED)
+    name = registration['name']
+    current_process().name = name
+    DistributedJobManager.job_setting = registration['job_setting']
+
+    cancelled = manager.cancelled()
+    # The coordinator cannot signal this process
+    cancellation.watch()
+    args = (QueueWrapper('arguments', manager.arguments_queue()),
+            QueueWrapper('result', manager.result_queue()),
+            functools.partial(_run_job, coordinator, local_dir),
+            QueueWrapper('log', manager.log_queue()),
+            DistributedJobManager._log_configurer,
+            manager.worker_status(), cancelled,
+            # Results are sent whole, the spool directory of the coordinator is not shared
+            None,
+            manager.generation(), manager.log_stats(), manager.heartbeats(),
+            # The CPUs of this host are not in the budget of the coordinator, no parallel folds
+            None,
+            registration['recycle'])
+    DistributedJobManager._internal_worker_process(args)
+    try:
+        coordinator.unregister(name)
+    except (OSError, EOFError):
+        sys.exit(EXIT_DISCONNECTED)
+
+
+def main(argv: typing.List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description='Run search workers for a remote job manager')
+    parser.add_argument('address', help='HOST:PORT of the coordinator')
+    parser.add_argument('--authkey', default=os.environ.get('DSBOX_EXECUTOR_AUTHKEY', ''),
+                        help='DSBOX_EXECUTOR_AUTHKEY of the coordinator')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--local-dir', default=None,
+                        help='directory of the fetched datasets, by default a temporary directory')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s -- %(message)s')
+    local_dir = args.local_dir or tempfile.mkdtemp(prefix='dsbox_remote_')
+    os.makedirs(local_dir, exist_ok=True)
+    # Read by load_pickled_dataset in the worker processes
+    os.environ['D3MLOCALDIR'] = local_dir
+    address = executor.parse_address(args.address)
+    authkey = args.authkey.encode()
+
+    workers: typing.List[typing.Optional[Process]] = [None] * args.processes
+    while True:
+        for slot, worker in enumerate(workers):
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None and worker.exitcode == EXIT_DISCONNECTED:
+                _logger.info('Coordinator is gone')
+                for other in workers:
+                    if other is not None and other.is_alive():
+                        other.terminate()
+                return
+            workers[slot] = Process(target=run_worker, args=(address, authkey, local_dir), daemon=True)
+            workers[slot].start()
+        time.sleep(CHECK_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
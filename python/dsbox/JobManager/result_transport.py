@@ -0,0 +1,198 @@
+'''
+Out-of-band transport of the large values in the results of the search workers.
+
+Before putting its result on the result queue a worker calls offload(). DataFrames and ndarrays
+of at least MIN_ARTIFACT_BYTES, e.g. the predictions on the ensemble tuning dataset, are written
+into the spool directory of the job manager and replaced by an Artifact, so only a small
+reference goes through the Manager process. Mostly numeric values are written as shared memory
+segments, the others are pickled. Artifact.load() reads the value back when it is needed, and
+removes it from the spool directory; ArtifactDict does so on access. The job manager calls
+discard() on the results it drops, e.g. the second result of a job run speculatively.
+
+The spool directory belongs to the process that created it. It outlives the workers that wrote
+into it, and is removed, with the artifacts never loaded, by remove_spool() or when its owner
+exits.
+'''
+import atexit
+import logging
+import os
+import pickle
+import psutil
+import re
+import shutil
+import typing
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from dsbox.JobManager import shared_memory
+
+_logger = logging.getLogger(__name__)
+
+SPOOL_PREFIX = 'dsbox_results_'
+
+# Smaller values are cheaper to send through the result queue
+MIN_ARTIFACT_BYTES = 1024**2
+
+_SPOOL_PATTERN = re.compile(r'^' + SPOOL_PREFIX + r'(\d+)$')
+
+# Spool directories created by this process
+_owned_spools: typing.Set[str] = set()
+
+
+class Artifact:
+    '''
+    Picklable reference to a value written into a spool directory
+    '''
+    def __init__(self, path: str, size: int, handle: shared_memory.SegmentHandle = None) -> None:
+        self.path = path
+        self.size = size
+        self.handle = handle
+
+    def load(self) -> typing.Any:
+        '''
+        Reads the value and removes it from the spool directory, an Artifact is loaded once.
+        Raises OSError if the spool directory was removed.
+        '''
+        if self.handle is not None:
+            # The mapping outlives the segment file
+            value = shared_memory.attach(self.handle)
+        else:
+            with open(self.path, 'rb') as fd:
+                value = pickle.load(fd)
+        self.discard()
+        return value
+
+    def discard(self) -> None:
+        '''
+        Removes the value from the spool directory without reading it
+        '''
+        if self.handle is not None:
+            shared_memory.release(self.handle)
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return f'Artifact({self.path}, {self.size} bytes)'
+
+
+class ArtifactDict(dict):
+    '''
+    Dict that loads its Artifact values on access
+    '''
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, Artifact):
+            value = value.load()
+            self[key] = value
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def make_spool(directory: str = shared_memory.SHARED_MEMORY_DIR) -> typing.Optional[str]:
+    '''
+    Creates the spool directory of this process. Returns None if it cannot be created, results
+    are then sent whole.
+    '''
+    cleanup_dead_spools(directory)
+    path = os.path.join(directory, f'{SPOOL_PREFIX}{os.getpid()}')
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        _logger.warning(f'Unable to create spool directory {path}', exc_info=True)
+        return None
+    _owned_spools.add(path)
+    return path
+
+
+def remove_spool(path: str) -> None:
+    shutil.rmtree(path, ignore_errors=True)
+    _owned_spools.discard(path)
+
+
+def cleanup_dead_spools(directory: str = shared_memory.SHARED_MEMORY_DIR) -> None:
+    '''
+    Removes the spool directories of processes that no longer exist
+    '''
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        match = _SPOOL_PATTERN.match(name)
+        if match and not psutil.pid_exists(int(match.group(1))):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def _spool(value: typing.Any, spool_dir: str, min_bytes: int) -> typing.Optional[Artifact]:
+    path = os.path.join(spool_dir, uuid.uuid4().hex)
+    handle = shared_memory.share(value, path=path + shared_memory.SEGMENT_SUFFIX, min_bytes=min_bytes)
+    if isinstance(handle, shared_memory.SegmentHandle):
+        return Artifact(handle.path, handle.size, handle)
+    try:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    if len(data) < min_bytes:
+        return None
+    path += '.pkl'
+    try:
+        with open(path, 'xb') as out:
+            out.write(data)
+    except OSError:
+        _logger.warning(f'Unable to write artifact {path}', exc_info=True)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return Artifact(path, len(data))
+
+
+def offload(result: typing.Any, spool_dir: typing.Optional[str],
+            min_bytes: int = MIN_ARTIFACT_BYTES) -> typing.Any:
+    '''
+    Returns result with its large DataFrame and ndarray values replaced by Artifacts. Other
+    results are returned unchanged.
+    '''
+    if not spool_dir or type(result) is not dict:
+        return result
+    offloaded = result
+    for key, value in result.items():
+        if isinstance(value, (pd.DataFrame, np.ndarray)):
+            artifact = _spool(value, spool_dir, min_bytes)
+            if artifact is not None:
+                if offloaded is result:
+                    offloaded = dict(result)
+                offloaded[key] = artifact
+                _logger.debug(f'Result {key} sent as {artifact}')
+    return offloaded
+
+
+def discard(result: typing.Any) -> None:
+    '''
+    Removes the Artifacts of a result returned by offload() that will not be used
+    '''
+    if type(result) is not dict:
+        return
+    for value in result.values():
+        if isinstance(value, Artifact):
+            value.discard()
+
+
+def _remove_owned_spools() -> None:
+    # Forked children inherit the set, only remove what this process created
+    name = f'{SPOOL_PREFIX}{os.getpid()}'
+    for path in list(_owned_spools):
+        if os.path.basename(path) == name:
+            shutil.rmtree(path, ignore_errors=True)
+    _owned_spools.clear()
+
+
+atexit.register(_remove_owned_spools)
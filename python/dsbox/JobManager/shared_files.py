@@ -0,0 +1,92 @@
+'''
+Files shared by the processes of the search through D3MLOCALDIR or the cache directories.
+
+Writers replace a file atomically with write_atomic() or dump_atomic(), so readers never see a
+partial file, and processes writing the same file do not interfere. Readers keep what they
+loaded from a file in a ResidentValue, which loads the file again only once it was replaced.
+'''
+import os
+import pickle
+import typing
+
+
+def temp_path(path: str) -> str:
+    '''
+    Temporary file of this process that is written before it replaces path
+    '''
+    return f'{path}.{os.getpid()}.tmp'
+
+
+def write_atomic(path: str, write: typing.Callable[[typing.IO], None], mode: str = 'wb') -> None:
+    '''
+    Writes the file with write(fd) into a temporary file that then replaces path. Raises what
+    write or the file system raise, after removing the temporary file.
+    '''
+    temp = temp_path(path)
+    try:
+        with open(temp, mode) as out:
+            write(out)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def dump_atomic(path: str, value: typing.Any) -> None:
+    '''
+    Pickles value into path with write_atomic()
+    '''
+    write_atomic(path, lambda out: pickle.dump(value, out, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_pickle(path: str) -> typing.Any:
+    with open(path, 'rb') as fd:
+        return pickle.load(fd)
+
+
+def file_version(path: str) -> typing.Optional[typing.Tuple[int, int, int]]:
+    '''
+    Changes whenever the file is replaced or modified, None if there is no file
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class ResidentValue:
+    """
+    Value loaded from a file by this process, kept as long as the file does not change
+    """
+    def __init__(self) -> None:
+        self.version: typing.Optional[typing.Tuple[int, int, int]] = None
+        self.value: typing.Any = None
+
+    def get(self, path: str, load: typing.Callable[[str], typing.Any], default: typing.Any = None) -> typing.Any:
+        """
+        Returns the value of the file, loaded with load(path) if the file changed since it was
+        last loaded, or default if there is no file. Raises what load raises.
+
+        Args:
+            path: the file
+            load: reads the value of the file
+            default: value returned without a file
+        """
+        version = file_version(path)
+        if version is None:
+            self.clear()
+            return default
+        if version != self.version:
+            # Free the previous value before loading the new one
+            self.clear()
+            self.value = load(path)
+            self.version = version
+        return self.value
+
+    def clear(self) -> None:
+        self.version = None
+        self.value = None
@@ -0,0 +1,463 @@
+'''
+Shared memory data plane for the search processes.
+
+Large numeric buffers of DataFrames, ndarrays and d3m Datasets are written once into a named
+segment (a file in /dev/shm, or any directory given by the caller), and only a small
+SegmentHandle is pickled and passed between processes. attach() maps the segment copy-on-write
+and rebuilds the containers with their numeric columns backed by the mapping, so every process
+pages in the same physical memory and nothing is copied until a primitive writes to a column.
+
+Object and extension dtype columns, indices and d3m metadata are pickled into the segment as
+well. Values that are not worth sharing are returned unchanged by share(), so callers can always
+pickle whatever share() returns.
+
+Segments created without an explicit path are owned by the creating process: their names carry
+its pid, they are removed when it exits normally, and cleanup_dead_segments() removes the ones
+left behind by processes that died.
+
+save_columns() stores a value in the columnar layout instead, a directory meant to live on disk:
+one .npy file per numeric column, mapped by attach(), one pickle per object column, and a
+metadata sidecar holding the layout of the containers, their indices and the d3m metadata. Only
+the sidecar and the object columns are unpickled, the numeric columns are paged in from the page
+cache shared by all processes.
+
+Only numeric columns are mapped. Columns of Python objects, strings included, are rebuilt object
+by object in every process that attaches them, so their loading time still grows with the number
+of rows. Datasets loaded from CSV by d3m hold strings in every column until a primitive parses
+them, so they gain little from the columnar layout; parsed frames and predictions do.
+'''
+import atexit
+import logging
+import mmap
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import typing
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from d3m.container.dataset import Dataset
+
+_logger = logging.getLogger(__name__)
+
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SEGMENT_PREFIX = 'dsbox_'
+SEGMENT_SUFFIX = '.seg'
+
+# Values with fewer numeric bytes than this are cheaper to pickle
+MIN_SHARED_BYTES = 1024**2
+
+# Keep this fraction of the file system free
+_FREE_SPACE_MARGIN = 0.1
+
+_ALIGNMENT = 64
+_NUMERIC_KINDS = 'biufcmM'
+
+_SEGMENT_PATTERN = re.compile(r'^' + SEGMENT_PREFIX + r'(\d+)_[0-9a-f]+' + re.escape(SEGMENT_SUFFIX) + '$')
+
+# Segments created by this process in SHARED_MEMORY_DIR
+_owned_segments: typing.Set[str] = set()
+
+
+class SegmentHandle:
+    '''
+    Picklable reference to a value stored in a segment
+    '''
+    def __init__(self, path: str, size: int, spec_offset: int, spec_size: int) -> None:
+        self.path = path
+        self.size = size
+        self.spec_offset = spec_offset
+        self.spec_size = spec_size
+
+    def __repr__(self):
+        return f'SegmentHandle({self.path}, {self.size} bytes)'
+
+
+class _SegmentWriter:
+    def __init__(self) -> None:
+        self.chunks: typing.List[typing.Any] = []
+        self.size = 0
+        self.shared_bytes = 0
+
+    def add_buffer(self, array: np.ndarray) -> typing.Tuple[int, str, typing.Tuple]:
+        padding = -self.size % _ALIGNMENT
+        if padding:
+            self.chunks.append(bytes(padding))
+            self.size += padding
+        array = np.ascontiguousarray(array)
+        offset = self.size
+        self.chunks.append(array)
+        self.size += array.nbytes
+        self.shared_bytes += array.nbytes
+        return (offset, array.dtype.str, array.shape)
+
+    def add_bytes(self, data: bytes) -> int:
+        offset = self.size
+        self.chunks.append(data)
+        self.size += len(data)
+        return offset
+
+    def add_series(self, series: pd.Series) -> pd.Series:
+        return series.reset_index(drop=True)
+
+    def write(self, path: str) -> None:
+        with open(path, 'xb') as out:
+            for chunk in self.chunks:
+                if isinstance(chunk, np.ndarray):
+                    out.write(_raw_bytes(chunk))
+                else:
+                    out.write(chunk)
+
+
+def _raw_bytes(array: np.ndarray) -> memoryview:
+    '''
+    Bytes of a contiguous array, without a copy. Datetimes and timedeltas are not supported by
+    the buffer protocol, their int64 view has the same bytes and is decoded with their dtype.
+    '''
+    if array.dtype.kind in 'mM':
+        array = array.view(np.int64)
+    return memoryview(array).cast('B')
+
+
+class _SegmentReader:
+    def __init__(self, mapped: np.ndarray) -> None:
+        self.mapped = mapped
+
+    def buffer(self, buffer: typing.Tuple[int, str, typing.Tuple]) -> np.ndarray:
+        return _buffer_view(self.mapped, buffer)
+
+    def series(self, series: pd.Series) -> pd.Series:
+        return series.copy(deep=False)
+
+
+class ColumnsHandle:
+    '''
+    Picklable reference to a value stored by save_columns()
+    '''
+    def __init__(self, directory: str, size: int) -> None:
+        self.directory = directory
+        self.size = size
+
+    def __repr__(self):
+        return f'ColumnsHandle({self.directory}, {self.size} bytes)'
+
+
+class _ColumnWriter:
+    '''
+    Writes each column to a file of its own as it is encoded
+    '''
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.count = 0
+        self.size = 0
+        self.shared_bytes = 0
+
+    def _next_path(self, suffix: str) -> typing.Tuple[str, str]:
+        name = f'{self.count}{suffix}'
+        self.count += 1
+        return name, os.path.join(self.directory, name)
+
+    def add_buffer(self, array: np.ndarray) -> typing.Tuple[str, str, typing.Tuple]:
+        array = np.ascontiguousarray(array)
+        name, path = self._next_path('.npy')
+        np.save(path, array, allow_pickle=False)
+        self.size += os.path.getsize(path)
+        self.shared_bytes += array.nbytes
+        return (name, array.dtype.str, array.shape)
+
+    def add_series(self, series: pd.Series) -> str:
+        name, path = self._next_path('.pkl')
+        with open(path, 'wb') as out:
+            pickle.dump(series.reset_index(drop=True), out, protocol=pickle.HIGHEST_PROTOCOL)
+        self.size += os.path.getsize(path)
+        return name
+
+
+class _ColumnReader:
+    def __init__(self, directory: str, writable: bool) -> None:
+        self.directory = directory
+        # Copy-on-write, like segments
+        self.mmap_mode = 'c' if writable else 'r'
+
+    def buffer(self, buffer: typing.Tuple[str, str, typing.Tuple]) -> np.ndarray:
+        name, _, shape = buffer
+        path = os.path.join(self.directory, name)
+        if not all(shape):
+            # Empty files cannot be mapped
+            return np.load(path, allow_pickle=False)
+        return np.load(path, mmap_mode=self.mmap_mode, allow_pickle=False).view(np.ndarray)
+
+    def series(self, name: str) -> pd.Series:
+        with open(os.path.join(self.directory, name), 'rb') as fd:
+            return pickle.load(fd)
+
+
+def _is_numeric(values: typing.Any) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype.kind in _NUMERIC_KINDS and not values.dtype.hasobject
+
+
+def _encode(value: typing.Any, writer: _SegmentWriter) -> typing.Dict:
+    if isinstance(value, pd.DataFrame):
+        columns = []
+        for i in range(value.shape[1]):
+            column = value.iloc[:, i]
+            if _is_numeric(column.values):
+                columns.append(('buffer', writer.add_buffer(column.values)))
+            else:
+                # Object and extension dtype columns are pickled
+                columns.append(('series', writer.add_series(column)))
+        return {
+            'kind': 'frame',
+            'cls': type(value),
+            'names': list(value.columns),
+            'index': value.index,
+            'columns': columns,
+            'metadata': getattr(value, 'metadata', None),
+        }
+    if isinstance(value, Dataset):
+        return {
+            'kind': 'dataset',
+            'cls': type(value),
+            'resources': [(resource_id, _encode(resource, writer)) for resource_id, resource in value.items()],
+            'metadata': value.metadata,
+        }
+    if isinstance(value, np.ndarray) and _is_numeric(value):
+        return {
+            'kind': 'ndarray',
+            'cls': type(value),
+            'buffer': writer.add_buffer(value),
+            'metadata': getattr(value, 'metadata', None),
+        }
+    if isinstance(value, list):
+        return {
+            'kind': 'list',
+            'cls': type(value),
+            'items': [_encode(item, writer) for item in value],
+            'metadata': getattr(value, 'metadata', None),
+        }
+    if type(value) is dict:
+        return {
+            'kind': 'dict',
+            'items': [(key, _encode(item, writer)) for key, item in value.items()],
+        }
+    return {'kind': 'value', 'value': value}
+
+
+def _buffer_view(mapped: np.ndarray, buffer: typing.Tuple[int, str, typing.Tuple]) -> np.ndarray:
+    offset, dtype, shape = buffer
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape)) if shape else 1
+    return mapped[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+
+
+def _set_metadata(value: typing.Any, metadata: typing.Any) -> typing.Any:
+    if metadata is not None:
+        value.metadata = metadata
+    return value
+
+
+def _decode(spec: typing.Dict, reader: typing.Any) -> typing.Any:
+    kind = spec['kind']
+    if kind == 'frame':
+        index = spec['index']
+        parts = []
+        for position, (column_kind, column) in enumerate(spec['columns']):
+            if column_kind == 'buffer':
+                values = reader.buffer(column)
+                # A 2-d view becomes a block of its own, so the column is not copied
+                parts.append(pd.DataFrame(values.reshape(-1, 1), index=index, columns=[position], copy=False))
+            else:
+                column = reader.series(column)
+                column.index = index
+                parts.append(column.to_frame(name=position))
+        if parts:
+            frame = pd.concat(parts, axis=1, copy=False)
+        else:
+            frame = pd.DataFrame(index=index)
+        frame.columns = pd.Index(spec['names']) if spec['names'] else frame.columns
+        if spec['cls'] is not pd.DataFrame:
+            frame = spec['cls'](frame, copy=False)
+        return _set_metadata(frame, spec['metadata'])
+    if kind == 'dataset':
+        resources = {resource_id: _decode(resource, reader) for resource_id, resource in spec['resources']}
+        return _set_metadata(spec['cls'](resources, spec['metadata']), spec['metadata'])
+    if kind == 'ndarray':
+        array = reader.buffer(spec['buffer'])
+        if spec['cls'] is not np.ndarray:
+            array = array.view(spec['cls'])
+        return _set_metadata(array, spec['metadata'])
+    if kind == 'list':
+        items = [_decode(item, reader) for item in spec['items']]
+        if spec['cls'] is list:
+            return items
+        return _set_metadata(spec['cls'](items), spec['metadata'])
+    if kind == 'dict':
+        return {key: _decode(item, reader) for key, item in spec['items']}
+    return spec['value']
+
+
+def _has_space(directory: str, size: int) -> bool:
+    try:
+        stat = os.statvfs(directory)
+    except OSError:
+        return False
+    available = stat.f_bavail * stat.f_frsize
+    total = stat.f_blocks * stat.f_frsize
+    return available - size > total * _FREE_SPACE_MARGIN
+
+
+def share(value: typing.Any, *, path: str = None, min_bytes: int = MIN_SHARED_BYTES) -> typing.Any:
+    '''
+    Writes value into a segment and returns its SegmentHandle. Returns value itself if it has
+    less than min_bytes of numeric data, or if there is not enough space for the segment.
+
+    Args:
+        value: DataFrame, ndarray, Dataset, or a list or dict of those
+        path: Segment file. If not given a segment owned by this process is created in
+            SHARED_MEMORY_DIR. The caller is responsible for removing segments with a path.
+        min_bytes: Smallest amount of numeric data worth sharing
+    '''
+    writer = _SegmentWriter()
+    spec = _encode(value, writer)
+    if writer.shared_bytes < min_bytes:
+        return value
+    try:
+        spec_bytes = pickle.dumps(spec, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        _logger.debug('Unable to pickle segment spec', exc_info=True)
+        return value
+    spec_offset = writer.add_bytes(spec_bytes)
+
+    owned = path is None
+    if owned:
+        path = os.path.join(SHARED_MEMORY_DIR, f'{SEGMENT_PREFIX}{os.getpid()}_{uuid.uuid4().hex}{SEGMENT_SUFFIX}')
+    if not _has_space(os.path.dirname(path), writer.size):
+        _logger.info(f'Not enough space in {os.path.dirname(path)} for {writer.size} bytes, not sharing')
+        return value
+    try:
+        writer.write(path)
+    except (OSError, ValueError, TypeError):
+        _logger.warning(f'Unable to write segment {path}', exc_info=True)
+        _remove(path)
+        return value
+    if owned:
+        _owned_segments.add(path)
+    return SegmentHandle(path, writer.size, spec_offset, len(spec_bytes))
+
+
+def save_columns(value: typing.Any, directory: str) -> typing.Any:
+    '''
+    Writes value in the columnar layout into directory, which must not exist, and returns its
+    ColumnsHandle. Returns value itself if it has no columns to store, or if writing them fails,
+    e.g. for lack of space. The caller is responsible for removing the directory, see release().
+
+    Args:
+        value: DataFrame, ndarray, Dataset, or a list or dict of those
+        directory: Directory to create
+    '''
+    parent = os.path.dirname(directory)
+    # Readers never see a partly written directory
+    temp_directory = tempfile.mkdtemp(prefix='.columns_', dir=parent)
+    try:
+        writer = _ColumnWriter(temp_directory)
+        spec = _encode(value, writer)
+        if spec['kind'] == 'value':
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            return value
+        sidecar_path = os.path.join(temp_directory, 'metadata.pkl')
+        with open(sidecar_path, 'wb') as out:
+            pickle.dump(spec, out, protocol=pickle.HIGHEST_PROTOCOL)
+        size = writer.size + os.path.getsize(sidecar_path)
+        os.rename(temp_directory, directory)
+    except Exception:
+        _logger.warning(f'Unable to write columns {directory}', exc_info=True)
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        return value
+    return ColumnsHandle(directory, size)
+
+
+def attach(value: typing.Any, writable: bool = True) -> typing.Any:
+    '''
+    Rebuilds the value referenced by a SegmentHandle or a ColumnsHandle. Other values are
+    returned unchanged. Unless writable, the mapped arrays are read-only. Raises OSError if the
+    segment or the columns are gone.
+    '''
+    if isinstance(value, ColumnsHandle):
+        with open(os.path.join(value.directory, 'metadata.pkl'), 'rb') as fd:
+            spec = pickle.load(fd)
+        return _decode(spec, _ColumnReader(value.directory, writable))
+    if not isinstance(value, SegmentHandle):
+        return value
+    with open(value.path, 'rb') as fd:
+        # Copy-on-write: primitives may modify their inputs in place without affecting others
+        access = mmap.ACCESS_COPY if writable else mmap.ACCESS_READ
+        buffer = mmap.mmap(fd.fileno(), 0, access=access)
+    mapped = np.frombuffer(buffer, dtype=np.uint8)
+    spec = pickle.loads(mapped[value.spec_offset:value.spec_offset + value.spec_size].tobytes())
+    return _decode(spec, _SegmentReader(mapped))
+
+
+def release(value: typing.Any) -> None:
+    '''
+    Removes the segment of a SegmentHandle, or the directory of a ColumnsHandle. Processes that
+    already attached it keep their mapping.
+    '''
+    if isinstance(value, ColumnsHandle):
+        shutil.rmtree(value.directory, ignore_errors=True)
+    if isinstance(value, SegmentHandle):
+        _remove(value.path)
+        _owned_segments.discard(value.path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup_dead_segments(directory: str = SHARED_MEMORY_DIR) -> int:
+    '''
+    Removes the segments owned by processes that no longer exist, e.g. workers that were killed.
+    Returns the number of segments removed.
+    '''
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        match = _SEGMENT_PATTERN.match(name)
+        if match and not _pid_alive(int(match.group(1))):
+            _remove(os.path.join(directory, name))
+            removed += 1
+    if removed:
+        _logger.info(f'Removed {removed} segments of dead processes')
+    return removed
+
+
+def _release_owned_segments() -> None:
+    # Forked children inherit the set, only remove what this process created
+    pid = str(os.getpid())
+    for path in list(_owned_segments):
+        match = _SEGMENT_PATTERN.match(os.path.basename(path))
+        if match and match.group(1) == pid:
+            _remove(path)
+    _owned_segments.clear()
+
+
+atexit.register(_release_owned_segments)
@@ -126,6 +126,44 @@ class UsageMonitor:
                     target_pids_dict[child.pid] = current_parent_pid
         return target_pids_dict
 
+    @staticmethod
+    def get_process_tree_memory(pid: int) -> int:
+        """
+        Resident memory in bytes of the given process and all of its child processes
+        """
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0
+        total = 0
+        for proc in processes:
+            # use try to prevent process died and cause program crashed
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    @staticmethod
+    def get_process_tree_cpu_time(pid: int) -> float:
+        """
+        CPU seconds, user and system, used so far by the given process and its live child processes
+        """
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0.0
+        total = 0.0
+        for proc in processes:
+            try:
+                times = proc.cpu_times()
+                total += times.user + times.system
+            except psutil.Error:
+                pass
+        return total
+
     @staticmethod
     def measure_usage_for_multiple_process(recorder, target_pids, wait_time_get_data=1, frequency_update_pids=5):
         """
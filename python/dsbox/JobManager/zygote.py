@@ -0,0 +1,171 @@
+'''
+Warm process from which the search workers are forked.
+
+The job manager starts the zygote once, where it used to fork its workers, and asks it for a new
+worker whenever it needs one: at start, and when a worker is recycled, timed out or died. When a
+search knows its templates it asks the zygote to preload the d3m primitive index and the modules
+of their primitives, so the workers forked afterwards start with these imports done instead of
+repeating them on their first jobs. Nothing is imported in the main process.
+
+Workers are children of the zygote. The job manager handles them through WarmWorker, which has
+the part of the multiprocessing.Process interface it uses.
+'''
+import logging
+import os
+import psutil
+import signal
+import threading
+import time
+import typing
+
+from multiprocessing import Pipe, Process, current_process
+
+_logger = logging.getLogger(__name__)
+
+
+class WarmWorker:
+    '''
+    Worker forked by the zygote
+    '''
+    # Seconds between two checks in join()
+    JOIN_INTERVAL = 0.05
+
+    def __init__(self, name: str, pid: int, exit_codes: typing.Dict) -> None:
+        self.name = name
+        self.pid = pid
+        self._exit_codes = exit_codes
+
+    @property
+    def exitcode(self) -> typing.Optional[int]:
+        return self._exit_codes.get(self.pid)
+
+    def is_alive(self) -> bool:
+        if self.pid in self._exit_codes:
+            return False
+        try:
+            # Zombie until the zygote reaps it
+            return psutil.Process(self.pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+
+    def terminate(self) -> None:
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def join(self, timeout: float = None) -> None:
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.is_alive():
+            if deadline is not None and time.perf_counter() > deadline:
+                return
+            time.sleep(WarmWorker.JOIN_INTERVAL)
+
+
+class Zygote:
+    """
+    Process that preloads primitives and forks workers running target(base_args + extra_args).
+
+    Args:
+        manager: Manager used to share the exit codes of the workers
+        target: function run by the workers
+        base_args: arguments common to all workers. They are inherited, not pickled.
+    """
+
+    # Seconds between two reaps of exited workers
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, manager, target: typing.Callable, base_args: typing.Tuple) -> None:
+        self._exit_codes = manager.dict()
+        self._conn, child_conn = Pipe()
+        self._lock = threading.Lock()
+        self.preloaded: typing.Set[str] = set()
+        self._process = Process(target=Zygote._main,
+                                args=(child_conn, target, base_args, self._exit_codes),
+                                name='Zygote', daemon=True)
+        self._process.start()
+
+    def is_alive(self) -> bool:
+        return self._process.is_alive()
+
+    def _request(self, *command) -> typing.Any:
+        with self._lock:
+            self._conn.send(command)
+            return self._conn.recv()
+
+    def spawn(self, name: str, extra_args: typing.Tuple) -> WarmWorker:
+        '''
+        Forks a worker. extra_args must be picklable.
+        Raises:
+            OSError or EOFError if the zygote is gone
+        '''
+        pid = self._request('spawn', name, extra_args)
+        return WarmWorker(name, pid, self._exit_codes)
+
+    def preload(self, python_paths: typing.Iterable[str]) -> int:
+        '''
+        Loads the primitives that are not loaded yet into the zygote. Returns how many were
+        loaded.
+        '''
+        python_paths = sorted(set(python_paths) - self.preloaded)
+        loaded = self._request('preload', python_paths)
+        self.preloaded.update(python_paths)
+        return loaded
+
+    def stop(self) -> None:
+        try:
+            with self._lock:
+                self._conn.send(('stop',))
+        except OSError:
+            pass
+        self._process.join(Zygote.POLL_INTERVAL * 4)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    @staticmethod
+    def _main(conn, target: typing.Callable, base_args: typing.Tuple, exit_codes: typing.Dict) -> None:
+        # Daemonic processes may not have children otherwise
+        current_process().daemon = False
+        parent_pid = os.getppid()
+        workers: typing.Dict[int, Process] = {}
+        while os.getppid() == parent_pid:
+            for pid, worker in list(workers.items()):
+                if not worker.is_alive():
+                    exit_codes[pid] = worker.exitcode
+                    del workers[pid]
+            if not conn.poll(Zygote.POLL_INTERVAL):
+                continue
+            try:
+                command = conn.recv()
+            except EOFError:
+                break
+            if command[0] == 'spawn':
+                _, name, extra_args = command
+                worker = Process(target=target, args=(base_args + extra_args,), name=name, daemon=True)
+                worker.start()
+                workers[worker.pid] = worker
+                conn.send(worker.pid)
+            elif command[0] == 'preload':
+                conn.send(Zygote._preload(command[1]))
+            else:
+                break
+
+    @staticmethod
+    def _preload(python_paths: typing.List[str]) -> int:
+        start = time.perf_counter()
+        try:
+            from d3m import index as d3m_index
+            d3m_index.search()
+        except Exception:
+            _logger.warning('Unable to load the primitive index', exc_info=True)
+            return 0
+        loaded = 0
+        for python_path in python_paths:
+            try:
+                d3m_index.get_primitive(python_path)
+                loaded += 1
+            except Exception:
+                _logger.debug(f'Unable to preload {python_path}', exc_info=True)
+        _logger.info(f'Preloaded {loaded}/{len(python_paths)} primitives in '
+                     f'{time.perf_counter() - start:.1f}s')
+        return loaded
@@ -23,12 +23,14 @@ from d3m.metadata.pipeline import Pipeline
 from d3m.metadata.problem import Problem,TaskKeyword #TaskType
 
 from dsbox.exceptions import PipelineInstantiationError, PipelineEvaluationError, PipelinePickleError
+from dsbox.exceptions import PipelineRacedOutError
+from dsbox.JobManager import cancellation
 from dsbox.JobManager.cache import PrimitivesCache
 from dsbox.pipeline.fitted_pipeline import FittedPipeline
 from dsbox.schema import get_target_columns
 from dsbox.template.configuration_space import ConfigurationPoint
 from dsbox.template.configuration_space import ConfigurationSpace
-from dsbox.combinatorial_search.search_utils import load_pickled_dataset
+from dsbox.combinatorial_search.search_utils import LazySplits, RowSplit, load_resident_dataset, row_splits
 from dsbox.template.template import DSBoxTemplate
 # from dsbox.template.utils import calculate_score, graph_problem_conversion, SpecialMetric
 from dsbox.template.utils import score_prediction, graph_problem_conversion
@@ -47,6 +49,17 @@ class Mode(enum.IntEnum):
     TRAIN_TEST_MODE = 2
 
 
+def _find_cause(exc: BaseException, exc_type: typing.Type[BaseException]) -> typing.Optional[BaseException]:
+    '''
+    exc or the exception it was raised from, e.g. by the d3m runtime, if it is an exc_type
+    '''
+    while exc is not None:
+        if isinstance(exc, exc_type):
+            return exc
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
 class ConfigurationSpaceBaseSearch():
     """
     Search configuration space on dimension at a time.
@@ -162,12 +175,13 @@ class ConfigurationSpaceBaseSearch():
         Note: This methods will modify the configuration point, by updating its data field.
         """
         # update v2019.11.7: now load the dataset here
-        self.train_dataset1 = load_pickled_dataset("train_dataset1")
-        self.train_dataset2 = load_pickled_dataset("train_dataset2")
-        self.test_dataset1 = load_pickled_dataset("test_dataset1")
-        self.test_dataset2 = load_pickled_dataset("test_dataset2")
-        self.all_dataset = load_pickled_dataset("all_dataset")
-        self.ensemble_tuning_dataset = load_pickled_dataset("ensemble_tuning_dataset")
+        # Loaded once per worker, later candidates get views of the same datasets
+        self.train_dataset1 = load_resident_dataset("train_dataset1")
+        self.train_dataset2 = load_resident_dataset("train_dataset2")
+        self.test_dataset1 = load_resident_dataset("test_dataset1")
+        self.test_dataset2 = load_resident_dataset("test_dataset2")
+        self.all_dataset = load_resident_dataset("all_dataset")
+        self.ensemble_tuning_dataset = load_resident_dataset("ensemble_tuning_dataset")
 
         if self.ensemble_tuning_dataset:
             self.do_ensemble_tuning = True
@@ -179,6 +193,7 @@ class ConfigurationSpaceBaseSearch():
         dump2disk = args[2] if len(args) == 3 else True
 
         evaluation_result = None
+        start_time = time.time()
 
         try:
             _logger.info(f"Evaluate template {self.template.template['name']} {hash(str(configuration))}")
@@ -189,6 +204,13 @@ class ConfigurationSpaceBaseSearch():
 
             _logger.info(f"END Evaluation of template {self.template.template['name']} {hash(str(configuration))} in {current_process()}")
         except Exception as exc:
+            if cancellation.is_cancelled():
+                # Not a failure of the pipeline
+                raise
+            raced_out = _find_cause(exc, PipelineRacedOutError)
+            if raced_out is not None and self.evaluating_pipeline is not None:
+                # Not a failure either, the pipeline cannot beat the best one so far
+                return self._partial_evaluation_result(configuration, raced_out, time.time() - start_time)
             if self.evaluating_pipeline is None:
                 raise PipelineInstantiationError(f'Not able to create pipeline from template {self.template.template["name"]}.') from exc
             else:
@@ -206,6 +228,26 @@ class ConfigurationSpaceBaseSearch():
         #     return None
         # configuration.data.update(new_data)
 
+    def _partial_evaluation_result(self, configuration: ConfigurationPoint, raced_out: PipelineRacedOutError,
+                                   total_runtime: float) -> typing.Dict:
+        """
+        Report of a pipeline whose cross-validation was stopped early. There is no fitted
+        pipeline, only the cross-validation metrics of the folds that ran, and the evidence of
+        the race in 'partial_evaluation'.
+        """
+        _logger.info(f"Partial evaluation of template {self.template.template['name']} {hash(str(configuration))}: "
+                     f"{raced_out.evidence.get('folds_run')} of {raced_out.evidence.get('n_folds')} folds")
+        return {
+            'id': self.evaluating_pipeline.id,
+            'fid': None,
+            'training_metrics': [],
+            'cross_validation_metrics': raced_out.cross_validation_metrics,
+            'test_metrics': [],
+            'total_runtime': total_runtime,
+            'configuration': configuration,
+            'partial_evaluation': raced_out.evidence,
+        }
+
     def _evaluate(self,
                   configuration: ConfigurationPoint,
                   cache: PrimitivesCache,
@@ -272,6 +314,9 @@ class ConfigurationSpaceBaseSearch():
         #     fitted_pipeline.save(self.output_directory)
         #     return data
 
+        # Cross-validation that selects the candidate, the incumbent of racing is the best one
+        raced_cross_validation = None
+
         # following codes should only for running in the normal validation that can be splitted and tested
         # if in cross validation mode
         if self.testing_mode == Mode.CROSS_VALIDATION_MODE:
@@ -283,7 +328,9 @@ class ConfigurationSpaceBaseSearch():
                 metric_descriptions=self.performance_metrics,
                 template=self.template, problem=self.problem, extra_primitive=self.extra_primitive, random_seed=self.random_seed)
 
-            fitted_pipeline.fit(cache=cache, inputs=[self.train_dataset1], save_loc=self.output_directory)
+            # Only this fit races, refits on other datasets always run every fold
+            fitted_pipeline.fit(cache=cache, inputs=[self.train_dataset1], save_loc=self.output_directory,
+                                race=True)
 
             training_prediction = fitted_pipeline.get_fit_step_output(self.template.get_output_step_number())
             # training_ground_truth = get_target_columns(self.train_dataset1)
@@ -305,6 +352,11 @@ class ConfigurationSpaceBaseSearch():
 
             cv_metrics = fitted_pipeline.get_cross_validation_metrics()
             test_metrics = copy.deepcopy(training_metrics)
+            if cv_metrics:
+                raced_cross_validation = {
+                    'dataset': fitted_pipeline.runtime.data_fingerprints.get('inputs.0'),
+                    'cross_validation_metrics': cv_metrics,
+                }
 
             # use cross validation's avg value as the test score
             for i in range(len(test_metrics)):
@@ -413,6 +465,7 @@ class ConfigurationSpaceBaseSearch():
                 'configuration': configuration,
                 'ensemble_tuning_result': ensemble_tuning_result,
                 'ensemble_tuning_metrics': ensemble_tuning_metrics,
+                'raced_cross_validation': raced_cross_validation,
             }
             fitted_pipeline.auxiliary = dict(data)
 
@@ -497,9 +550,15 @@ class ConfigurationSpaceBaseSearch():
                     split_primitive = KFoldDatasetSplitPrimitive(hyperparams = hyperparams_split)
                     split_primitive.set_training_data(dataset = self.all_dataset)
                     split_primitive.fit()
-                    query_dataset_list = list(range(self._repeat_times_level_1))
-                    train_return = split_primitive.produce(inputs = query_dataset_list).value#['learningData']
-                    test_return = split_primitive.produce_score_data(inputs = query_dataset_list).value
+                    splits = row_splits(split_primitive, RowSplit.of_dataset("all_dataset", self.all_dataset))
+                    if splits is not None:
+                        # Only the fold in use is materialized
+                        train_return = LazySplits(splits[0], base_loader=lambda _: self.all_dataset)
+                        test_return = LazySplits(splits[1], base_loader=lambda _: self.all_dataset)
+                    else:
+                        query_dataset_list = list(range(self._repeat_times_level_1))
+                        train_return = split_primitive.produce(inputs = query_dataset_list).value#['learningData']
+                        test_return = split_primitive.produce_score_data(inputs = query_dataset_list).value
 
                     all_test_metrics = []
                     for i in range(self._repeat_times_level_1):
@@ -595,6 +654,7 @@ class ConfigurationSpaceBaseSearch():
                 'configuration': configuration,
                 'ensemble_tuning_result': ensemble_tuning_result,
                 'ensemble_tuning_metrics': ensemble_tuning_metrics,
+                'raced_cross_validation': raced_cross_validation,
             }
             fitted_pipeline.auxiliary = dict(data)
 
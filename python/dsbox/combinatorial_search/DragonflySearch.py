@@ -154,7 +154,7 @@ class DragonflySearch(TemplateSpaceBaseSearch):
             _logger.info(f"Search Failed on candidate {hash(str(candidate))}")
             _logger.warning(traceback.format_exc())
             self.history.update_none(fail_report=None, template_name=template_name)
-            self.cacheManager.candidate_cache.push_None(candidate=candidate)
+            self.cacheManager.candidate_cache.push_None(candidate=candidate, failed=True)
 
     def _select_next_template(self, num_iter: int = 2) \
             -> Tuple_t[Dragonfly_config_t, ConfigurationSpaceBaseSearch]:
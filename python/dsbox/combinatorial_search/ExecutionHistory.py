@@ -9,6 +9,8 @@ import typing
 import numpy as np
 import pandas as pd
 
+from dsbox.JobManager.result_transport import ArtifactDict
+from dsbox.template import racing
 from dsbox.template.configuration_space import ConfigurationPoint
 from dsbox.schema import larger_is_better
 
@@ -56,10 +58,19 @@ class ExecutionHistory:
         self.all_reports = {}
         self.queue: queue.Queue = queue.Queue()
 
+        # Reports of the candidates whose cross-validation was stopped early by racing, by id
+        self.partial_reports = {}
+        # Best score of the selection cross-validation of each (dataset fingerprint, metric),
+        # candidates are raced against it
+        self.incumbent_scores = {}
+        racing.publish_incumbent(self.incumbent_scores)
+
     def done(self):
         """
         Used to signal Ta2Servicer that search has finished.
         """
+        # Pipelines fitted after the search are not raced
+        racing.publish_incumbent({})
         self.queue.put(False)
 
     def update(self, report: typing.Dict, template_name: str = 'generic') -> None:
@@ -78,6 +89,9 @@ class ExecutionHistory:
             }
             e = ExecutionHistory(...)
             e.update(template_name="...",report=r)
+        Reports of candidates raced out during cross-validation have a 'partial_evaluation'
+        entry. They are charged to the template and kept in partial_reports, but never replace
+        the best candidate.
         Args:
             template_name: str
                 name of the template
@@ -87,8 +101,12 @@ class ExecutionHistory:
         Returns:
             None
         """
+        if report and 'partial_evaluation' in report:
+            # Raced out, there is no fitted pipeline for TA3
+            _logger.info(f"  id={report['id']} partially evaluated: {report['partial_evaluation']}")
+            self.partial_reports[report['id']] = report
         # TA3 save all reports
-        if report and 'id' in report:
+        elif report and 'id' in report:
             if report['id'] in self.all_reports:
                 _logger.error('Duplicate report id: %s', report['id'])
             if 'rank' in report:
@@ -100,7 +118,8 @@ class ExecutionHistory:
 
         # add new things in history records for ensemble tuning
         if 'ensemble_tuning_result' in report:
-            temp = {}
+            # Predictions of parallel searches stay in the spool of the job manager until read
+            temp = ArtifactDict()
             temp['ensemble_tuning_result'] = report['ensemble_tuning_result'] # the ensemble tuning's dataset predictions
             temp['pipeline'] = report['configuration'] # correspond pipeline structure
             temp['ensemble_tuning_metrics'] = report['ensemble_tuning_metrics'] # ensemble tuning dataset's matrix score
@@ -138,6 +157,9 @@ class ExecutionHistory:
         for k in update:
             self.storage.loc[template_name][k] = update[k]
 
+        if 'Error' not in report and 'partial_evaluation' not in report:
+            self._update_incumbent(report.get('raced_cross_validation'))
+
         # check validity of the storage
         # measures = ['training_metrics', 'cross_validation_metrics', 'test_metrics']
         # self.storage[measures].applymap(lambda e: e is None or isinstance(e, list))
@@ -148,6 +170,27 @@ class ExecutionHistory:
             #     isinstance(e[0], dict) for e in self.storage[k].values if isinstance(e, list)
             # ]), "column {} must be list of dict".format(k)
 
+    def _update_incumbent(self, raced_cross_validation: typing.Optional[typing.Dict]) -> None:
+        '''
+        Publishes the score of the selection cross-validation of the report, on train_dataset1,
+        if it is the best one so far on that dataset. The 'cross_validation_metrics' of a report
+        may come from a refit on another dataset, they are never raced against.
+        '''
+        if not raced_cross_validation or raced_cross_validation.get('dataset') is None:
+            return
+        dataset = raced_cross_validation['dataset']
+        cross_validation_metrics = raced_cross_validation.get('cross_validation_metrics')
+        if not isinstance(cross_validation_metrics, list) or len(cross_validation_metrics) == 0:
+            return
+        metric = cross_validation_metrics[0]['metric']
+        value = cross_validation_metrics[0]['value']
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        best = self.incumbent_scores.get((dataset, metric))
+        if best is None or racing.is_better(metric, value, best):
+            self.incumbent_scores[(dataset, metric)] = value
+            racing.publish_incumbent(self.incumbent_scores)
+
     def normalize(self) -> pd.DataFrame:
         """
         Returns the normalized version of execution history. The normalized dataframe only
@@ -183,6 +226,15 @@ class ExecutionHistory:
 
         return normalize
 
+    def mean_runtime(self, template_name: str) -> typing.Optional[float]:
+        """
+        Average evaluation time of the template's candidates, or None before the first result
+        """
+        row = self.storage.loc[template_name]
+        if row['sim_count'] > 0:
+            return row['total_runtime'] / row['sim_count']
+        return None
+
     def update_none(self, fail_report: typing.Dict, template_name: str = 'generic') -> None:
 
         if fail_report is None:
@@ -198,7 +250,7 @@ class ExecutionHistory:
 
     @staticmethod
     def _is_better(base: typing.Dict, check: typing.Dict, key_attribute: str) -> bool:
-        if 'Error' in check:
+        if 'Error' in check or 'partial_evaluation' in check:
             return False
 
         if base is None:
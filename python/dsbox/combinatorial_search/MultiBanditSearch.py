@@ -58,6 +58,8 @@ class MultiBanditSearch(TemplateSpaceParallelBaseSearch[T]):
 
         # UCT scores holder
         # self.uct_score = dict(map(lambda t: (t, None), template_list))
+        self.uct_score: typing.Dict[str, float] = {}
+        self.job_manager.priority_function = self._job_priority
 
     def _select_next_template(self, num_iter=2) -> \
             typing.Tuple[ConfigurationSpaceBaseSearch, str]:
@@ -104,6 +106,7 @@ class MultiBanditSearch(TemplateSpaceParallelBaseSearch[T]):
             f"sname:{snames}, uct:{uct_score}"
 
         _logger.info(f"UCT updated: {uct_score}")
+        self.uct_score = uct_score
         choice_weight = [(s, uct_score[s.template.template["name"]])
                          for s in self.confSpaceBaseSearch]
         # choice_weight = [(s, uct_score[s]) for s in snames]
@@ -113,6 +116,16 @@ class MultiBanditSearch(TemplateSpaceParallelBaseSearch[T]):
 
         return _choices, _weights
 
+    def _job_priority(self, kwargs_bundle: typing.Dict[str, typing.Any]) -> float:
+        """
+        Priority of a queued candidate: the last UCT score of its template. Candidates of the
+        initial evaluation round, before any score, come first.
+        """
+        score = self.uct_score.get(kwargs_bundle['target_obj'].template.template['name'])
+        if score is None or np.isnan(score):
+            return float('inf')
+        return float(score)
+
     def search(self, num_iter: int=2) -> typing.Dict:
         """
         runs the random search for each compatible template and returns the report of the best
@@ -1,6 +1,5 @@
 import traceback
 import logging
-import time
 import typing
 import random
 from multiprocessing import Pool
@@ -102,7 +101,6 @@ class RandomDimensionalSearch(TemplateSpaceParallelBaseSearch[T]):
                     kwargs_bundle=self._prepare_job_posting(candidate=conf,
                                                             search=search)
                 )
-                time.sleep(0.1)
 
             # wait until all the candidates are evaluated
             self._get_evaluation_results()
@@ -11,7 +11,9 @@ from d3m.container.dataset import Dataset
 from dsbox.combinatorial_search.ConfigurationSpaceBaseSearch import ConfigurationSpaceBaseSearch
 from dsbox.template.configuration_space import ConfigurationPoint
 from dsbox.combinatorial_search.ExecutionHistory import ExecutionHistory
-from dsbox.JobManager.cache import CacheManager
+from dsbox.combinatorial_search.search_utils import release_resident_datasets
+from dsbox.JobManager.cache import CacheManager, PrimitivesCache
+from dsbox.JobManager.DistributedJobManager import JobStatus, JOB_STATUS, TIME_LIMIT
 from dsbox.template.template import DSBoxTemplate
 
 
@@ -53,6 +55,9 @@ class TemplateSpaceBaseSearch():
 
         # self.cacheManager.timeout_sec = timeout_sec
         self.template_list = template_list
+        self.output_directory = output_directory
+        self.cacheManager.candidate_cache.set_context(
+            all_dataset if all_dataset is not None else train_dataset1, problem)
 
         self.configuration_space_list = list(
             map(lambda t: t.generate_configuration_space(), template_list))
@@ -114,6 +119,7 @@ class TemplateSpaceBaseSearch():
         _logger.info('Done searching')
 
         self.cacheManager.cleanup()
+        release_resident_datasets()
         self.history.done()
 
         return self.history.get_best_history()
@@ -178,11 +184,26 @@ class TemplateSpaceBaseSearch():
             _logger.debug(f"Report details: {report}")
             self.history.update(report, template_name=template_name)
             self.cacheManager.candidate_cache.push(report)
+        elif kwargs_bundle.get(JOB_STATUS) == JobStatus.CANCELLED:
+            # Not evaluated, neither the template nor the candidate are charged
+            _logger.info(f"Evaluation cancelled for {template_name} on candidate {hash(str(candidate))}")
+        elif kwargs_bundle.get(JOB_STATUS) == JobStatus.TIMEOUT:
+            _logger.warning(f"Evaluation timed out for {template_name} on candidate {hash(str(candidate))}")
+            # Charge the time spent to the template
+            fail_report = {'total_runtime': kwargs_bundle.get(TIME_LIMIT) or 0}
+            self.history.update_none(fail_report=fail_report, template_name=template_name)
+            # Not persisted, the candidate may finish in a later search
+            self.cacheManager.candidate_cache.push_None(candidate=candidate)
+        elif kwargs_bundle.get(JOB_STATUS) == JobStatus.LOST:
+            _logger.warning(f"Evaluation lost its worker for {template_name} on candidate {hash(str(candidate))}")
+            self.history.update_none(fail_report=None, template_name=template_name)
+            # Not persisted, e.g. the worker ran out of memory next to other jobs
+            self.cacheManager.candidate_cache.push_None(candidate=candidate)
         else:
             _logger.info(f"Search Failed for {template_name} on candidate {hash(str(candidate))}")
             # _logger.warning(traceback.format_exc())
             self.history.update_none(fail_report=None, template_name=template_name)
-            self.cacheManager.candidate_cache.push_None(candidate=candidate)
+            self.cacheManager.candidate_cache.push_None(candidate=candidate, failed=True)
 
     def _prepare_job_posting(self,
                              candidate: typing.Dict[str, typing.Any],
@@ -204,6 +225,21 @@ class TemplateSpaceBaseSearch():
             }
         }
 
+    def _remote_job_posting(self, kwargs_bundle: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """
+        adapts a job posting for workers on other hosts, which cannot reach the primitive cache
+        shared through this host's Manager. They get an empty cache of their own.
+        Args:
+            kwargs_bundle: job posting made by _prepare_job_posting
+
+        Returns:
+            the job posting to send
+        """
+        candidate, _, dump2disk = kwargs_bundle['kwargs']['args']
+        kwargs_bundle = dict(kwargs_bundle)
+        kwargs_bundle['kwargs'] = {'args': (candidate, PrimitivesCache(), dump2disk)}
+        return kwargs_bundle
+
     def _select_next_template(self, num_iter: int = 2) \
             -> typing.Iterable[ConfigurationSpaceBaseSearch]:
         """
@@ -241,6 +277,9 @@ class TemplateSpaceBaseSearch():
         Returns:
             Bool: whether candidate evaluation is needed or not
         """
+        # Results of previous runs end up in the candidate cache
+        self.cacheManager.candidate_cache.reuse_persisted(candidate, self.history, self.output_directory)
+
         if self.cacheManager.candidate_cache.is_hit(candidate):
             report = self.cacheManager.candidate_cache.lookup(candidate)
             assert report is not None and 'configuration' in report, \
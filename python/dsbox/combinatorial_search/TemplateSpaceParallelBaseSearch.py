@@ -10,6 +10,7 @@ from d3m.metadata.problem import Problem
 from d3m.container.dataset import Dataset
 from dsbox.JobManager.DistributedJobManager import DistributedJobManager
 from dsbox.combinatorial_search.ConfigurationSpaceBaseSearch import ConfigurationSpaceBaseSearch
+from dsbox.combinatorial_search.search_utils import pickled_dataset_size
 from dsbox.combinatorial_search.TemplateSpaceBaseSearch import TemplateSpaceBaseSearch
 from dsbox.template.configuration_space import ConfigurationPoint
 from dsbox.template.template import DSBoxTemplate
@@ -39,13 +40,21 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
 
     """
 
+    # Seconds of the search time left for collecting the last results
+    RESULT_MARGIN = 15
+
     def __init__(self, num_proc):
         super().__init__(is_multiprocessing=True)
         self.job_manager = DistributedJobManager(proc_num=num_proc)
+        self.job_manager.remote_bundle_function = self._remote_job_posting
         self.num_proc = num_proc
         self.timeout_sec = None
         self.jobs_completed = 0
         self.jobs_pushed = 0
+        # True while the push thread runs
+        self._pushing = False
+        # Worker seconds without a job during the last search
+        self.idle_worker_seconds = 0.0
 
 
     def initialize_problem(self, template_list: typing.List[DSBoxTemplate],
@@ -70,6 +79,11 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
             output_directory=output_directory,
             start_time=start_time, timeout_sec=timeout_sec
         )
+        # Used to predict the memory of jobs before any has been measured
+        self.job_manager.admission.dataset_bytes = pickled_dataset_size("train_dataset1")
+        # Workers start with the primitives of the templates imported
+        self.job_manager.preload_primitives(
+            set(extra_primitive or ()).union(*[template.get_primitive_paths() for template in template_list]))
 
         # setup the execution history to store the results of each template separately
         # self.setup_exec_history(template_list=self.template_list)
@@ -95,7 +109,8 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
         # self.job_manager._start_workers(target_method=self._evaluate_template)
         # from dsbox.template.runtime import ForkedPdb
         # ForkedPdb().set_trace()
-        time.sleep(0.1)
+        idle_start = self.job_manager.idle_worker_seconds()
+        search_start = time.perf_counter()
 
         # def _timeout_handler(self, signum):
         #     print('Signal handler called with signal', signum)
@@ -107,15 +122,19 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
         # Use thread to push candidates. Otherwise the the queue and/or its underlying
         # pipe get filled up, and cause broken pipe errors.
         # self._push_random_candidates(num_iter)
+        self._pushing = True
         push_thread = threading.Thread(target=self._push_random_candidates, args=(num_iter,))
         push_thread.start()
 
-        time.sleep(1)
-
         # iteratively wait until a result is available and process the result untill there is no
         # other pending job in the job manager
         self._get_evaluation_results()
 
+        self.idle_worker_seconds = self.job_manager.idle_worker_seconds() - idle_start
+        worker_seconds = (time.perf_counter() - search_start) * self.num_proc
+        _logger.info(f'Workers idle for {self.idle_worker_seconds:.0f}s, '
+                     f'{100 * self.idle_worker_seconds / max(worker_seconds, 1e-9):.0f}% of the worker time')
+
         # cleanup the caches and cache manager
         self.cacheManager.cleanup()
 
@@ -130,35 +149,48 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
         """
         The process is sleeped on jobManager's result queue until a result is ready, then it pops
         the results and updates history and candidate's cache with it. The method repeats this
-        process until there are no pending jobs in the jobManager.
+        process until there are no pending jobs in the jobManager and the push thread is done, or
+        until RESULT_MARGIN seconds of the search time are left.
         Args:
             None
         Returns:
             None
         """
         _logger.debug("Waiting for the results")
+        margin = self.RESULT_MARGIN
         try:
-            wait_seconds = self.start_time + self.timeout_sec - time.perf_counter()
-            while (self.jobs_completed < max_num) and (not self.job_manager.is_idle()) and wait_seconds > 15:
-                # print("[INFO] Sleeping,", self.jobs_completed)
+            wait_seconds = self.start_time + self.timeout_sec - time.perf_counter() - margin
+            while self.jobs_completed < max_num and wait_seconds > 0:
+                # Wakes up when a job is pushed, or when the push thread is done
+                if not self.job_manager.wait_for_jobs(lambda ongoing: ongoing > 0 or not self._pushing,
+                                                      timeout=wait_seconds):
+                    break
+                if self.job_manager.ongoing_jobs == 0:
+                    break
                 _logger.info(f"Main Process jobs_completed:{self.jobs_completed}, timeout={wait_seconds}")
-                if wait_seconds > 15:
+                try:
                     (kwargs_bundle, report) = self.job_manager.pop_job(block=True, timeout=wait_seconds)
-                    _logger.info(f"Got Result kwargs={kwargs_bundle}")
-                    if report:
-                        _logger.info(f"Got Result report id={report['id']}")
-                    else:
-                        _logger.info(f"Got Result: report is None")
+                except queue.Empty:
+                    # Only dropped results of cancelled or copied jobs
+                    wait_seconds = self.start_time + self.timeout_sec - time.perf_counter() - margin
+                    continue
+                _logger.info("Got Result kwargs=%s", kwargs_bundle)
+                if report:
+                    _logger.info(f"Got Result report id={report['id']}")
+                else:
+                    _logger.info(f"Got Result: report is None")
 
-                    self._add_report_to_history(kwargs_bundle, report)
+                self._add_report_to_history(kwargs_bundle, report)
+                # Priorities may depend on the history
+                self.job_manager.reprioritize()
 
                 self.jobs_completed += 1
-                wait_seconds = self.start_time + self.timeout_sec - time.perf_counter()
+                wait_seconds = self.start_time + self.timeout_sec - time.perf_counter() - margin
 
-            if wait_seconds > 15:
+            if wait_seconds > 0:
                 _logger.info("No more pending job")
             else:
-                _logger.info(f"Time remaining is less than 15 seconds ({wait_seconds}). Empyting Result queue...")
+                _logger.info(f"Time remaining is less than {margin} seconds. Empyting Result queue...")
                 count = 0
                 try:
                     while True:
@@ -183,24 +215,29 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
 
         """
         _logger.info('Start pushing canditates')
-        for count, search in enumerate(self._select_next_template(num_iter=num_iter)):
-            wait_seconds = self.start_time + self.timeout_sec - time.perf_counter()
-            if wait_seconds > 15:
-                self._random_pipeline_evaluation_push(search=search, num_iter=1)
-                _logger.info(f'Pushed canditate {count}')
-            else:
-                _logger.warning('Timed out before pushing all the candiates')
-                break
+        try:
+            for count, search in enumerate(self._select_next_template(num_iter=num_iter)):
+                wait_seconds = self.start_time + self.timeout_sec - time.perf_counter()
+                if wait_seconds > self.RESULT_MARGIN:
+                    self._random_pipeline_evaluation_push(search=search, num_iter=1)
+                    _logger.info(f'Pushed canditate {count}')
+                else:
+                    _logger.warning('Timed out before pushing all the candiates')
+                    break
+        finally:
+            self._pushing = False
+            self.job_manager.notify_waiters()
         _logger.info('Done  pushing canditates')
 
     def _random_pipeline_evaluation_push(self, search: ConfigurationSpaceBaseSearch,
-                                         num_iter: int = 1) -> None:
+                                         num_iter: int = 1, priority: float = None) -> None:
         """
         randomly samples 'num_iter' unique pipelines from an specified configuration space and
         pushes them to jobManager for evaluation.
         Args:
             search: the selected configuration space (template)
             num_iter: number of pipelines to sample
+            priority: priority of the pushed jobs, see DistributedJobManager.push_job
 
         Returns:
 
@@ -208,18 +245,18 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
         for candidate in self._sample_random_pipeline(search=search, num_iter=num_iter):
 
             try:
-                while True:
+                wait_seconds = self.start_time + self.timeout_sec - time.perf_counter()
+                if self._pushing and wait_seconds > self.RESULT_MARGIN:
+                    # Refill as soon as a job is popped, keeping a few jobs waiting for free workers
+                    self.job_manager.wait_for_jobs(lambda ongoing: ongoing <= 2 * self.num_proc,
+                                                   timeout=wait_seconds - self.RESULT_MARGIN)
                     wait_seconds = self.start_time + self.timeout_sec - time.perf_counter()
-                    long_queue: bool = self.jobs_pushed - self.jobs_completed > 2 * self.num_proc
-                    if long_queue and wait_seconds > 16:
-                        time.sleep(1)
-                    else:
-                        break
-                if wait_seconds > 15:
+                if wait_seconds > self.RESULT_MARGIN:
                     # push the candidate to the job manager
                     self.job_manager.push_job(
                         kwargs_bundle=self._prepare_job_posting(candidate=candidate,
-                                                                search=search))
+                                                                search=search),
+                        priority=priority)
                     self.jobs_pushed += 1
                 else:
                     _logger.warning('Timed out before pushing all the candiates')
@@ -228,8 +265,6 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
                 traceback.print_exc()
                 _logger.error(traceback.format_exc())
 
-            time.sleep(0.1)
-
     def evaluate_blocking(self, base_search: ConfigurationSpaceBaseSearch,
                           candidate: ConfigurationPoint) -> typing.Dict:
         """
@@ -253,6 +288,10 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
         # check the cache for evaluation. If the candidate has been evaluated before and
         # its metric value was None (meaning it was not compatible with dataset),
         # then reevaluating the candidate is redundant
+        report = self.cacheManager.candidate_cache.reuse_persisted(candidate, self.history, self.output_directory)
+        if report is not None:
+            return report
+
         if self.cacheManager.candidate_cache.is_hit(candidate):
             report = self.cacheManager.candidate_cache.lookup(candidate)
             assert report is not None and 'configuration' in report, \
@@ -284,7 +323,7 @@ class TemplateSpaceParallelBaseSearch(TemplateSpaceBaseSearch):
 
         # wait for the results
         (kwargs_bundle, report) = self.job_manager.pop_job(block=True)
-        _logger.info(f"Got Result kwargs={kwargs_bundle}")
+        _logger.info("Got Result kwargs=%s", kwargs_bundle)
         if report:
             _logger.info(f"Got Result report id={report['id']}")
         else:
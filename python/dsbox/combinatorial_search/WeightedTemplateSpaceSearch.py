@@ -15,6 +15,7 @@ from dsbox.combinatorial_search.ConfigurationSpaceBaseSearch import Configuratio
 from dsbox.template.configuration_space import ConfigurationPoint
 from dsbox.combinatorial_search.ExecutionHistory import ExecutionHistory
 from dsbox.JobManager.cache import CacheManager
+from dsbox.JobManager.DistributedJobManager import JobStatus, JOB_STATUS, TIME_LIMIT
 from dsbox.template.template import DSBoxTemplate
 
 
@@ -56,6 +57,9 @@ class WeightedTemplateSpaceSearch():
 
         # self.cacheManager.timeout_sec = timeout_sec
         self.template_list = template_list
+        self.output_directory = output_directory
+        self.cacheManager.candidate_cache.set_context(
+            all_dataset if all_dataset is not None else train_dataset1, problem)
 
         self.weights = [template.template['weight'] if 'weight' in template.template else 1.0 for template in self.template_list]
 
@@ -205,11 +209,26 @@ class WeightedTemplateSpaceSearch():
             _logger.debug(f"Report details: {report}")
             self.history.update(report, template_name=template_name)
             self.cacheManager.candidate_cache.push(report)
+        elif kwargs_bundle.get(JOB_STATUS) == JobStatus.CANCELLED:
+            # Not evaluated, neither the template nor the candidate are charged
+            _logger.info(f"Evaluation cancelled on candidate {hash(str(candidate))}")
+        elif kwargs_bundle.get(JOB_STATUS) == JobStatus.TIMEOUT:
+            _logger.warning(f"Evaluation timed out on candidate {hash(str(candidate))}")
+            # Charge the time spent to the template
+            fail_report = {'total_runtime': kwargs_bundle.get(TIME_LIMIT) or 0}
+            self.history.update_none(fail_report=fail_report, template_name=template_name)
+            # Not persisted, the candidate may finish in a later search
+            self.cacheManager.candidate_cache.push_None(candidate=candidate)
+        elif kwargs_bundle.get(JOB_STATUS) == JobStatus.LOST:
+            _logger.warning(f"Evaluation lost its worker on candidate {hash(str(candidate))}")
+            self.history.update_none(fail_report=None, template_name=template_name)
+            # Not persisted, e.g. the worker ran out of memory next to other jobs
+            self.cacheManager.candidate_cache.push_None(candidate=candidate)
         else:
             _logger.info(f"Search Failed on candidate {hash(str(candidate))}")
             # _logger.warning(traceback.format_exc())
             self.history.update_none(fail_report=None, template_name=template_name)
-            self.cacheManager.candidate_cache.push_None(candidate=candidate)
+            self.cacheManager.candidate_cache.push_None(candidate=candidate, failed=True)
 
     def _prepare_job_posting(self,
                              candidate: typing.Dict[str, typing.Any],
@@ -268,6 +287,9 @@ class WeightedTemplateSpaceSearch():
         Returns:
             Bool: whether candidate evaluation is needed or not
         """
+        # Results of previous runs end up in the candidate cache
+        self.cacheManager.candidate_cache.reuse_persisted(candidate, self.history, self.output_directory)
+
         if self.cacheManager.candidate_cache.is_hit(candidate):
             report = self.cacheManager.candidate_cache.lookup(candidate)
             assert report is not None and 'configuration' in report, \
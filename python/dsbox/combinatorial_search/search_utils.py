@@ -1,13 +1,24 @@
 import bisect
+import collections.abc
+import copy
 import enum
 import pickle
 import operator
 import os
 import random
+import uuid
+
+import numpy as np
+import pandas as pd
+
 from d3m.metadata.base import ALL_ELEMENTS
 from d3m.base import utils
 from d3m.metadata.base import DataMetadata
 
+from dsbox.JobManager import fingerprint
+from dsbox.JobManager import shared_files
+from dsbox.JobManager import shared_memory
+
 comparison_metrics = ['training_metrics', 'cross_validation_metrics', 'test_metrics']
 
 def random_choices_without_replacement(population, weights, k=1):
@@ -43,11 +54,138 @@ def accumulate(iterable, func=operator.add):
         yield total
 
 
+class RowSplit:
+    '''
+    Rows of the main resource of a saved dataset, the base. Splits are represented by their rows
+    and materialized as datasets only where a container is needed.
+    '''
+    def __init__(self, base_name, resource_id, rows, base_rows, base_fingerprint):
+        self.base_name = base_name
+        self.resource_id = resource_id
+        # Ascending, like the rows selected by Dataset.select_rows
+        self.rows = np.unique(np.asarray(rows, dtype=np.int64))
+        self.base_rows = base_rows
+        self.base_fingerprint = base_fingerprint
+        self.fingerprint = fingerprint.combine('rows', base_fingerprint, resource_id,
+                                               fingerprint.ndarray_fingerprint(self.rows))
+
+    @classmethod
+    def of_dataset(cls, base_name, dataset):
+        '''
+        All the rows of dataset, saved as base_name
+        '''
+        resource_id, resource = utils.get_tabular_resource(dataset=dataset, resource_id=None)
+        return cls(base_name, resource_id, np.arange(len(resource)), len(resource),
+                   fingerprint.ensure_fingerprint(dataset))
+
+    @property
+    def fraction(self):
+        return len(self.rows) / self.base_rows if self.base_rows else 1.0
+
+    def subset(self, positions):
+        '''
+        Rows at the given positions of the dataset this split materializes to
+        '''
+        return RowSplit(self.base_name, self.resource_id, self.rows[np.asarray(positions, dtype=np.int64)],
+                        self.base_rows, self.base_fingerprint)
+
+    def materialize(self, base):
+        dataset = base.select_rows({self.resource_id: self.rows.tolist()})
+        # Derived from the rows, so no process has to hash the content of the split
+        fingerprint.attach_fingerprint(dataset, self.fingerprint)
+        return dataset
+
+
+class LazySplits(collections.abc.Sequence):
+    '''
+    Sequence of the datasets selected by a list of RowSplits (or None). A dataset is
+    materialized when it is accessed and only the last one is kept, so a loop over the splits
+    holds one at a time.
+    '''
+    def __init__(self, splits, base_loader=None):
+        self.splits = list(splits)
+        # base name -> base dataset
+        self._base_loader = base_loader
+        self._current = (None, None)
+
+    def __len__(self):
+        return len(self.splits)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        index = range(len(self))[index]
+        split = self.splits[index]
+        if not isinstance(split, RowSplit):
+            return split
+        if self._current[0] != index:
+            # Free the previous one first
+            self._current = (None, None)
+            base_loader = self._base_loader or load_resident_dataset
+            self._current = (index, split.materialize(base_loader(split.base_name)))
+        return self._current[1]
+
+    def __reduce__(self):
+        # Rows only, the base is loaded where the splits are used
+        return (LazySplits, (self.splits,))
+
+
+def row_splits(split_primitive, rows):
+    '''
+    Splits of a fitted d3m split primitive as RowSplits, subsets of rows, the RowSplit of the
+    dataset it was fitted on. Returns None if rows is not a RowSplit or if the primitive does not
+    expose its splits.
+    '''
+    # Row positions in the main resource, computed by fit() and selected by produce()
+    splits = getattr(split_primitive, '_splits', None)
+    if not isinstance(rows, RowSplit) or splits is None:
+        return None
+    try:
+        return [rows.subset(train) for train, _ in splits], [rows.subset(test) for _, test in splits]
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _is_row_split(dataset):
+    if isinstance(dataset, list):
+        return any(isinstance(item, RowSplit) for item in dataset)
+    return isinstance(dataset, RowSplit)
+
+
+# dataset name -> columns of the dataset saved by this process
+_shared_datasets = {}
+
+# dataset name -> RowSplit or list of RowSplits saved by this process
+_saved_splits = {}
+
+
 def save_pickled_dataset(dataset, dataset_name):
     base_dir = os.environ.get("D3MLOCALDIR", "/tmp")
     dataset_path = os.path.join(base_dir, dataset_name + ".pkl")
+    _saved_splits.pop(dataset_name, None)
+    if isinstance(dataset, LazySplits):
+        dataset = dataset.splits
+    if _is_row_split(dataset):
+        # Only the rows are saved, load_resident_dataset materializes them from the base
+        shared_memory.release(_shared_datasets.pop(dataset_name, None))
+        _saved_splits[dataset_name] = dataset
+        with open(dataset_path, 'wb') as f:
+            pickle.dump(dataset, f)
+        return
+    if dataset is not None:
+        # Hash the content once here, so that workers loading the dataset do not have to
+        fingerprint.ensure_fingerprint(dataset)
+    # Workers map the numeric columns from the column files instead of unpickling their own
+    # copy, string columns are still unpickled, see shared_memory. A new directory each time,
+    # workers may still map the previous one.
+    previous = _shared_datasets.pop(dataset_name, None)
+    columns_dir = os.path.join(base_dir, f"{dataset_name}_{uuid.uuid4().hex}.columns")
+    shared = shared_memory.save_columns(dataset, columns_dir)
+    if isinstance(shared, shared_memory.ColumnsHandle):
+        _shared_datasets[dataset_name] = shared
     with open(dataset_path, 'wb') as f:
-        pickle.dump(dataset, f)
+        pickle.dump(shared, f)
+    shared_memory.release(previous)
 
 
 def load_pickled_dataset(dataset_name):
@@ -56,7 +194,81 @@ def load_pickled_dataset(dataset_name):
     if not os.path.exists(dataset_path):
         return None
     with open(dataset_path, 'rb') as f:
-        return pickle.load(f)
+        return shared_memory.attach(pickle.load(f))
+
+
+# dataset name -> ResidentValue of the dataset loaded by this process
+_resident_datasets = {}
+
+
+def load_resident_dataset(dataset_name):
+    '''
+    Like load_pickled_dataset, but loads the dataset only once per process, as long as its file
+    does not change. Each call returns a view: a shallow copy of the dataset and of each of its
+    resource frames, so replacing the resources, the columns or the metadata of one view does
+    not affect the others. Values mapped from shared memory are copy-on-write: primitives may
+    modify them in place without affecting other processes, but later views in this process
+    see the change.
+
+    A saved RowSplit is materialized from its base once. A saved list of RowSplits is returned as
+    LazySplits, materializing one split at a time.
+    '''
+    base_dir = os.environ.get("D3MLOCALDIR", "/tmp")
+    dataset_path = os.path.join(base_dir, dataset_name + ".pkl")
+    resident = _resident_datasets.setdefault(dataset_name, shared_files.ResidentValue())
+    return _dataset_view(resident.get(dataset_path, _load_resident_file))
+
+
+def _load_resident_file(dataset_path):
+    dataset = shared_memory.attach(shared_files.load_pickle(dataset_path))
+    if isinstance(dataset, RowSplit):
+        dataset = dataset.materialize(load_resident_dataset(dataset.base_name))
+    return dataset
+
+
+def release_resident_datasets():
+    '''
+    Frees the datasets loaded by load_resident_dataset, e.g. once the search is over
+    '''
+    _resident_datasets.clear()
+
+
+def _dataset_view(dataset):
+    if _is_row_split(dataset):
+        return LazySplits(dataset)
+    if isinstance(dataset, list):
+        return [_dataset_view(item) for item in dataset]
+    if isinstance(dataset, dict):
+        view = copy.copy(dataset)
+        for resource_id, resource in dataset.items():
+            if isinstance(resource, pd.DataFrame):
+                view[resource_id] = _frame_view(resource)
+        return view
+    return dataset
+
+
+def _frame_view(frame):
+    view = frame.copy(deep=False)
+    if hasattr(frame, 'metadata'):
+        view.metadata = frame.metadata
+    return view
+
+
+def pickled_dataset_size(dataset_name):
+    '''
+    Size in bytes of a dataset saved by save_pickled_dataset, or 0 if there is none
+    '''
+    base_dir = os.environ.get("D3MLOCALDIR", "/tmp")
+    dataset_path = os.path.join(base_dir, dataset_name + ".pkl")
+    if dataset_name in _shared_datasets:
+        return _shared_datasets[dataset_name].size
+    split = _saved_splits.get(dataset_name)
+    if isinstance(split, RowSplit):
+        return int(pickled_dataset_size(split.base_name) * split.fraction)
+    try:
+        return os.path.getsize(dataset_path)
+    except OSError:
+        return 0
 
 
 class Status(enum.Enum):
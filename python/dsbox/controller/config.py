@@ -19,6 +19,87 @@ class RuntimeSetting:
         self.log_dir = log_dir
 
 
+class CacheSetting:
+    '''
+    Class for storing information needed by the search caches
+    '''
+    def __init__(self, *, primitive_cache_dir: str = None, primitive_cache_max_bytes: int = 0,
+                 cache_step_outputs: bool = True, cache_read_bytes_per_second: int = 500 * 1024**2,
+                 cache_validation_rate: float = 0.1,
+                 candidate_cache_dir: str = None, reuse_candidate_results: bool = True,
+                 metrics_file: str = None):
+        self.primitive_cache_dir = primitive_cache_dir
+        # Byte budget of the on-disk primitive cache. Zero means unbounded.
+        self.primitive_cache_max_bytes = primitive_cache_max_bytes
+        # Also cache the produced outputs of fitted steps (only with primitive_cache_dir)
+        self.cache_step_outputs = cache_step_outputs
+        # Used to decide whether reading cached outputs is cheaper than producing them
+        self.cache_read_bytes_per_second = cache_read_bytes_per_second
+        # Fraction of cache hits of trusted primitives that are validated by refitting
+        self.cache_validation_rate = cache_validation_rate
+        # Evaluation results persisted across runs
+        self.candidate_cache_dir = candidate_cache_dir
+        # Reuse results of previous runs instead of evaluating the candidates again
+        self.reuse_candidate_results = reuse_candidate_results
+        # Cache statistics are dumped here at the end of each search
+        self.metrics_file = metrics_file
+
+
+class JobSetting:
+    '''
+    Class for storing information needed by the parallel job manager
+    '''
+    def __init__(self, *, job_time_limit: float = 0, job_time_limit_fraction: float = 0.5,
+                 min_job_time_limit: float = 60, ram_bytes: int = 0,
+                 worker_max_jobs: int = 0, worker_max_rss_bytes: int = 0,
+                 admission_ram_fraction: float = 0.8, cancel_grace_period: float = 30,
+                 warm_workers: bool = True, log_level: int = logging.NOTSET,
+                 stall_timeout: float = 0, speculative_execution: bool = False,
+                 executor: str = 'process', executor_address: str = '0.0.0.0:0', executor_authkey: str = '',
+                 cpu: int = 0, parallel_folds: bool = True):
+        # Seconds a single candidate evaluation may run. Zero means derived from the search time.
+        self.job_time_limit = job_time_limit
+        # Without job_time_limit, fraction of the remaining search time given to a job. Zero
+        # means no limit.
+        self.job_time_limit_fraction = job_time_limit_fraction
+        # Lower bound of the derived time limit
+        self.min_job_time_limit = min_job_time_limit
+        # Memory available to the search. Zero means unknown.
+        self.ram_bytes = ram_bytes
+        # A worker is replaced after this many jobs. Zero means never.
+        self.worker_max_jobs = worker_max_jobs
+        # A worker is replaced once its rss exceeds this, checked between jobs. Zero means
+        # ram_bytes divided by the number of workers.
+        self.worker_max_rss_bytes = worker_max_rss_bytes
+        # Jobs are held back while the predicted memory of the running jobs would exceed this
+        # fraction of ram_bytes. Zero disables admission control.
+        self.admission_ram_fraction = admission_ram_fraction
+        # Seconds a cancelled job is given to stop at a step boundary before its worker is
+        # terminated
+        self.cancel_grace_period = cancel_grace_period
+        # Fork the workers from a zygote process that preloads the primitives of the search
+        self.warm_workers = warm_workers
+        # Workers drop log records below this level instead of sending them to the main process,
+        # where no handler would output them
+        self.log_level = log_level
+        # Seconds a job may stay at the same pipeline step without using CPU before its worker is
+        # terminated. Zero means never.
+        self.stall_timeout = stall_timeout
+        # Run a copy of straggler jobs on idle workers and keep the first result, and run the job
+        # of a stalled worker again
+        self.speculative_execution = speculative_execution
+        # 'process' runs the workers on this host. 'socket' also accepts remote workers on
+        # executor_address, authenticated with executor_authkey, see dsbox.JobManager.executor.
+        self.executor = executor
+        self.executor_address = executor_address
+        self.executor_authkey = executor_authkey
+        # CPUs available to the search. Zero means unknown.
+        self.cpu = cpu
+        # Workers run the folds of a cross-validation in parallel on the CPUs not reserved for
+        # other workers, see dsbox.JobManager.fold_budget
+        self.parallel_folds = parallel_folds
+
+
 class DsboxConfig:
     '''
     Class for loading and managing DSBox configurations.
@@ -67,9 +148,52 @@ class DsboxConfig:
     * logs (log_dir): directory for logging files
     * logs/dfs (dfs_log_dir): directory for detailed dataframe logging
 
+    Written under output_dir, next to pipelines_status:
+    * cache_metrics.json: primitive and candidate cache statistics of the last search
+
     DSBox variables
     * search_method: pipeline search methods, possible values 'serial', 'parallel', 'random-dimensional', 'bandit', 'multi-bandit'
     * timeout_search: Timeout for search part. The remaining time after timeout_search is used for returning results.
+    * primitive_cache_dir: Directory under local_dir where fitted primitives are spilled during search
+    * primitive_cache_max_bytes: Byte budget of the primitive cache. By default a fraction
+      (primitive_cache_ram_fraction) of ram, can be overridden with DSBOX_PRIMITIVE_CACHE_MB.
+    * cache_step_outputs: If true, the primitive cache also stores the produced outputs of fitted
+      steps. Set DSBOX_CACHE_STEP_OUTPUTS=false to disable.
+    * cache_validation_rate: Fraction of primitive cache hits validated by refitting, once the
+      primitive passed its first validations. Can be overridden with DSBOX_CACHE_VALIDATION_RATE.
+    * candidate_cache_dir: Directory under local_dir where candidate evaluation results are
+      persisted across runs
+    * reuse_candidate_results: If true, candidates evaluated by a previous run on the same dataset and
+      problem are not evaluated again. Set DSBOX_REUSE_CANDIDATE_RESULTS=false to disable.
+    * job_time_limit: Seconds a single candidate evaluation may run in a parallel search before its
+      worker is terminated. Taken from time_bound_run if TA3 sets it, otherwise from
+      DSBOX_JOB_TIME_LIMIT. If zero, a job gets job_time_limit_fraction of the remaining search
+      time (DSBOX_JOB_TIME_LIMIT_FRACTION, zero disables the limit).
+    * worker_max_jobs: Parallel search workers are replaced by fresh processes after this many jobs
+      (DSBOX_WORKER_MAX_JOBS, zero means never)
+    * worker_max_rss_bytes: Workers are also replaced between jobs once their resident memory exceeds
+      this. By default ram divided by cpu, can be overridden with DSBOX_WORKER_MAX_RSS_MB.
+    * admission_ram_fraction: Parallel search jobs are only dispatched while the predicted memory of
+      the running jobs stays within this fraction of ram (DSBOX_ADMISSION_RAM_FRACTION, zero disables)
+    * cancel_grace_period: Seconds a cancelled parallel search job may take to stop before its worker
+      is terminated (DSBOX_CANCEL_GRACE_PERIOD)
+    * warm_workers: If true, parallel search workers are forked from a process that has imported the
+      primitives of the selected templates. Set DSBOX_WARM_WORKERS=false to disable.
+    * stall_timeout: Seconds a parallel search job may stay at the same pipeline step without its
+      processes using CPU before its worker is terminated (DSBOX_STALL_TIMEOUT, by default zero,
+      which disables it)
+    * speculative_execution: If true, straggler jobs are also run on idle workers and the first
+      result is kept, and jobs of stalled workers are run again. Set DSBOX_SPECULATIVE_EXECUTION=true
+      to enable.
+    * executor: 'process' runs the parallel search workers on this host. With 'socket', workers
+      started on other hosts with python -m dsbox.JobManager.remote_worker join the search
+      (DSBOX_EXECUTOR, DSBOX_EXECUTOR_ADDRESS as host:port, DSBOX_EXECUTOR_AUTHKEY required)
+    * parallel_folds: If true, parallel search workers run cross-validation folds in extra
+      processes on the CPUs not used by other workers, within cpu. Set DSBOX_PARALLEL_FOLDS=false
+      to disable.
+    * racing: If true, the cross-validation of a candidate stops once its folds show it cannot beat
+      the best candidate so far, and it is recorded as partially evaluated. Set DSBOX_RACING=false
+      to disable.
 
     '''
 
@@ -118,6 +242,33 @@ class DsboxConfig:
         # Search time
         self.timeout_search: int = 0
 
+        # == DSBox caching
+        self.primitive_cache_dir: str = ''
+        self.primitive_cache_ram_fraction: float = 0.25
+        self.primitive_cache_max_bytes: int = 0
+        self.cache_step_outputs: bool = True
+        self.cache_validation_rate: float = 0.1
+        self.candidate_cache_dir: str = ''
+        self.reuse_candidate_results: bool = True
+
+        # == DSBox parallel job manager
+        self.job_time_limit: int = 0
+        self.job_time_limit_fraction: float = 0.5
+        self.worker_max_jobs: int = 50
+        self.worker_max_rss_bytes: int = 0
+        self.admission_ram_fraction: float = 0.8
+        self.cancel_grace_period: float = 30
+        self.warm_workers: bool = True
+        self.stall_timeout: float = 0
+        self.speculative_execution: bool = False
+        self.executor: str = 'process'
+        self.executor_address: str = '0.0.0.0:0'
+        self.executor_authkey: str = ''
+        self.parallel_folds: bool = True
+
+        # == DSBox search
+        self.racing: bool = True
+
         # DSBox logging
         self.file_formatter = "%(asctime)s [%(levelname)s] %(name)s -- %(message)s"
         self.file_logging_level = logging.INFO
@@ -189,6 +340,45 @@ class DsboxConfig:
             scratch_dir=self.dsbox_scratch_dir,
             log_dir=self.log_dir)
 
+    def get_cache_setting(self) -> CacheSetting:
+        return CacheSetting(
+            primitive_cache_dir=self.primitive_cache_dir,
+            primitive_cache_max_bytes=self.primitive_cache_max_bytes,
+            cache_step_outputs=self.cache_step_outputs,
+            cache_validation_rate=self.cache_validation_rate,
+            candidate_cache_dir=self.candidate_cache_dir,
+            reuse_candidate_results=self.reuse_candidate_results,
+            metrics_file=os.path.join(self.output_dir, 'cache_metrics.json'))
+
+    def get_job_setting(self) -> JobSetting:
+        return JobSetting(
+            job_time_limit=self.time_bound_run if self.time_bound_run > 0 else self.job_time_limit,
+            job_time_limit_fraction=self.job_time_limit_fraction,
+            ram_bytes=self.ram_bytes,
+            worker_max_jobs=self.worker_max_jobs,
+            worker_max_rss_bytes=self.worker_max_rss_bytes,
+            admission_ram_fraction=self.admission_ram_fraction,
+            cancel_grace_period=self.cancel_grace_period,
+            warm_workers=self.warm_workers,
+            log_level=min(self.file_logging_level, self.console_logging_level),
+            stall_timeout=self.stall_timeout,
+            speculative_execution=self.speculative_execution,
+            executor=self.executor,
+            executor_address=self.executor_address,
+            executor_authkey=self.executor_authkey,
+            cpu=self.cpu,
+            parallel_folds=self.parallel_folds)
+
+    @property
+    def ram_bytes(self) -> int:
+        '''
+        Returns available memory in bytes, or 0 if D3MRAM is not defined.
+
+        D3MRAM is in GB units (for example 15), but also accept Kubernetes style quantities
+        like 15Gi or 512Mi.
+        '''
+        return parse_memory_size(self.ram, default_unit=1024**3)
+
     def _load_d3m_environment(self, ta2ta3_mode: bool):
         '''
         Get D3M environmental variable values.
@@ -240,6 +430,47 @@ class DsboxConfig:
             self.search_method = 'weighted_parallel'
             # self.search_method = 'parallel'
             # self.search_method = 'serial'
+        if 'DSBOX_PRIMITIVE_CACHE_MB' in os.environ:
+            self.primitive_cache_max_bytes = int(os.environ['DSBOX_PRIMITIVE_CACHE_MB']) * 1024**2
+        else:
+            self.primitive_cache_max_bytes = int(self.ram_bytes * self.primitive_cache_ram_fraction)
+        if 'DSBOX_CACHE_STEP_OUTPUTS' in os.environ:
+            self.cache_step_outputs = os.environ['DSBOX_CACHE_STEP_OUTPUTS'].lower() not in ('false', '0', 'no')
+        if 'DSBOX_CACHE_VALIDATION_RATE' in os.environ:
+            self.cache_validation_rate = float(os.environ['DSBOX_CACHE_VALIDATION_RATE'])
+        if 'DSBOX_REUSE_CANDIDATE_RESULTS' in os.environ:
+            self.reuse_candidate_results = \
+                os.environ['DSBOX_REUSE_CANDIDATE_RESULTS'].lower() not in ('false', '0', 'no')
+        if 'DSBOX_JOB_TIME_LIMIT' in os.environ:
+            self.job_time_limit = int(os.environ['DSBOX_JOB_TIME_LIMIT'])
+        if 'DSBOX_JOB_TIME_LIMIT_FRACTION' in os.environ:
+            self.job_time_limit_fraction = float(os.environ['DSBOX_JOB_TIME_LIMIT_FRACTION'])
+        if 'DSBOX_WORKER_MAX_JOBS' in os.environ:
+            self.worker_max_jobs = int(os.environ['DSBOX_WORKER_MAX_JOBS'])
+        if 'DSBOX_WORKER_MAX_RSS_MB' in os.environ:
+            self.worker_max_rss_bytes = int(os.environ['DSBOX_WORKER_MAX_RSS_MB']) * 1024**2
+        elif self.cpu > 0:
+            self.worker_max_rss_bytes = self.ram_bytes // self.cpu
+        if 'DSBOX_ADMISSION_RAM_FRACTION' in os.environ:
+            self.admission_ram_fraction = float(os.environ['DSBOX_ADMISSION_RAM_FRACTION'])
+        if 'DSBOX_CANCEL_GRACE_PERIOD' in os.environ:
+            self.cancel_grace_period = float(os.environ['DSBOX_CANCEL_GRACE_PERIOD'])
+        if 'DSBOX_WARM_WORKERS' in os.environ:
+            self.warm_workers = os.environ['DSBOX_WARM_WORKERS'].lower() not in ('false', '0', 'no')
+        if 'DSBOX_STALL_TIMEOUT' in os.environ:
+            self.stall_timeout = float(os.environ['DSBOX_STALL_TIMEOUT'])
+        if 'DSBOX_SPECULATIVE_EXECUTION' in os.environ:
+            self.speculative_execution = os.environ['DSBOX_SPECULATIVE_EXECUTION'].lower() in ('true', '1', 'yes')
+        if 'DSBOX_EXECUTOR' in os.environ:
+            self.executor = os.environ['DSBOX_EXECUTOR'].lower()
+        if 'DSBOX_EXECUTOR_ADDRESS' in os.environ:
+            self.executor_address = os.environ['DSBOX_EXECUTOR_ADDRESS']
+        if 'DSBOX_EXECUTOR_AUTHKEY' in os.environ:
+            self.executor_authkey = os.environ['DSBOX_EXECUTOR_AUTHKEY']
+        if 'DSBOX_PARALLEL_FOLDS' in os.environ:
+            self.parallel_folds = os.environ['DSBOX_PARALLEL_FOLDS'].lower() not in ('false', '0', 'no')
+        if 'DSBOX_RACING' in os.environ:
+            self.racing = os.environ['DSBOX_RACING'].lower() not in ('false', '0', 'no')
 
     def _setup(self):
         self._define_create_output_dirs()
@@ -312,6 +543,10 @@ class DsboxConfig:
         self.log_dir = os.path.join(self.dsbox_output_dir, 'logs')
         self.dfs_log_dir = os.path.join(self.log_dir, 'dfs')
 
+        # For spilling fitted primitives and persisting candidate results during search
+        self.primitive_cache_dir = os.path.join(self.local_dir, 'primitive_cache')
+        self.candidate_cache_dir = os.path.join(self.local_dir, 'candidate_cache')
+
         os.makedirs(self.output_dir, exist_ok=True)
         for directory in [
                 self.pipelines_ranked_dir, self.pipelines_ranked_temp_dir, self.pipelines_scored_dir,
@@ -379,6 +614,10 @@ class DsboxConfig:
         print(f'  timeout: {self.timeout}', file=out)
         print(f'  timeout_search: {self.timeout_search}', file=out)
         print(f'  search_method: {self.search_method}', file=out)
+        print(f'  primitive_cache_max_bytes: {self.primitive_cache_max_bytes}', file=out)
+        print(f'  cache_step_outputs: {self.cache_step_outputs}', file=out)
+        print(f'  cache_validation_rate: {self.cache_validation_rate}', file=out)
+        print(f'  reuse_candidate_results: {self.reuse_candidate_results}', file=out)
         content = out.getvalue()
         out.close()
         return content
@@ -407,6 +646,28 @@ class DsboxConfig:
     #         self[key] = os.path.join(prefix, suffix)
 
 
+def parse_memory_size(value: typing.Union[str, int, None], default_unit: int = 1) -> int:
+    '''
+    Convert memory size like '15', '15G', '15Gi' or '512Mi' to bytes. Plain numbers are
+    multiplied by default_unit. Returns 0 if value is empty or cannot be parsed.
+    '''
+    units = {'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4}
+    if value is None or str(value).strip() == '':
+        return 0
+    text = str(value).strip().lower()
+    if text.endswith('b'):
+        text = text[:-1]
+    number = text.rstrip('kmgti')
+    suffix = text[len(number):]
+    try:
+        if suffix == '':
+            return int(float(number) * default_unit)
+        # Treat 'G' same as 'Gi', since that is what is meant by memory limits most of the time
+        return int(float(number) * units.get(suffix.rstrip('i'), 0))
+    except ValueError:
+        return 0
+
+
 def find_dataset_docs(datasets_dir, _logger=None):
     '''
     Find all datasetDoc.json files under the input root directory.
@@ -32,17 +32,23 @@ from datamart_isi import config as config_datamart
 from datamart_isi import rest
 
 from dsbox.combinatorial_search.ExecutionHistory import ExecutionHistory
+from dsbox.combinatorial_search.search_utils import LazySplits, RowSplit, row_splits
 from dsbox.combinatorial_search.TemplateSpaceBaseSearch import TemplateSpaceBaseSearch
 from dsbox.combinatorial_search.TemplateSpaceParallelBaseSearch import TemplateSpaceParallelBaseSearch
 from dsbox.combinatorial_search.WeightedTemplateSpaceSearch import WeightedTemplateSpaceSearch
 from dsbox.combinatorial_search.WeightedTemplateSpaceParallelSearch import WeightedTemplateSpaceParallelSearch
+from dsbox.JobManager import fingerprint
+from dsbox.JobManager.cache import CacheManager
+from dsbox.JobManager.DistributedJobManager import DistributedJobManager
 from dsbox.JobManager.usage_monitor import UsageMonitor
 # from dsbox.combinatorial_search.BanditDimensionalSearch import BanditDimensionalSearch
 # from dsbox.combinatorial_search.MultiBanditSearch import MultiBanditSearch
 from dsbox.controller.config import DsboxConfig
-from dsbox.schema import ColumnRole, SpecializedProblem
+from dsbox.schema import ColumnRole, SpecializedProblem, get_target_columns
 from dsbox.pipeline.fitted_pipeline import FittedPipeline
 from dsbox.pipeline.ensemble_tuning import EnsembleTuningPipeline, HorizontalTuningPipeline
+from dsbox.template import fold_plan
+from dsbox.template import racing
 from dsbox.template.library import TemplateLibrary
 from dsbox.template.template import DSBoxTemplate
 
@@ -556,6 +562,8 @@ class Controller:
         self._log_search_results(report=report)
 
     def _run_WeightedParallelSearch(self, report_ensemble):
+        # TA3 may set time_bound_run after initialize()
+        self._search_method.job_manager.job_setting = self.config.get_job_setting()
         self._search_method.initialize_problem(
             template_list=self.template_list,
             performance_metrics=self.config.problem['problem']['performance_metrics'],
@@ -582,6 +590,8 @@ class Controller:
         self._search_method.job_manager.reset()
 
     def _run_ParallelBaseSearch(self, report_ensemble):
+        # TA3 may set time_bound_run after initialize()
+        self._search_method.job_manager.job_setting = self.config.get_job_setting()
         self._search_method.initialize_problem(
             template_list=self.template_list,
             performance_metrics=self.config.problem['problem']['performance_metrics'],
@@ -717,6 +727,9 @@ class Controller:
         # Set runtime environment info before process forks
         if self.config.static_dir:
             FittedPipeline.runtime_setting = self.config.get_runtime_setting()
+        CacheManager.cache_setting = self.config.get_cache_setting()
+        DistributedJobManager.job_setting = self.config.get_job_setting()
+        racing.enable(self.config.racing)
 
         use_multiprocessing = True
         # END change for v2020.1.23
@@ -1433,17 +1446,20 @@ class Controller:
         else:
             self._logger.info("Summary: Can split")
 
-    def split_dataset(self, dataset, random_state=42, test_size=0.2, n_splits=1, need_test_dataset=True):
+    def split_dataset(self, dataset, random_state=42, test_size=0.2, n_splits=1, need_test_dataset=True, rows=None):
         """
             Split dataset into 2 parts for training and test
+            If rows, the RowSplit of dataset, is given, the parts are returned as RowSplits when
+            the split primitive exposes its row indices, instead of as datasets.
         """
+        whole = dataset if rows is None else rows
         # if the dataset type in the list that we should not split
         if self.cannot_split:
             train_return = []
             test_return = []
             for i in range(n_splits):
                 # just return all dataset to train part
-                train_return.append(dataset)
+                train_return.append(whole)
                 test_return.append(None)
 
         # if the dataset type can be split
@@ -1481,10 +1497,15 @@ class Controller:
             try:
                 split_primitive.set_training_data(dataset=dataset)
                 split_primitive.fit()
-                # TODO: is it correct here?
-                query_dataset_list = list(range(n_splits))
-                train_return = split_primitive.produce(inputs=query_dataset_list).value
-                test_return = split_primitive.produce_score_data(inputs=query_dataset_list).value
+                splits = row_splits(split_primitive, rows)
+                if splits is not None:
+                    train_return = splits[0][:n_splits]
+                    test_return = splits[1][:n_splits]
+                else:
+                    # TODO: is it correct here?
+                    query_dataset_list = list(range(n_splits))
+                    train_return = split_primitive.produce(inputs=query_dataset_list).value
+                    test_return = split_primitive.produce_score_data(inputs=query_dataset_list).value
 
             except Exception as e:
                 # Do not split stratified shuffle fails
@@ -1493,7 +1514,7 @@ class Controller:
                 self._logger.warning('Split failed! Please check!!!')
                 self._logger.info(str(e))
                 for i in range(n_splits):
-                    train_return.append(dataset)
+                    train_return.append(whole)
                     test_return.append(None)
 
             self._logger.info("split done!")
@@ -1726,33 +1747,47 @@ class Controller:
                 # pickle this fitted sampler for furture use in pipelines
                 self.dump_primitive(sampler, "splitter")
 
+        # Splits are kept as rows of all_dataset where possible, and materialized where needed
+        all_rows = RowSplit.of_dataset("all_dataset", self.all_dataset)
+
+        def materialize(split):
+            if isinstance(split, RowSplit):
+                return split.materialize(self.all_dataset)
+            return split
+
         # if we need to do ensemble tune, we split one extra time
         if self.do_ensemble_tune or self.do_horizontal_tune:
-            self.train_dataset1, self.ensemble_dataset = self.split_dataset(dataset=self.all_dataset, test_size=0.1)
-            self.train_dataset1 = self.train_dataset1[0]
-            self.ensemble_dataset = self.ensemble_dataset[0]
-            self.train_dataset1, self.test_dataset1 = self.split_dataset(dataset=self.train_dataset1)
+            train_split1, ensemble_split = self.split_dataset(dataset=self.all_dataset, test_size=0.1, rows=all_rows)
+            train_split1 = train_split1[0]
+            ensemble_split = ensemble_split[0]
+            self.ensemble_dataset = materialize(ensemble_split)
+            train_split1, test_split1 = self.split_dataset(dataset=materialize(train_split1), rows=train_split1)
 
         else:
+            ensemble_split = self.ensemble_dataset
             # split the dataset first time
-            self.train_dataset1, self.test_dataset1 = self.split_dataset(dataset=self.all_dataset, test_size=0.1)
+            train_split1, test_split1 = self.split_dataset(dataset=self.all_dataset, test_size=0.1, rows=all_rows)
             if self._logger.getEffectiveLevel() <= 10:
-                self._save_dataset(self.train_dataset1, pathlib.Path(self.config.dsbox_scratch_dir) / 'train_dataset1')
-                self._save_dataset(self.test_dataset1, pathlib.Path(self.config.dsbox_scratch_dir) / 'test_dataset1')
+                self._save_dataset([materialize(split) for split in train_split1],
+                                   pathlib.Path(self.config.dsbox_scratch_dir) / 'train_dataset1')
+                self._save_dataset([materialize(split) for split in test_split1],
+                                   pathlib.Path(self.config.dsbox_scratch_dir) / 'test_dataset1')
 
         # here we only split one times, so no need to use list to include the dataset
-        if len(self.train_dataset1) == 1:
-            self.train_dataset1 = self.train_dataset1[0]
+        if len(train_split1) == 1:
+            train_split1 = train_split1[0]
         else:
             self._logger.error("Some error happend with all_dataset split: "
                                "The length of splitted dataset is not 1 but %s",
-                               len(self.train_dataset1))
+                               len(train_split1))
+        self.train_dataset1 = materialize(train_split1)
 
-        if len(self.test_dataset1) == 1:
-            self.test_dataset1 = self.test_dataset1[0]
+        if len(test_split1) == 1:
+            test_split1 = test_split1[0]
         else:
             self._logger.error("Split failed on all_dataset.")
-            self.test_dataset1 = None
+            test_split1 = None
+        self.test_dataset1 = materialize(test_split1)
 
         # if necessary, we need to make a second split
         if self.max_split_times > 0:
@@ -1762,8 +1797,11 @@ class Controller:
             else:
                 test_size = 0.1
 
-            self.train_dataset2, self.test_dataset2 = self.split_dataset(
-                dataset=self.train_dataset1, test_size=test_size, n_splits=self.max_split_times)
+            train_splits2, test_splits2 = self.split_dataset(
+                dataset=self.train_dataset1, test_size=test_size, n_splits=self.max_split_times, rows=train_split1)
+            # Materialized one at a time when used
+            self.train_dataset2 = LazySplits(train_splits2, base_loader=lambda _: self.all_dataset)
+            self.test_dataset2 = LazySplits(test_splits2, base_loader=lambda _: self.all_dataset)
             if len(self.train_dataset2) < 1:
                 self._logger.error(
                     "Some error happend with train_dataset1 split: The length of splitted dataset "
@@ -1776,12 +1814,39 @@ class Controller:
             self.test_dataset2 = None
         # save splitted dataset so that we do not send them via multi-processing queue
         from dsbox.combinatorial_search.search_utils import save_pickled_dataset
-        save_pickled_dataset(self.train_dataset1, "train_dataset1")
+        # all_dataset first, it is the base of the splits saved as rows
+        save_pickled_dataset(self.all_dataset, "all_dataset")
+        save_pickled_dataset(train_split1, "train_dataset1")
         save_pickled_dataset(self.train_dataset2, "train_dataset2")
-        save_pickled_dataset(self.test_dataset1, "test_dataset1")
+        save_pickled_dataset(test_split1, "test_dataset1")
         save_pickled_dataset(self.test_dataset2, "test_dataset2")
-        save_pickled_dataset(self.all_dataset, "all_dataset")
-        save_pickled_dataset(self.ensemble_dataset, "ensemble_tuning_dataset")
+        save_pickled_dataset(ensemble_split, "ensemble_tuning_dataset")
+        self._save_fold_plans()
+
+    def _save_fold_plans(self):
+        """
+            Compute the cross-validation folds of the datasets the candidates are fitted on once,
+            so that every candidate is validated on the same folds
+        """
+        settings = set()
+        for template in self.template_list:
+            for step in template.template['steps']:
+                runtime_instr = step.get('runtime', {})
+                if 'cross_validation' in runtime_instr:
+                    settings.add((int(runtime_instr['cross_validation']), bool(runtime_instr.get('stratified', False))))
+        plans = {}
+        for dataset in (self.train_dataset1, self.all_dataset):
+            if not settings or not isinstance(dataset, Dataset):
+                continue
+            try:
+                targets = get_target_columns(dataset)
+            except Exception:
+                self._logger.warning("Unable to get the targets for the fold plans", exc_info=True)
+                continue
+            targets = targets.drop(columns=['d3mIndex'], errors='ignore')
+            plans[fingerprint.ensure_fingerprint(dataset)] = [
+                fold_plan.compute_fold_plan(targets, n_splits, stratified) for n_splits, stratified in sorted(settings)]
+        fold_plan.save_fold_plans(plans)
 
 
     def _save_dataset(self, dataset_list: typing.List[Dataset], save_dir: pathlib.Path):
@@ -14,6 +14,16 @@ class PipelinePickleError(RuntimeError):
     Pipeline failed to properly pickle/unpickle
     '''
 
+class PipelineRacedOutError(RuntimeError):
+    '''
+    Cross-validation stopped early, the pipeline cannot beat the best pipeline so far. Carries
+    the cross-validation metrics of the folds that ran, and the evidence of the race.
+    '''
+    def __init__(self, message, cross_validation_metrics=None, evidence=None):
+        super().__init__(message)
+        self.cross_validation_metrics = cross_validation_metrics or []
+        self.evidence = evidence or {}
+
 # class MetricsMismatchError(ValueError):
 #     '''
 #     Mismatch between metrics generate by original and pickled pipelines.
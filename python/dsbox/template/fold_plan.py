@@ -0,0 +1,149 @@
+'''
+Cross-validation fold plans.
+
+The folds of Runtime._cross_validation only depend on the number of rows the pipeline is fitted
+on, on which rows share a class when stratified, and on the number of folds and the seed. The controller
+computes them once for the datasets the candidates are fitted on and saves them next to the
+dataset splits. Runtime looks up the plan of its input dataset by fingerprint, so every
+candidate is validated on the same folds, and no fold setup runs per candidate.
+
+Datasets without a plan, or whose rows changed in the pipeline, get their folds computed on the
+spot with compute_fold_plan(), as before. Stratified plans record the class of each row in row
+order, so steps that reorder the rows before the cross-validation do not get folds stratified on
+other targets.
+'''
+import logging
+import os
+import pickle
+import typing
+
+import numpy as np
+import pandas as pd
+
+from sklearn.model_selection import KFold, StratifiedKFold  # type: ignore
+
+from dsbox.JobManager import fingerprint
+from dsbox.JobManager import shared_files
+
+_logger = logging.getLogger(__name__)
+
+# Seed of the folds, unless the runtime instructions give one
+CV_SEED = 4767
+
+PLANS_NAME = 'fold_plans'
+
+# dataset fingerprint -> plans, loaded by this process
+_resident_plans = shared_files.ResidentValue()
+
+
+class FoldPlan:
+    """
+    Folds of one dataset for one cross-validation setting
+
+    Args:
+        n_splits: number of folds
+        stratified: whether stratified folds were asked for
+        seed: random state of the folds
+        folds: (train rows, test rows) of each fold
+        is_stratified: whether the folds are stratified, which fails e.g. for classes smaller
+            than the number of folds
+        targets_fingerprint: target_order_fingerprint() of the targets if stratified folds
+            were asked for, else None
+    """
+    def __init__(self, n_splits: int, stratified: bool, seed: int,
+                 folds: typing.List[typing.Tuple[np.ndarray, np.ndarray]], is_stratified: bool,
+                 targets_fingerprint: typing.Optional[str] = None) -> None:
+        self.n_splits = n_splits
+        self.stratified = stratified
+        self.seed = seed
+        self.folds = folds
+        self.is_stratified = is_stratified
+        self.targets_fingerprint = targets_fingerprint
+        self.n_rows = sum(len(test) for _, test in folds)
+
+    def matches(self, n_rows: int, n_splits: int, stratified: bool, seed: int,
+                targets_fingerprint: typing.Optional[str] = None) -> bool:
+        '''
+        Whether the plan applies. Plain folds only depend on the number of rows, stratified
+        folds also on the class of each row, given by targets_fingerprint.
+        '''
+        if stratified and self.targets_fingerprint != targets_fingerprint:
+            return False
+        return (self.n_rows == n_rows and self.n_splits == n_splits and self.stratified == stratified
+                and self.seed == seed)
+
+    def __len__(self):
+        return len(self.folds)
+
+    def __iter__(self):
+        return iter(self.folds)
+
+
+def _target_values(targets: typing.Any) -> np.ndarray:
+    values = np.asarray(targets)
+    if values.ndim == 2 and values.shape[1] == 1:
+        values = values[:, 0]
+    return values
+
+
+def target_order_fingerprint(targets: typing.Any) -> str:
+    '''
+    Fingerprint of which rows of targets share a class, in row order. It does not depend on how
+    the classes are encoded, e.g. as labels or as their codes.
+    '''
+    values = _target_values(targets)
+    columns = values.reshape(len(values), -1)
+    codes = np.stack([pd.factorize(columns[:, i])[0] for i in range(columns.shape[1])], axis=1)
+    return fingerprint.ndarray_fingerprint(codes)
+
+
+def compute_fold_plan(targets: typing.Any, n_splits: int, stratified: bool, seed: int = CV_SEED) -> FoldPlan:
+    '''
+    Folds of the rows of targets, a DataFrame or an array with a row per sample. Stratified folds
+    fall back to plain folds when stratifying fails.
+    '''
+    values = _target_values(targets)
+    placeholder = np.zeros(len(values))
+    folds = None
+    if stratified:
+        try:
+            folds = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed).split(placeholder, values))
+        except Exception as e:
+            _logger.error(f"Stratified failed, use KFold instead: {e}")
+    is_stratified = folds is not None
+    if folds is None:
+        folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=seed).split(placeholder))
+    targets_fingerprint = target_order_fingerprint(values) if stratified else None
+    return FoldPlan(n_splits, stratified, seed, folds, is_stratified, targets_fingerprint)
+
+
+def _plans_path() -> str:
+    return os.path.join(os.environ.get("D3MLOCALDIR", "/tmp"), PLANS_NAME + ".pkl")
+
+
+def save_fold_plans(plans: typing.Dict[str, typing.List[FoldPlan]]) -> None:
+    '''
+    Shares the plans, by dataset fingerprint, with the workers
+    '''
+    shared_files.dump_atomic(_plans_path(), plans)
+
+
+def lookup_fold_plan(dataset_fingerprint: typing.Optional[str], targets: typing.Any, n_splits: int,
+                     stratified: bool, seed: int = CV_SEED) -> typing.Optional[FoldPlan]:
+    '''
+    Saved plan of the dataset with the given fingerprint, or None if there is none for this
+    setting and these targets, the ones the folds are applied to
+    '''
+    if dataset_fingerprint is None:
+        return None
+    path = _plans_path()
+    try:
+        plans = _resident_plans.get(path, shared_files.load_pickle, default={})
+    except (OSError, EOFError, pickle.UnpicklingError):
+        _logger.warning(f'Unable to load fold plans {path}', exc_info=True)
+        return None
+    targets_fingerprint = target_order_fingerprint(targets) if stratified else None
+    for plan in plans.get(dataset_fingerprint, []):
+        if plan.matches(len(targets), n_splits, stratified, seed, targets_fingerprint):
+            return plan
+    return None
@@ -0,0 +1,173 @@
+'''
+Racing of cross-validation folds against the best pipeline found so far.
+
+Candidates are selected by the cross-validation of their fit on train_dataset1. The search
+publishes the best score of that cross-validation for each dataset and metric, the incumbent,
+whenever it improves. After each fold of a cross-validation with racing on, Runtime checks
+whether the candidate can still beat the incumbent of the same dataset: once an optimistic
+confidence bound on the mean score of the folds run so far is not better than the incumbent, in
+the sense of ExecutionHistory._is_better, the remaining folds are not run and the evaluation
+stops with PipelineRacedOutError. The search records such candidates as
+partially evaluated, with the scores of the folds that ran.
+
+Only the fits that select candidates race, the refits of a candidate on other datasets, e.g. on
+all_dataset, always run every fold. Without a published incumbent, e.g. outside of a search or
+before the first candidate with cross-validation scores, every fold runs too.
+'''
+import logging
+import math
+import operator
+import os
+import pickle
+import typing
+
+import numpy as np
+
+from scipy import stats  # type: ignore
+
+from dsbox.JobManager import shared_files
+from dsbox.schema import larger_is_better
+
+_logger = logging.getLogger(__name__)
+
+# One-sided confidence of the bound on the mean score of a candidate
+CONFIDENCE = 0.95
+
+# Folds run before a candidate may be stopped
+MIN_FOLDS = 2
+
+INCUMBENT_NAME = 'racing_incumbent'
+
+# Whether this process, the search, publishes incumbents
+_enabled = False
+
+# (dataset fingerprint, metric) -> best score, loaded by this process
+_resident_incumbent = shared_files.ResidentValue()
+
+
+def _incumbent_path() -> str:
+    return os.path.join(os.environ.get("D3MLOCALDIR", "/tmp"), INCUMBENT_NAME + ".pkl")
+
+
+def enable(enabled: bool) -> None:
+    '''
+    Called by the controller before the search, racing is off unless enabled
+    '''
+    global _enabled
+    _enabled = enabled
+
+
+def publish_incumbent(scores: typing.Dict) -> None:
+    '''
+    Shares the best cross-validation score of each (dataset fingerprint, metric) with the
+    workers. Without scores, or when racing is not enabled, candidates are not raced.
+    '''
+    path = _incumbent_path()
+    if not (_enabled and scores):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return
+    try:
+        shared_files.dump_atomic(path, dict(scores))
+    except OSError:
+        _logger.warning(f'Unable to publish incumbent {path}', exc_info=True)
+
+
+def lookup_incumbent(dataset: str, metric: typing.Any) -> typing.Optional[float]:
+    '''
+    Best published cross-validation score for metric on the dataset with the given fingerprint,
+    or None
+    '''
+    path = _incumbent_path()
+    try:
+        scores = _resident_incumbent.get(path, shared_files.load_pickle, default={})
+    except (OSError, EOFError, pickle.UnpicklingError):
+        _logger.debug(f'Unable to load incumbent {path}', exc_info=True)
+        return None
+    return scores.get((dataset, metric))
+
+
+def is_better(metric: typing.Any, check: float, base: float) -> bool:
+    '''
+    Whether score check is strictly better than score base, as in ExecutionHistory._is_better
+    '''
+    opr = operator.gt if larger_is_better(metric) else operator.lt
+    return opr(check, base)
+
+
+class FoldRace:
+    """
+    Follows the scores of the folds of one cross-validation, in fold order, and tells when the
+    candidate can no longer beat the incumbent. The first metric of the fold scores is raced.
+
+    Args:
+        n_folds: number of folds of the cross-validation
+        dataset: fingerprint of the dataset cross-validated, None to never stop the candidate
+        confidence: one-sided confidence of the bound on the mean score
+        min_folds: folds run before the candidate may be stopped
+    """
+    def __init__(self, n_folds: int, dataset: typing.Optional[str] = None, confidence: float = CONFIDENCE,
+                 min_folds: int = MIN_FOLDS) -> None:
+        self.n_folds = n_folds
+        self.dataset = dataset
+        self.confidence = confidence
+        self.min_folds = max(2, min_folds)
+        self.metric: typing.Any = None
+        # Score of each fold run so far, averaged over the targets
+        self.scores: typing.List[float] = []
+        # Set once the candidate is hopeless
+        self.incumbent: typing.Optional[float] = None
+        self.bound: typing.Optional[float] = None
+
+    def add(self, metric_score: typing.List[typing.Dict]) -> None:
+        if not metric_score:
+            return
+        if self.metric is None:
+            self.metric = metric_score[0]['metric']
+        values = [score['value'] for score in metric_score if score['metric'] == self.metric]
+        if values:
+            self.scores.append(float(np.mean(values)))
+
+    def optimistic_bound(self) -> float:
+        '''
+        Upper confidence bound on the mean score, lower bound if smaller scores are better
+        '''
+        count = len(self.scores)
+        spread = (stats.t.ppf(self.confidence, count - 1) * np.std(self.scores, ddof=1)
+                  / math.sqrt(count))
+        mean = float(np.mean(self.scores))
+        return float(mean + spread if larger_is_better(self.metric) else mean - spread)
+
+    def is_hopeless(self) -> bool:
+        if self.dataset is None:
+            return False
+        if len(self.scores) < self.min_folds or len(self.scores) >= self.n_folds:
+            return False
+        if not all(math.isfinite(score) for score in self.scores):
+            return False
+        incumbent = lookup_incumbent(self.dataset, self.metric)
+        if incumbent is None:
+            return False
+        bound = self.optimistic_bound()
+        if is_better(self.metric, bound, incumbent):
+            return False
+        self.incumbent = incumbent
+        self.bound = bound
+        return True
+
+    def evidence(self) -> typing.Dict:
+        '''
+        Why the candidate was stopped, recorded with its partial evaluation
+        '''
+        return {
+            'dataset': self.dataset,
+            'metric': self.metric,
+            'fold_values': list(self.scores),
+            'folds_run': len(self.scores),
+            'n_folds': self.n_folds,
+            'bound': self.bound,
+            'incumbent': self.incumbent,
+            'confidence': self.confidence,
+        }
@@ -2,6 +2,8 @@
 import contextlib
 import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import pdb
 import pprint
@@ -16,7 +18,6 @@ from collections import defaultdict
 from multiprocessing import current_process
 
 from pandas import DataFrame  # type: ignore
-from sklearn.model_selection import KFold, StratifiedKFold  # type: ignore
 
 import numpy as np
 
@@ -30,13 +31,146 @@ from d3m.metadata import pipeline_run as pipeline_run_module
 from d3m.metadata import problem
 from d3m.primitive_interfaces import base
 
+from dsbox.JobManager import cancellation
+from dsbox.JobManager import fingerprint
+from dsbox.JobManager import fold_budget
+from dsbox.JobManager import heartbeat
 from dsbox.JobManager.cache import PrimitivesCache
+from dsbox.exceptions import PipelineRacedOutError
+from dsbox.template import fold_plan
+from dsbox.template import racing
 from dsbox.template.utils import calculate_score, SpecialMetric
 
 _logger = logging.getLogger(__name__)
 
 MAX_DUMP_SIZE = 50  # 1000
 
+# Seconds between two checks for cancellation while waiting for fold processes
+FOLD_POLL_INTERVAL = 1.0
+
+
+def _take_rows(frame: DataFrame, rows: typing.Sequence[int]) -> DataFrame:
+    '''
+    Copy of the given rows of frame, with a continuous index
+    '''
+    fold = frame.take(rows, axis=0)
+    fold.reset_index(drop=True, inplace=True)
+    return fold
+
+
+def _fold_metrics(validation_metrics: typing.Dict[str, typing.List[float]],
+                  targets: typing.Dict[str, typing.List[list]]) -> typing.List[typing.Dict]:
+    '''
+    Cross-validation result of each metric from its fold values, or an empty list if a metric has
+    no values
+    '''
+    results = []
+    for metric_description, values in validation_metrics.items():
+        if len(values) == 0:
+            return []
+        results.append({
+            'metric': metric_description,
+            'value': sum(values) / len(values),
+            'values': values,
+            'targets': targets[metric_description],
+        })
+    return results
+
+
+def _flush_log_handlers() -> None:
+    for handler in logging.getLogger().handlers:
+        try:
+            handler.flush()
+        except Exception:
+            pass
+
+
+def _run_fold_share(conn, run_fold: typing.Callable, folds: typing.List[typing.Tuple],
+                    indices: typing.List[int]) -> None:
+    try:
+        for k in indices:
+            conn.send((k, run_fold(*folds[k])))
+    finally:
+        # Buffered records, e.g. of the BatchingQueueHandler of a search worker, whose flushing
+        # thread is not running here. The process exits without logging.shutdown().
+        _flush_log_handlers()
+        conn.close()
+
+
+def _receive_folds(receivers: typing.List, results: typing.Dict[int, typing.Any], timeout: float) -> bool:
+    '''
+    Adds the fold results sent by the fold processes within timeout to results. Returns False
+    once every process is done.
+    '''
+    if not receivers:
+        return False
+    for receiver in multiprocessing.connection.wait(receivers, timeout):
+        try:
+            k, result = receiver.recv()
+        except EOFError:
+            receivers.remove(receiver)
+            continue
+        results[k] = result
+    return True
+
+
+def _map_forked(run_fold: typing.Callable, folds: typing.List[typing.Tuple],
+                extra: int) -> typing.Iterator:
+    '''
+    Runs fold k in process k % (extra + 1), process 0 being this one, and yields the results in
+    fold order. Folds of a process that died have a None result. Closing the generator
+    terminates the fold processes.
+    '''
+    shares = [list(range(i, len(folds), extra + 1)) for i in range(extra + 1)]
+    context = multiprocessing.get_context('fork')
+    children = []
+    # Search workers are daemonic, which forbids children. The job manager kills the children
+    # of the workers it terminates.
+    daemon = current_process().daemon
+    current_process().daemon = False
+    # Fork with empty log buffers, and with no handler in the middle of a record, the children
+    # would send the buffered records again or wait for a lock held by a thread they lack
+    handlers = list(logging.getLogger().handlers)
+    _flush_log_handlers()
+    for handler in handlers:
+        handler.acquire()
+    try:
+        for share in shares[1:]:
+            receiver, sender = context.Pipe(duplex=False)
+            child = context.Process(target=_run_fold_share, args=(sender, run_fold, folds, share), daemon=True)
+            child.start()
+            sender.close()
+            children.append((child, receiver))
+    finally:
+        for handler in handlers:
+            handler.release()
+        current_process().daemon = daemon
+    try:
+        # fold index -> result, until yielded
+        results: typing.Dict[int, typing.Any] = {}
+        receivers = [receiver for _, receiver in children]
+        own_folds = iter(shares[0])
+        next_fold = 0
+        while next_fold < len(folds):
+            if next_fold in results:
+                yield results.pop(next_fold)
+                next_fold += 1
+                continue
+            cancellation.check_cancelled()
+            k = next(own_folds, None)
+            if k is not None:
+                results[k] = run_fold(*folds[k])
+                _receive_folds(receivers, results, 0)
+            elif not _receive_folds(receivers, results, FOLD_POLL_INTERVAL):
+                # Its process died
+                results[next_fold] = None
+    finally:
+        for child, receiver in children:
+            receiver.close()
+            if child.is_alive():
+                child.terminate()
+            child.join()
+
 
 class ForkedPdb(pdb.Pdb):
     """
@@ -120,6 +254,10 @@ class Runtime(runtime_base.Runtime):
         # super().__init__(pipeline=pipeline_description, hyperparams=None, problem_description=None)
 
         self.cache: PrimitivesCache = None
+        # Whether the cross-validation of fit may stop the pipeline early, see racing
+        self.race_folds = False
+        # Fingerprints of the data values computed during fit, keyed by data reference
+        self.data_fingerprints: typing.Dict[str, str] = {}
         self.cross_validation_result: typing.List = []
         if fitted_pipeline_id is None:
             # Occurs when runtime is not initialized by DSBox
@@ -138,7 +276,7 @@ class Runtime(runtime_base.Runtime):
         self.use_cache = True
         # self.timing["total_time_used_without_cache"] = 0.0
 
-        # Debug mode. If true compare cache with actual result.
+        # If true compare a sample of cache hits with the actual result, see CacheValidationPolicy
         self.validate_cache = True
         # use for recording the cpu/memory usage
         self.recorder_all = dict()
@@ -175,6 +313,7 @@ class Runtime(runtime_base.Runtime):
     def _do_run(self) -> None:
         if self.phase == metadata_base.PipelineRunPhase.FIT:
             prefix = 'fit'
+            self.data_fingerprints = {}
         else:
             prefix = 'pro'
         try:
@@ -196,6 +335,9 @@ class Runtime(runtime_base.Runtime):
             Override the d3m_runtime's function
             And add the cache support
         '''
+        # Step boundary, stop here if the search cancelled this job
+        cancellation.check_cancelled()
+        heartbeat.set_step(f'{self.current_step} {step.primitive}')
         if step.primitive is None:
             raise exceptions.InvalidPipelineError("Primitive has not been resolved.")
 
@@ -205,6 +347,7 @@ class Runtime(runtime_base.Runtime):
 
         time_start = time.time()
         cache_hit: bool = False
+        validate_hit: bool = False
 
         self.pipeline_run.add_primitive_step(step)
         arguments = self._prepare_primitive_arguments(step)
@@ -216,16 +359,21 @@ class Runtime(runtime_base.Runtime):
                 hash_prefix=None,
                 pipe_step=self.pipeline.steps[self.current_step],
                 primitive_arguments=arguments,
-                primitive_hyperparams=hyperparams
+                primitive_hyperparams=hyperparams,
+                argument_fingerprints=self._argument_fingerprints(step, arguments)
             )
 
             # Store cache_hit state. In parallel mode, cache may change state and cause primitive_actual not to be set.
-            cache_hit = self.use_cache and self.cache.is_hit_key(prim_hash=prim_hash, prim_name=prim_name)
+            if self.use_cache:
+                # Returns (None, None) on a miss, or if another worker evicted the entry meanwhile
+                fitting_time, primitive = self.cache.lookup_key(prim_name=prim_name, prim_hash=prim_hash)
+                cache_hit = primitive is not None
+                if cache_hit:
+                    _logger.debug(f'Using cached primitive: {prim_name}, {prim_hash}')
 
             if cache_hit:
-                _logger.debug(f'Using cached primitive: {prim_name}, {prim_hash}')
-                fitting_time, primitive = self.cache.lookup_key(prim_name=prim_name, prim_hash=prim_hash)
-                if self.validate_cache:
+                validate_hit = self.validate_cache and self.cache.should_validate(prim_name)
+                if validate_hit:
                     primitive_actual = self._create_pipeline_primitive(step.primitive, hyperparams)
             else:
                 # We create a primitive just before it is being fitted for the first time. This assures that any primitives
@@ -260,14 +408,20 @@ class Runtime(runtime_base.Runtime):
 
         if self.phase == metadata_base.PipelineRunPhase.FIT:
             if cache_hit:
-                fit_multi_produce_arguments = self._filter_arguments(step.primitive, 'multi_produce', dict(arguments, produce_methods=step.outputs))
-                while True:
-                    multi_call_result = self._call_primitive_method(primitive.multi_produce, fit_multi_produce_arguments)
-                    if multi_call_result.has_finished:
-                        outputs = multi_call_result.values
-                        break
+                # Outputs of the fitted step may be cached as well, then multi_produce is skipped
+                outputs = self.cache.lookup_outputs(prim_name=prim_name, prim_hash=prim_hash)
+                if outputs is None:
+                    produce_start = time.time()
+                    fit_multi_produce_arguments = self._filter_arguments(step.primitive, 'multi_produce', dict(arguments, produce_methods=step.outputs))
+                    while True:
+                        multi_call_result = self._call_primitive_method(primitive.multi_produce, fit_multi_produce_arguments)
+                        if multi_call_result.has_finished:
+                            outputs = multi_call_result.values
+                            break
+                    self.cache.push_outputs(prim_name=prim_name, prim_hash=prim_hash, outputs=outputs,
+                                            produce_time=time.time() - produce_start)
 
-                if self.validate_cache:
+                if validate_hit:
                     fit_multi_produce_arguments = self._filter_arguments(step.primitive, 'fit_multi_produce', dict(arguments, produce_methods=step.outputs))
                     while True:
                         multi_call_result = self._call_primitive_method(primitive_actual.fit_multi_produce, fit_multi_produce_arguments)
@@ -275,8 +429,13 @@ class Runtime(runtime_base.Runtime):
                             outputs_actual = multi_call_result.values
                             break
                     is_equal, reason = self._equals(outputs_actual, outputs)
+                    self.cache.record_validation(prim_name, is_equal, reason)
                     if not is_equal:
                         self._log_cache_difference(step, reason, outputs_actual, outputs)
+                        # Do not trust the cached result
+                        primitive = primitive_actual
+                        outputs = outputs_actual
+                        self.steps_state[self.current_step] = primitive
 
             else:
                 # Primitve is newly create, must fit it
@@ -293,7 +452,11 @@ class Runtime(runtime_base.Runtime):
 
                 # Add fitted primitive to cache
                 fitting_time = (time.time() - time_start)
-                self.cache.push_key(prim_name=prim_name, prim_hash=prim_hash, model=primitive, fitting_time=fitting_time)
+                push_status = self.cache.push_key(prim_name=prim_name, prim_hash=prim_hash, model=primitive, fitting_time=fitting_time)
+                if push_status in (PrimitivesCache.PUSHED, PrimitivesCache.DOUBLE_PUSH):
+                    # Without the cached model the outputs would cost a full fit to recompute
+                    self.cache.push_outputs(prim_name=prim_name, prim_hash=prim_hash, outputs=outputs,
+                                            produce_time=fitting_time)
 
         elif self.phase == metadata_base.PipelineRunPhase.PRODUCE:
             multi_produce_arguments = self._filter_arguments(step.primitive, 'multi_produce', dict(arguments, produce_methods=step.outputs))
@@ -315,6 +478,10 @@ class Runtime(runtime_base.Runtime):
 
             if output_id in outputs:
                 self.data_values[output_data_reference] = outputs[output_id]
+                if self.phase == metadata_base.PipelineRunPhase.FIT:
+                    output_fingerprint = fingerprint.derive_output_fingerprint(prim_hash, output_id)
+                    self.data_fingerprints[output_data_reference] = output_fingerprint
+                    fingerprint.attach_fingerprint(outputs[output_id], output_fingerprint)
             else:
                 raise exceptions.InvalidReturnValueError("Missing declared output '{output_id}' in computed primitive's outputs.".format(output_id=output_id))
         if self.phase == metadata_base.PipelineRunPhase.FIT:
@@ -326,6 +493,32 @@ class Runtime(runtime_base.Runtime):
         self.timing["total_time_used"] += (time.time() - time_start)
         _logger.debug(f"Done  primitive: {step.primitive.metadata.query()['name']}")
 
+    def _argument_fingerprints(self, step: pipeline_module.PrimitiveStep,
+                               arguments: typing.Dict) -> typing.Dict[str, str]:
+        '''
+        Fingerprints of the step arguments, taken from the upstream steps that produced them.
+        Raw pipeline inputs are content hashed at most once per run, or not at all if they
+        already carry a fingerprint in their metadata.
+        '''
+        result = {}
+        for name in arguments:
+            description = step.arguments.get(name)
+            if not description:
+                continue
+            data = description['data']
+            references = [data] if isinstance(data, str) else list(data)
+            fingerprints = []
+            for reference in references:
+                if reference not in self.data_fingerprints and reference.startswith('inputs.'):
+                    self.data_fingerprints[reference] = fingerprint.ensure_fingerprint(self.data_values[reference])
+                if reference not in self.data_fingerprints:
+                    # Produced by a non-primitive step, let the cache hash the content
+                    break
+                fingerprints.append(self.data_fingerprints[reference])
+            else:
+                result[name] = fingerprint.combine(*fingerprints)
+        return result
+
     def _equals(self, outputs_actual: typing.Dict, outputs: typing.Dict) -> typing.Tuple[bool, str]:
         try:
             for key, actual in outputs_actual.items():
@@ -625,7 +818,7 @@ class Runtime(runtime_base.Runtime):
                           fit_multi_produce_arguments: typing.Dict,
                           multi_produce_arguments: typing.Dict,
                           runtime_instr: typing.Dict,
-                          seed: int = 4767
+                          seed: int = fold_plan.CV_SEED
     ) -> typing.List:
         _logger.debug('cross-val primitive: %s' % str(primitive_base))
 
@@ -634,7 +827,6 @@ class Runtime(runtime_base.Runtime):
         validation_metrics: typing.Dict[str, typing.List[float]] = defaultdict(list)
         targets: typing.Dict[str, typing.List[list]] = defaultdict(list)
 
-        X = fit_multi_produce_arguments['inputs']
         y = fit_multi_produce_arguments['outputs']
 
         cv = runtime_instr.get('cross_validation', 10)
@@ -648,77 +840,31 @@ class Runtime(runtime_base.Runtime):
             with open(os.path.join(tmpdir, str(primitive_base)), 'w') as errorfile:
                 with contextlib.redirect_stderr(errorfile):
 
-                    if use_stratified:
-                        kf = StratifiedKFold(n_splits=cv, shuffle=True, random_state=seed)
-                    else:
-                        kf = KFold(n_splits=cv, shuffle=True, random_state=seed)
+                    # Same folds for every candidate fitted on this dataset
+                    plan = fold_plan.lookup_fold_plan(
+                        self.data_fingerprints.get('inputs.0'), y, cv, use_stratified, seed)
+                    if plan is None:
+                        plan = fold_plan.compute_fold_plan(y, cv, use_stratified, seed)
 
-                    try:
-                        temp = StratifiedKFold(n_splits=cv, shuffle=True, random_state=seed)
-                        for k, (train, test) in enumerate(temp.split(X, y)):
-                            pass
-                    except Exception as e:
-                        _logger.error(f"Stratified failed, use KFold instead: {e}")
-                        kf = KFold(n_splits=cv, shuffle=True, random_state=seed)
+                    # if task type not given, take a guess
+                    if self.task_type == "":
+                        self._guess_task_type()
 
-                    num = 0.0
-                    for k, (train, test) in enumerate(kf.split(X, y)):
-                        primitive = self._create_pipeline_primitive(primitive_base, hyperparams)
-
-                        trainX = X.take(train, axis=0)
-                        trainY = y.take(train, axis=0)#.values.ravel()
-                        testX = X.take(test, axis=0)
-                        testY = y.take(test, axis=0)#.values.ravel()
-
-                        # reset index to be continuous
-                        trainX = trainX.reset_index()
-                        trainY = trainY.reset_index()
-                        testX = testX.reset_index()
-                        testY = testY.reset_index()
-                        trainX = trainX.iloc[:, 1:]
-                        trainY = trainY.iloc[:, 1:]
-                        testX = testX.iloc[:, 1:]
-                        testY = testY.iloc[:, 1:]
-
-                        validation_train_arguments = dict(fit_multi_produce_arguments)
-                        validation_train_arguments['inputs'] = trainX
-                        validation_train_arguments['outputs'] = trainY
-
-                        validation_test_arguments = dict(multi_produce_arguments)
-                        validation_test_arguments['inputs'] = testX
-
-                        try:
-                            while True:
-                                multi_call_result = self._call_primitive_method(primitive.fit_multi_produce, validation_train_arguments)
-                                if multi_call_result.has_finished:
-                                    train_outputs = multi_call_result.values
-                                    break
-
-                            while True:
-                                multi_call_result = self._call_primitive_method(primitive.multi_produce, validation_test_arguments)
-                                if multi_call_result.has_finished:
-                                    test_outputs = multi_call_result.values
-                                    break
-
-                            ypred = test_outputs['produce']
+                    def run_fold(train, test):
+                        return self._run_fold(primitive_base, hyperparams, fit_multi_produce_arguments,
+                                              multi_produce_arguments, train, test)
 
-                            num = num + 1.0
-
-                            # if task type not given, take a guess
-                            if self.task_type == "":
-                                self._guess_task_type()
-
-                            if 'd3mIndex' not in testY.columns:
-                                testY.insert(0,'d3mIndex' ,testX['d3mIndex'].copy())
-                            if 'd3mIndex' not in ypred.columns:
-                                ypred.insert(0,'d3mIndex' ,testX['d3mIndex'].copy())
-
-                            # update 2019.5.13: use calculate_score method instead from ConfigurationSpaceBaseSearch
-                            # !!!! TODO: Use utils.score. How to fix this.
-                            metric_score = calculate_score(
-                                ground_truth=testY, prediction=ypred, performance_metrics=self.metric_descriptions,
-                                task_type=self.task_type, regression_metric=SpecialMetric().regression_metric)
+                    # Stops the candidate once it cannot beat the best pipeline so far
+                    race = racing.FoldRace(
+                        len(plan), self.data_fingerprints.get('inputs.0') if self.race_folds else None)
 
+                    num = 0.0
+                    # Merged in fold order, however the folds were run
+                    with contextlib.closing(self._map_folds(run_fold, list(plan))) as fold_scores:
+                        for metric_score in fold_scores:
+                            if metric_score is None:
+                                continue
+                            num = num + 1.0
                             # targets['ground_truth'].append(testY)
                             # targets['prediction'].append(ypred)
                             for metric_description in metric_score:
@@ -727,29 +873,21 @@ class Runtime(runtime_base.Runtime):
                             #     params: typing.Dict = metric_description['params']
                                 validation_metrics[metric_description['metric']].append(metric_description['value'])
                             # validation_metrics.append(metric_score)
-
-                        except Exception as e:
-                            sys.stderr.write(
-                                "ERROR: cross_validation {}: {}\n".format(primitive_base, e))
-                            # _logger.error("ERROR: cross_validation {}: {}\n".format(primitive_base, e))
-                            _logger.exception("ERROR: cross_validation {}: {}\n".format(primitive_base, e))
+                            race.add(metric_score)
+                            if race.is_hopeless():
+                                evidence = race.evidence()
+                                _logger.info(
+                                    f'Cross-validation of {primitive_base} stopped after {evidence["folds_run"]} '
+                                    f'of {evidence["n_folds"]} folds: bound {evidence["bound"]:.4f} on '
+                                    f'{evidence["metric"]} does not beat {evidence["incumbent"]:.4f}')
+                                raise PipelineRacedOutError(
+                                    f'Cross-validation stopped after {evidence["folds_run"]} folds',
+                                    _fold_metrics(validation_metrics, targets), evidence)
 
         if num == 0:
             return results
 
-        average_metrics: typing.Dict[str, dict] = {}
-        for name, values in validation_metrics.items():
-            if len(values) == 0:
-                return results
-            average_metrics[name] = sum(values) / len(values)
-
-        for metric_description in validation_metrics:
-            result_by_metric = {}
-            result_by_metric['metric'] = metric_description
-            result_by_metric['value'] = average_metrics[metric_description]
-            result_by_metric['values'] = validation_metrics[metric_description]
-            result_by_metric['targets'] = targets[metric_description]
-            results.append(result_by_metric)
+        results = _fold_metrics(validation_metrics, targets)
 
         for result in results:
             _logger.debug('cross-validation metric: %s=%.4f', result['metric'], result['value'])
@@ -758,6 +896,86 @@ class Runtime(runtime_base.Runtime):
 
         return results
 
+    def _run_fold(self,
+                  primitive_base: typing.Type[base.PrimitiveBase],
+                  hyperparams: typing.Dict,
+                  fit_multi_produce_arguments: typing.Dict,
+                  multi_produce_arguments: typing.Dict,
+                  train: typing.Sequence[int],
+                  test: typing.Sequence[int]
+    ) -> typing.Optional[typing.List[typing.Dict]]:
+        '''
+        Fits a new primitive on the train rows and scores it on the test rows. Returns the
+        metric scores of the fold, or None if it failed.
+        '''
+        X = fit_multi_produce_arguments['inputs']
+        y = fit_multi_produce_arguments['outputs']
+        primitive = self._create_pipeline_primitive(primitive_base, hyperparams)
+
+        # Folds are row indices of X and y, each is materialized right before
+        # the call that needs it
+        validation_train_arguments = dict(fit_multi_produce_arguments)
+        validation_train_arguments['inputs'] = _take_rows(X, train)
+        validation_train_arguments['outputs'] = _take_rows(y, train)
+
+        validation_test_arguments = dict(multi_produce_arguments)
+
+        try:
+            while True:
+                multi_call_result = self._call_primitive_method(primitive.fit_multi_produce, validation_train_arguments)
+                if multi_call_result.has_finished:
+                    train_outputs = multi_call_result.values
+                    break
+            # Free the training fold before materializing the test fold
+            validation_train_arguments = train_outputs = multi_call_result = None
+
+            testX = _take_rows(X, test)
+            testY = _take_rows(y, test)
+            validation_test_arguments['inputs'] = testX
+
+            while True:
+                multi_call_result = self._call_primitive_method(primitive.multi_produce, validation_test_arguments)
+                if multi_call_result.has_finished:
+                    test_outputs = multi_call_result.values
+                    break
+
+            ypred = test_outputs['produce']
+
+            if 'd3mIndex' not in testY.columns:
+                testY.insert(0,'d3mIndex' ,testX['d3mIndex'].copy())
+            if 'd3mIndex' not in ypred.columns:
+                ypred.insert(0,'d3mIndex' ,testX['d3mIndex'].copy())
+
+            # update 2019.5.13: use calculate_score method instead from ConfigurationSpaceBaseSearch
+            # !!!! TODO: Use utils.score. How to fix this.
+            return calculate_score(
+                ground_truth=testY, prediction=ypred, performance_metrics=self.metric_descriptions,
+                task_type=self.task_type, regression_metric=SpecialMetric().regression_metric)
+
+        except Exception as e:
+            sys.stderr.write(
+                "ERROR: cross_validation {}: {}\n".format(primitive_base, e))
+            # _logger.error("ERROR: cross_validation {}: {}\n".format(primitive_base, e))
+            _logger.exception("ERROR: cross_validation {}: {}\n".format(primitive_base, e))
+            return None
+
+    def _map_folds(self, run_fold: typing.Callable, folds: typing.List[typing.Tuple]) -> typing.Iterator:
+        '''
+        Yields the results of run_fold(train, test) for each fold, in fold order. In a search
+        worker the folds run in extra processes on the CPUs the job manager grants, see
+        fold_budget. Closing the generator stops the folds not run yet.
+        '''
+        extra = fold_budget.acquire(len(folds) - 1)
+        if extra == 0:
+            for train, test in folds:
+                yield run_fold(train, test)
+            return
+        _logger.debug(f'Running {len(folds)} folds in {extra + 1} processes')
+        try:
+            yield from _map_forked(run_fold, folds, extra)
+        finally:
+            fold_budget.release(extra)
+
     # def _cross_validation_old(self, primitive: typing.Type[base.PrimitiveBase],
     #                       training_arguments: typing.Dict,
     #                       produce_params: typing.Dict,
@@ -921,8 +1139,10 @@ class Runtime(runtime_base.Runtime):
         Paramters
         ---------
         arguments
-            Arguments required to train the Pipeline
+            Arguments required to train the Pipeline. With race=True, the cross-validation may
+            stop the pipeline early with PipelineRacedOutError, see racing
         """
+        self.race_folds = arguments.get('race', False)
         if 'cache' in arguments:
             _logger.debug("Using global cache")
             self.cache = arguments['cache']
@@ -931,6 +1151,7 @@ class Runtime(runtime_base.Runtime):
             self.cache = PrimitivesCache()
 
         self.fit_outputs = super().fit(inputs=inputs)
+        self.cache.metrics.flush()
         self.check_results(self.fit_outputs)
         return self.fit_outputs
 
@@ -554,6 +554,25 @@ class DSBoxTemplate():
     def get_output_step_number(self):
         return self.step_number[self.template['output']]
 
+    def get_primitive_paths(self) -> typing.Set[str]:
+        '''
+        Python paths of all the primitives the steps of the template may use
+        '''
+        paths: typing.Set[str] = set()
+
+        def add(primitive):
+            if isinstance(primitive, str):
+                paths.add(primitive)
+            elif isinstance(primitive, dict) and 'primitive' in primitive:
+                paths.add(primitive['primitive'])
+            elif isinstance(primitive, list):
+                for each in primitive:
+                    add(each)
+
+        for step in self.template.get('steps', []):
+            add(step.get('primitives', []))
+        return paths
+
 
 def _product_dict(dct):
     keys = dct.keys()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+# The dsbox dependencies are only installed in the docker image
+try:
+    import numpy as np
+    import pandas as pd
+    from dsbox.JobManager import fingerprint
+except ImportError:
+    fingerprint = None
+
+
+def _frame():
+    return pd.DataFrame({
+        'int': np.arange(100, dtype=np.int64),
+        'time': pd.date_range('2020-01-01', periods=100, freq='D'),
+        'delta': pd.to_timedelta(np.arange(100), unit='m'),
+        'text': [str(i) for i in range(100)],
+    })
+
+
+@unittest.skipUnless(fingerprint, 'dsbox dependencies are not installed')
+class TestFingerprint(unittest.TestCase):
+
+    def test_dataframe_stable(self):
+        self.assertEqual(fingerprint.dataframe_fingerprint(_frame()), fingerprint.dataframe_fingerprint(_frame()))
+        self.assertEqual(fingerprint.dataframe_fingerprint(_frame()),
+                         fingerprint.dataframe_fingerprint(_frame().copy(deep=True)))
+
+    def test_dataframe_changes(self):
+        base = fingerprint.dataframe_fingerprint(_frame())
+        for column, value in [('int', -1), ('time', pd.Timestamp('1999-01-01')),
+                              ('delta', pd.Timedelta(hours=5)), ('text', 'changed')]:
+            frame = _frame()
+            frame.loc[3, column] = value
+            self.assertNotEqual(fingerprint.dataframe_fingerprint(frame), base, column)
+        renamed = _frame().rename(columns={'int': 'other'})
+        self.assertNotEqual(fingerprint.dataframe_fingerprint(renamed), base)
+
+    def test_ndarray(self):
+        times = np.arange('2020-01-01', '2020-02-01', dtype='datetime64[D]')
+        self.assertEqual(fingerprint.ndarray_fingerprint(times), fingerprint.ndarray_fingerprint(times.copy()))
+        changed = times.copy()
+        changed[0] = np.datetime64('1999-01-01')
+        self.assertNotEqual(fingerprint.ndarray_fingerprint(changed), fingerprint.ndarray_fingerprint(times))
+
+    def test_canonical(self):
+        self.assertEqual(fingerprint.canonical_fingerprint({'a': 1, 'b': [1, 2]}),
+                         fingerprint.canonical_fingerprint({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(fingerprint.canonical_fingerprint({'a': 1}),
+                            fingerprint.canonical_fingerprint({'a': 2}))
+
+
+if __name__ == '__main__':
+    unittest.main()
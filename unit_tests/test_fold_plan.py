@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+# The dsbox dependencies are only installed in the docker image
+try:
+    import numpy as np
+    from dsbox.template import fold_plan
+except ImportError:
+    fold_plan = None
+
+
+@unittest.skipUnless(fold_plan, 'dsbox dependencies are not installed')
+class TestFoldPlan(unittest.TestCase):
+
+    def _assert_partition(self, plan, n_rows):
+        tests = np.concatenate([test for _, test in plan])
+        self.assertEqual(sorted(tests.tolist()), list(range(n_rows)))
+        for train, test in plan:
+            self.assertEqual(len(np.intersect1d(train, test)), 0)
+            self.assertEqual(len(train) + len(test), n_rows)
+
+    def test_stratified(self):
+        targets = np.array(['a', 'b'] * 10)
+        plan = fold_plan.compute_fold_plan(targets, 5, True, seed=1)
+        self.assertTrue(plan.is_stratified)
+        self.assertEqual(len(plan), 5)
+        self._assert_partition(plan, 20)
+        for _, test in plan:
+            self.assertEqual(sorted(targets[test].tolist()), ['a', 'a', 'b', 'b'])
+
+    def test_stratified_fallback(self):
+        # Every class is smaller than the number of folds
+        targets = np.array(['a', 'b', 'c', 'd', 'e', 'f'])
+        plan = fold_plan.compute_fold_plan(targets.reshape(-1, 1), 3, True, seed=1)
+        self.assertTrue(plan.stratified)
+        self.assertFalse(plan.is_stratified)
+        self.assertEqual(len(plan), 3)
+        self._assert_partition(plan, 6)
+        targets_fingerprint = fold_plan.target_order_fingerprint(targets)
+        self.assertTrue(plan.matches(6, 3, True, 1, targets_fingerprint))
+        self.assertFalse(plan.matches(7, 3, True, 1, targets_fingerprint))
+
+    def test_target_order(self):
+        targets = np.array(['a', 'b', 'b'] * 10)
+        plan = fold_plan.compute_fold_plan(targets, 5, True, seed=1)
+        # Same classes, encoded differently
+        codes = np.array([3, 1, 1] * 10)
+        self.assertTrue(plan.matches(30, 5, True, 1, fold_plan.target_order_fingerprint(codes)))
+        # Rows reordered by a step of the pipeline
+        reordered = np.sort(targets)
+        self.assertFalse(plan.matches(30, 5, True, 1, fold_plan.target_order_fingerprint(reordered)))
+        # Plain folds only depend on the number of rows
+        plain = fold_plan.compute_fold_plan(targets, 5, False, seed=1)
+        self.assertTrue(plain.matches(30, 5, False, 1))
+
+    def test_deterministic(self):
+        targets = np.arange(30) % 3
+        first = fold_plan.compute_fold_plan(targets, 3, False, seed=7)
+        second = fold_plan.compute_fold_plan(targets, 3, False, seed=7)
+        for (train1, test1), (train2, test2) in zip(first, second):
+            np.testing.assert_array_equal(train1, train2)
+            np.testing.assert_array_equal(test1, test2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+# The dsbox dependencies are only installed in the docker image
+try:
+    from dsbox.JobManager.cache import CacheManager, CacheValidationPolicy, DummyManager, PrimitivesCache
+except ImportError:
+    PrimitivesCache = None
+
+PRIM_NAME = 'd3m.primitives.data_cleaning.imputer.SKlearn'
+
+
+@unittest.skipUnless(PrimitivesCache, 'dsbox dependencies are not installed')
+class TestDummyManagerCache(unittest.TestCase):
+    '''
+    Caches of the serial searches and of Runtime.fit, without multiprocessing manager
+    '''
+    def test_push_lookup(self):
+        cache = PrimitivesCache(DummyManager())
+        model = {'weights': [1, 2, 3]}
+        self.assertEqual(cache.push_key('hash', PRIM_NAME, model, 5), PrimitivesCache.PUSHED)
+        self.assertTrue(cache.is_hit_key('hash', PRIM_NAME))
+        self.assertEqual(cache.lookup_key('hash', PRIM_NAME), (5, model))
+        self.assertEqual(cache.push_key('hash', PRIM_NAME, model, 5), PrimitivesCache.DOUBLE_PUSH)
+        self.assertEqual(cache.lookup_key('other', PRIM_NAME), (None, None))
+
+        cache.remove_primitive(PRIM_NAME)
+        self.assertFalse(cache.is_hit_key('hash', PRIM_NAME))
+
+    def test_clear(self):
+        cache = CacheManager(is_multiprocessing=False).primitive_cache
+        cache.push_key('hash', PRIM_NAME, 'model', 1)
+        cache.clear()
+        self.assertFalse(cache.is_hit_key('hash', PRIM_NAME))
+
+    def test_validation(self):
+        cache = PrimitivesCache(DummyManager())
+        for _ in range(CacheValidationPolicy.MIN_VALIDATIONS):
+            cache.record_validation(PRIM_NAME, True)
+        self.assertEqual(cache.validation.trust_score(PRIM_NAME), CacheValidationPolicy.MIN_VALIDATIONS)
+
+        cache.push_key('hash', PRIM_NAME, 'model', 1)
+        cache.record_validation(PRIM_NAME, False, 'outputs differ')
+        self.assertEqual(cache.validation.trust_score(PRIM_NAME), -1)
+        self.assertFalse(cache.is_hit_key('hash', PRIM_NAME))
+        self.assertEqual(cache.push_key('hash', PRIM_NAME, 'model', 1), PrimitivesCache.DO_NOT_CACHE)
+
+
+if __name__ == '__main__':
+    unittest.main()
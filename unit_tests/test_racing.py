@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+# The dsbox dependencies are only installed in the docker image
+try:
+    from d3m.metadata.problem import PerformanceMetric
+    from dsbox.template import racing
+except ImportError:
+    racing = None
+
+DATASET = 'dataset-fingerprint'
+
+
+@unittest.skipUnless(racing, 'dsbox dependencies are not installed')
+class TestFoldRace(unittest.TestCase):
+
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        self.previous_local_dir = os.environ.get('D3MLOCALDIR')
+        os.environ['D3MLOCALDIR'] = self.local_dir
+        racing.enable(True)
+
+    def tearDown(self):
+        racing.publish_incumbent({})
+        racing.enable(False)
+        if self.previous_local_dir is None:
+            os.environ.pop('D3MLOCALDIR', None)
+        else:
+            os.environ['D3MLOCALDIR'] = self.previous_local_dir
+        shutil.rmtree(self.local_dir, ignore_errors=True)
+
+    @staticmethod
+    def _race(metric, values, n_folds=10, dataset=DATASET):
+        race = racing.FoldRace(n_folds, dataset)
+        for value in values:
+            race.add([{'metric': metric, 'value': value}])
+        return race
+
+    def test_larger_is_better(self):
+        metric = PerformanceMetric.ACCURACY
+        racing.publish_incumbent({(DATASET, metric): 0.9})
+        race = self._race(metric, [0.50, 0.52, 0.48])
+        self.assertTrue(race.is_hopeless())
+        evidence = race.evidence()
+        self.assertEqual(evidence['incumbent'], 0.9)
+        self.assertEqual(evidence['folds_run'], 3)
+        self.assertLess(evidence['bound'], 0.9)
+        self.assertFalse(self._race(metric, [0.95, 0.97, 0.93]).is_hopeless())
+
+    def test_smaller_is_better(self):
+        metric = PerformanceMetric.MEAN_SQUARED_ERROR
+        racing.publish_incumbent({(DATASET, metric): 1.0})
+        self.assertTrue(self._race(metric, [5.0, 5.2, 4.8]).is_hopeless())
+        self.assertFalse(self._race(metric, [0.5, 0.6, 0.4]).is_hopeless())
+
+    def test_not_raced(self):
+        metric = PerformanceMetric.ACCURACY
+        racing.publish_incumbent({(DATASET, metric): 0.9})
+        # Too few folds to bound the mean
+        self.assertFalse(self._race(metric, [0.1]).is_hopeless())
+        # All the folds ran already
+        self.assertFalse(self._race(metric, [0.1, 0.2, 0.1], n_folds=3).is_hopeless())
+        # The incumbent of another dataset, or racing off for this cross-validation
+        self.assertFalse(self._race(metric, [0.1, 0.2, 0.1], dataset='other').is_hopeless())
+        self.assertFalse(self._race(metric, [0.1, 0.2, 0.1], dataset=None).is_hopeless())
+        # Without incumbent
+        racing.publish_incumbent({})
+        self.assertFalse(self._race(metric, [0.1, 0.2, 0.1]).is_hopeless())
+
+
+if __name__ == '__main__':
+    unittest.main()
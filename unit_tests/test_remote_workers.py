@@ -0,0 +1,108 @@
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from multiprocessing import current_process
+
+UNIT_TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.join(os.path.dirname(UNIT_TESTS_DIR), 'python')
+sys.path.insert(0, PYTHON_DIR)
+
+# The dsbox dependencies are only installed in the docker image, the remote workers need them as well
+try:
+    from dsbox.JobManager.DistributedJobManager import DistributedJobManager, JobStatus, JOB_ID, JOB_STATUS
+    from dsbox.controller.config import JobSetting
+except ImportError:
+    DistributedJobManager = None
+
+AUTHKEY = 'unit-test'
+DATASET_NAME = 'train_dataset1'
+
+
+class EchoJob:
+    '''
+    Trivial job, run by the remote workers
+    '''
+    def run(self, args):
+        value, = args
+        dataset_path = os.path.join(os.environ['D3MLOCALDIR'], DATASET_NAME + '.pkl')
+        with open(dataset_path, 'rb') as fd:
+            dataset = pickle.load(fd)
+        return {'id': value, 'value': value * 2, 'dataset': dataset, 'worker': current_process().name}
+
+
+@unittest.skipUnless(DistributedJobManager, 'dsbox dependencies are not installed')
+class TestRemoteWorkers(unittest.TestCase):
+    '''
+    SocketBackend on localhost, with two remote_worker processes
+    '''
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp(prefix='dsbox_coordinator_')
+        self.previous_local_dir = os.environ.get('D3MLOCALDIR')
+        os.environ['D3MLOCALDIR'] = self.local_dir
+        with open(os.path.join(self.local_dir, DATASET_NAME + '.pkl'), 'wb') as out:
+            pickle.dump({'rows': 3}, out)
+
+        DistributedJobManager.job_setting = JobSetting(
+            executor='socket', executor_address='127.0.0.1:0', executor_authkey=AUTHKEY, warm_workers=False)
+        # No local workers, every job has to go to the remote ones
+        self.job_manager = DistributedJobManager(proc_num=0)
+        port = self.job_manager.backend.address[1]
+        env = dict(os.environ)
+        # The remote workers unpickle EchoJob
+        env['PYTHONPATH'] = os.pathsep.join(
+            [PYTHON_DIR, UNIT_TESTS_DIR, os.path.dirname(UNIT_TESTS_DIR), env.get('PYTHONPATH', '')])
+        self.remote_dirs = [tempfile.mkdtemp(prefix='dsbox_remote_') for _ in range(2)]
+        self.remotes = [
+            subprocess.Popen([sys.executable, '-m', 'dsbox.JobManager.remote_worker', f'127.0.0.1:{port}',
+                              '--authkey', AUTHKEY, '--processes', '1', '--local-dir', remote_dir],
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for remote_dir in self.remote_dirs]
+
+    def tearDown(self):
+        self.job_manager.kill_job_manager()
+        for remote in self.remotes:
+            try:
+                remote.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                remote.kill()
+        for directory in [self.local_dir] + self.remote_dirs:
+            shutil.rmtree(directory, ignore_errors=True)
+        if self.previous_local_dir is None:
+            os.environ.pop('D3MLOCALDIR', None)
+        else:
+            os.environ['D3MLOCALDIR'] = self.previous_local_dir
+
+    def _wait_for_remote_workers(self, count, timeout=60):
+        deadline = time.time() + timeout
+        while len(self.job_manager.backend.remote_workers()) < count:
+            self.assertLess(time.time(), deadline, 'Remote workers did not register')
+            time.sleep(0.2)
+
+    def test_jobs_run_on_remote_workers(self):
+        self._wait_for_remote_workers(2)
+        self.assertEqual(self.job_manager.capacity, 2)
+
+        job_ids = [self.job_manager.push_job({'target_obj': EchoJob(), 'target_method': 'run',
+                                              'kwargs': {'args': (value,)}})
+                   for value in range(4)]
+        results = {}
+        while len(results) < len(job_ids):
+            kwargs, result = self.job_manager.pop_job(block=True, timeout=60)
+            self.assertEqual(kwargs[JOB_STATUS], JobStatus.DONE)
+            results[kwargs[JOB_ID]] = result
+
+        for value, job_id in enumerate(job_ids):
+            self.assertEqual(results[job_id]['value'], value * 2)
+            # Fetched from the coordinator
+            self.assertEqual(results[job_id]['dataset'], {'rows': 3})
+            self.assertTrue(results[job_id]['worker'].startswith('Remote-'))
+
+
+if __name__ == '__main__':
+    unittest.main()
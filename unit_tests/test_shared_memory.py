@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+# The dsbox dependencies are only installed in the docker image
+try:
+    import numpy as np
+    import pandas as pd
+    from dsbox.JobManager import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+def _frame(rows=1000):
+    return pd.DataFrame({
+        'int': np.arange(rows, dtype=np.int64),
+        'float': np.linspace(0, 1, rows),
+        'time': pd.date_range('2020-01-01', periods=rows, freq='D'),
+        'delta': pd.to_timedelta(np.arange(rows), unit='s'),
+        'text': [f'row {i}' for i in range(rows)],
+    }, index=pd.RangeIndex(rows) + 10)
+
+
+@unittest.skipUnless(shared_memory, 'dsbox dependencies are not installed')
+class TestSharedMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_share_round_trip(self):
+        frame = _frame()
+        handle = shared_memory.share(frame, path=os.path.join(self.directory, 'frame.seg'), min_bytes=0)
+        self.assertIsInstance(handle, shared_memory.SegmentHandle)
+        try:
+            attached = shared_memory.attach(handle)
+            pd.testing.assert_frame_equal(attached, frame)
+            # Copy-on-write, the segment keeps its values
+            attached.iloc[0, 0] = -1
+            pd.testing.assert_frame_equal(shared_memory.attach(handle), frame)
+        finally:
+            shared_memory.release(handle)
+        self.assertFalse(os.path.exists(handle.path))
+
+    def test_share_ndarray_round_trip(self):
+        array = np.arange('2020-01-01', '2020-03-01', dtype='datetime64[D]')
+        handle = shared_memory.share(array, path=os.path.join(self.directory, 'array.seg'), min_bytes=0)
+        self.assertIsInstance(handle, shared_memory.SegmentHandle)
+        try:
+            np.testing.assert_array_equal(shared_memory.attach(handle), array)
+        finally:
+            shared_memory.release(handle)
+
+    def test_share_small_value(self):
+        frame = _frame(rows=2)
+        self.assertIs(shared_memory.share(frame, path=os.path.join(self.directory, 'small.seg')), frame)
+
+    def test_columns_round_trip(self):
+        value = {'frame': _frame(), 'array': np.arange(12.0).reshape(3, 4)}
+        handle = shared_memory.save_columns(value, os.path.join(self.directory, 'value.columns'))
+        self.assertIsInstance(handle, shared_memory.ColumnsHandle)
+        attached = shared_memory.attach(handle)
+        pd.testing.assert_frame_equal(attached['frame'], value['frame'])
+        np.testing.assert_array_equal(attached['array'], value['array'])
+        shared_memory.release(handle)
+        self.assertFalse(os.path.exists(handle.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()